@@ -1,49 +1,128 @@
+import re
 import tkinter as tk
-from tkinter import messagebox
-
-def calcular_ratios():
-    try:
-        activos_corrientes = float(entry_activos_corrientes.get())
-        pasivos_corrientes = float(entry_pasivos_corrientes.get())
-        pasivos_totales = float(entry_pasivos_totales.get())
-        patrimonio_neto = float(entry_patrimonio_neto.get())
-        
-        # Calcular ratio de liquidez
-        ratio_liquidez = activos_corrientes / pasivos_corrientes
-        
-        # Calcular ratio de endeudamiento
-        ratio_endeudamiento = pasivos_totales / (patrimonio_neto + pasivos_totales)
-        
-        resultado = f"Ratio de liquidez: {ratio_liquidez:.2f}\n"
-        resultado += f"Ratio de endeudamiento: {ratio_endeudamiento:.2f}"
-        
-        messagebox.showinfo("Resultados", resultado)
-    except ValueError:
-        messagebox.showerror("Error", "Por favor ingrese valores numéricos válidos")
+from tkinter import ttk, messagebox
+
+import numpy as np
+
+from panda import calcular_ratios_vectorizado, CAMPOS_ENTRADA, GrillaVirtual, fmt_num
+
+# Columnas de la tabla pegada (en este orden; opcionalmente precedidas por el nombre)
+COLUMNAS_ENTRADA = ["activos_corrientes", "pasivos_corrientes", "pasivos_totales", "patrimonio_neto"]
+
+def calcular_ratios_tabla(ac, pc, pasivo_total, pn):
+    """
+    Liquidez y endeudamiento de muchas filas en una sola llamada al motor de panda.
+    Pasivo No Corriente = Pasivo Total - Pasivo Corriente. Divisiones por cero -> NaN.
+    """
+    n = len(ac)
+    t = {k: np.zeros(n) for k in CAMPOS_ENTRADA}
+    t["i"] = np.full(n, 0.05)
+    t["activo_corriente"] = np.asarray(ac, dtype=float)
+    t["pasivo_corriente"] = np.asarray(pc, dtype=float)
+    t["pasivo_no_corriente"] = np.asarray(pasivo_total, dtype=float) - t["pasivo_corriente"]
+    t["patrimonio_neto"] = np.asarray(pn, dtype=float)
+    r = calcular_ratios_vectorizado(t)
+    return r["Liquidez General"], r["Endeudamiento"]
 
-# Configurar ventana principal
-ventana = tk.Tk()
-ventana.title("Calculadora Ratios Financieros")
+# '3.800' o '1.234.567': punto de miles sin coma decimal (formato local)
+_MILES_CON_PUNTO = re.compile(r"[-+]?[1-9]\d{0,2}(\.\d{3})+")
 
-# Entradas de datos
-tk.Label(ventana, text="Activos Corrientes:").grid(row=0, column=0)
-entry_activos_corrientes = tk.Entry(ventana)
-entry_activos_corrientes.grid(row=0, column=1)
+def _a_numero(celda):
+    """
+    Acepta '3800', '3800.5', '3.800,50', '3800,5' o '3.800' (formato local).
+    Un punto seguido de exactamente tres dígitos sin coma es separador de miles.
+    """
+    celda = celda.strip().replace(" ", "")
+    if "," in celda:
+        celda = celda.replace(".", "").replace(",", ".")
+    elif _MILES_CON_PUNTO.fullmatch(celda):
+        celda = celda.replace(".", "")
+    return float(celda)
 
-tk.Label(ventana, text="Pasivos Corrientes:").grid(row=1, column=0)
-entry_pasivos_corrientes = tk.Entry(ventana)
-entry_pasivos_corrientes.grid(row=1, column=1)
+def parsear_tabla(texto):
+    """
+    Convierte el texto pegado (desde Excel: tabuladores; también ';' o espacios)
+    en nombres + matriz N x 4. Las filas con errores se devuelven aparte y la
+    primera fila se ignora si es una cabecera no numérica.
+    """
+    lineas = [l for l in texto.splitlines() if l.strip()]
+    sep = "\t" if "\t" in texto else (";" if ";" in texto else None)
+    nombres, valores, errores = [], [], []
+    for num, linea in enumerate(lineas, start=1):
+        celdas = linea.split(sep) if sep else re.split(r"\s+", linea.strip())
+        celdas = [c for c in celdas if c.strip() != ""]
+        nombre = None
+        if len(celdas) == 5:
+            nombre, celdas = celdas[0].strip(), celdas[1:]
+        try:
+            if len(celdas) != 4:
+                raise ValueError
+            fila = [_a_numero(c) for c in celdas]
+        except ValueError:
+            if num > 1 or valores:
+                errores.append(num)
+            continue
+        nombres.append(nombre or f"Fila {num}")
+        valores.append(fila)
+    matriz = np.array(valores, dtype=float).reshape(-1, 4)
+    return nombres, matriz, errores
 
-tk.Label(ventana, text="Pasivos Totales:").grid(row=2, column=0)
-entry_pasivos_totales = tk.Entry(ventana)
-entry_pasivos_totales.grid(row=2, column=1)
+class CalculadoraRatios(tk.Tk):
+    def __init__(self):
+        super().__init__()
+        self.title("Calculadora Ratios Financieros")
+        self.geometry("900x650")
 
-tk.Label(ventana, text="Patrimonio Neto:").grid(row=3, column=0)
-entry_patrimonio_neto = tk.Entry(ventana)
-entry_patrimonio_neto.grid(row=3, column=1)
+        # Entradas de datos (una empresa)
+        frm = ttk.Frame(self, padding=8)
+        frm.pack(fill="x")
+        self.entries = {}
+        etiquetas = ["Activos Corrientes:", "Pasivos Corrientes:", "Pasivos Totales:", "Patrimonio Neto:"]
+        for fila, (clave, texto) in enumerate(zip(COLUMNAS_ENTRADA, etiquetas)):
+            ttk.Label(frm, text=texto).grid(row=fila, column=0, sticky="w")
+            self.entries[clave] = ttk.Entry(frm)
+            self.entries[clave].grid(row=fila, column=1)
+        ttk.Button(frm, text="Calcular Ratios", command=self.calcular_ratios).grid(row=4, columnspan=2, pady=4)
+
+        # Modo tabla: pegar muchas filas
+        ttk.Label(self, text="Pegar tabla (AC, PC, Pasivo Total, PN; opcionalmente con el nombre en la primera columna):").pack(anchor="w", padx=8)
+        self.texto = tk.Text(self, height=6, width=100)
+        self.texto.pack(fill="x", padx=8)
+        ttk.Button(self, text="Evaluar tabla", command=self.evaluar_tabla).pack(pady=4)
+        self.estado = ttk.Label(self, text="")
+        self.estado.pack(anchor="w", padx=8)
+
+        columnas = [("fila", "#", 50), ("empresa", "Empresa", 200), ("ac", "AC", 90), ("pc", "PC", 90),
+                    ("pt", "Pasivo Total", 100), ("pn", "PN", 90), ("liquidez", "Liquidez", 80), ("endeudamiento", "Endeudamiento", 100)]
+        self.grilla = GrillaVirtual(self, columnas, filas_visibles=15, formato={"fila": lambda v: str(int(v))})
+        self.grilla.pack(fill="both", expand=True, padx=8, pady=8)
+
+    def calcular_ratios(self):
+        try:
+            valores = [_a_numero(self.entries[k].get()) for k in COLUMNAS_ENTRADA]
+        except ValueError:
+            messagebox.showerror("Error", "Por favor ingrese valores numéricos válidos")
+            return
+        liq, end = calcular_ratios_tabla(*[[v] for v in valores])
+        resultado = f"Ratio de liquidez: {fmt_num(None if np.isnan(liq[0]) else liq[0])}\n"
+        resultado += f"Ratio de endeudamiento: {fmt_num(None if np.isnan(end[0]) else end[0])}"
+        messagebox.showinfo("Resultados", resultado)
 
-# Botón para calcular
-boton_calcular = tk.Button(ventana, text="Calcular Ratios", command=calcular_ratios)
-boton_calcular.grid(row=4, columnspan=2)
+    def evaluar_tabla(self):
+        nombres, m, errores = parsear_tabla(self.texto.get("1.0", tk.END))
+        if not len(m):
+            messagebox.showerror("Error", "No se encontraron filas con 4 valores numéricos.")
+            return
+        liq, end = calcular_ratios_tabla(m[:, 0], m[:, 1], m[:, 2], m[:, 3])
+        self.grilla.cargar({
+            "fila": np.arange(1, len(m) + 1), "empresa": np.array(nombres, dtype=object),
+            "ac": m[:, 0], "pc": m[:, 1], "pt": m[:, 2], "pn": m[:, 3],
+            "liquidez": liq, "endeudamiento": end,
+        })
+        msg = f"{len(m)} filas evaluadas."
+        if errores:
+            msg += f" Filas ignoradas por formato: {', '.join(map(str, errores[:10]))}{'…' if len(errores) > 10 else ''}"
+        self.estado.config(text=msg)
 
-ventana.mainloop()
+if __name__ == "__main__":
+    CalculadoraRatios().mainloop()
@@ -0,0 +1,457 @@
+# benchmarks.py
+# Mediciones de rendimiento y prueba de resistencia de panda, separadas del
+# módulo de la interfaz. Cada función devuelve un dict (tiempos, tamaños, RSS).
+# Las que no piden argumentos se pueden lanzar desde la línea de órdenes:
+#
+#   python benchmarks.py registro atipicos prueba_resistencia
+#
+# (las que usan procesos, como benchmark_arranque, necesitan ese __main__)
+import os
+import gc
+import json
+import time
+import inspect
+import datetime
+import argparse
+import logging
+from io import BytesIO
+
+import numpy as np
+
+from panda import (BLOQUE_XLSX, CAMPOS_ENTRADA, CUENTAS_MONITOR, FACTORES_DUPONT, FormatoJSON,
+    InformeBorrador, MonitorRatios, _div, atipicos_sector, atribucion_dupont, calcular_ratios_from_inputs,
+    calcular_ratios_vectorizado, clasificar_cce_vectorizado, clasificar_situacion_vectorizado,
+    comparar_instantaneas, compilar_modelo_alerta, compilar_registro, configurar_registro, convertir_tabla,
+    crear_pool_precalentado, detener_registro, exportar_xlsx, generar_lote_pdf, generar_pdf_final,
+    memoria_rss_mb, preparar_ipc, preparar_secciones, preparar_tipos_cambio, proyectar_balances,
+    puntuar_cartera, reproducir_movimientos, resumen_cambios, validar_tabla)
+
+# -----------------------------
+# Registro de diagnóstico (JSON por cola, escritura en segundo plano)
+# -----------------------------
+
+def benchmark_diagnosticos(r23, r24, carpeta, repeticiones=5, fecha=None):
+    """
+    Informes por segundo sin registro, con registro DEBUG por cola y con el
+    equivalente síncrono (FileHandler en el hilo que dibuja), para comprobar
+    que dejar los diagnósticos activos no frena el lote.
+    """
+    fecha = fecha or datetime.date(2000, 1, 1)
+    secciones = preparar_secciones(r23, r24, fecha=fecha)
+    def mejor():
+        tiempos = []
+        for _ in range(repeticiones):
+            t0 = time.perf_counter()
+            generar_pdf_final(r23, r24, filename=BytesIO(), secciones=secciones, fecha=fecha, reproducible=True)
+            tiempos.append(time.perf_counter() - t0)
+        return min(tiempos)
+    res = {"sin_registro_s": mejor()}
+    configurar_registro(os.path.join(carpeta, "cola.log"))
+    try:
+        res["cola_s"] = mejor()
+    finally:
+        detener_registro()
+    raiz = logging.getLogger("panda")
+    sincrono = logging.FileHandler(os.path.join(carpeta, "sincrono.log"), encoding="utf-8")
+    sincrono.setFormatter(FormatoJSON())
+    raiz.addHandler(sincrono); raiz.setLevel(logging.DEBUG)
+    try:
+        res["sincrono_s"] = mejor()
+    finally:
+        raiz.removeHandler(sincrono); raiz.setLevel(logging.NOTSET); sincrono.close()
+    res["sobrecoste_cola"] = res["cola_s"] / res["sin_registro_s"] - 1
+    res["sobrecoste_sincrono"] = res["sincrono_s"] / res["sin_registro_s"] - 1
+    return res
+
+# -----------------------------
+# Registro declarativo de ratios
+# -----------------------------
+
+def _ratios_numpy_manual(t):
+    """Referencia escrita a mano (solo para benchmark_registro)."""
+    AC = t["activo_corriente"]; ANC = t["activo_no_corriente"]; PC = t["pasivo_corriente"]; PNC = t["pasivo_no_corriente"]
+    PN = t["patrimonio_neto"]; Caja = t["caja"]; Deudores = t["deudores"]; GFin = t["gastos_financieros"]
+    Activo = AC + ANC; Pasivo = PC + PNC; BAII = t["ventas"] - t["costo_ventas"]
+    i = np.where(Pasivo != 0, _div(GFin, Pasivo), 0.0)
+    RAT = _div(BAII, Activo); RAT0 = np.nan_to_num(RAT)
+    efecto = _div(Pasivo, PN) * (RAT0 - i)
+    return {
+        "Costo Deuda (i)": i, "Fondo Maniobra": AC - PC, "Fondo Maniobra Alternativo": PN + PNC - ANC,
+        "Liquidez General": _div(AC, PC), "Tesorería": _div(Caja + Deudores, PC), "Disponibilidad": _div(Caja, PC),
+        "Garantía": _div(Activo, Pasivo), "Autonomía": _div(PN, Pasivo), "Calidad Deuda": _div(PC, Pasivo),
+        "RAT": RAT, "RRP": _div(t["beneficio_neto"], PN), "RRP Apalancada": RAT0 + efecto, "Efecto Apalancamiento": efecto,
+        "Margen Neto": _div(t["beneficio_neto"], t["ventas"]), "Rotación Activo": _div(t["ventas"], Activo), "Multiplicador Capital": _div(Activo, PN),
+    }
+
+def benchmark_registro(n=1_000_000, repeticiones=5, semilla=0):
+    """Compara el kernel compilado del registro con NumPy escrito a mano (mejor de N, en segundos)."""
+    rng = np.random.default_rng(semilla)
+    t = {k: rng.uniform(0.0, 1000.0, n) for k in CAMPOS_ENTRADA}
+    kernel = compilar_registro()
+    tiempos = {}
+    for nombre, f in (("registro", kernel), ("manual", _ratios_numpy_manual)):
+        mejor = float("inf")
+        for _ in range(repeticiones):
+            t0 = time.perf_counter(); f(t); mejor = min(mejor, time.perf_counter() - t0)
+        tiempos[nombre] = mejor
+    tiempos["relacion"] = tiempos["registro"] / tiempos["manual"]
+    return tiempos
+
+# -----------------------------
+# Diferencias entre instantáneas (ejecución anterior vs actual)
+# -----------------------------
+
+def benchmark_diferencias(n=1_000_000, repeticiones=3, semilla=0):
+    """Tiempo de comparar_instantaneas entre dos carteras en memoria que comparten el 95% de empresas."""
+    rng = np.random.default_rng(semilla)
+    t = {k: rng.uniform(0.0, 1000.0, n) for k in CAMPOS_ENTRADA}
+    t["i"] = rng.uniform(0.0, 0.2, n)
+    claves = np.char.add("E", np.arange(n).astype(str))
+    def instantanea(t, claves):
+        rv = calcular_ratios_vectorizado(t)
+        _, cce_codigo = clasificar_cce_vectorizado(rv)
+        d = {k: v for k, v in rv.items() if not k.startswith("_")}
+        d.update(empresa=claves, situacion_codigo=clasificar_situacion_vectorizado(rv), cce_codigo=cce_codigo)
+        return d
+    anterior = instantanea(t, claves)
+    t2 = {k: v * rng.normal(1.0, 0.05, n) for k, v in t.items()}
+    sel = np.sort(rng.permutation(n)[: n * 95 // 100])
+    actual = instantanea({k: v[sel] for k, v in t2.items()}, claves[sel][::-1].copy())
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter(); dif = comparar_instantaneas(anterior, actual); tiempos.append(time.perf_counter() - t0)
+    return {"filas": n, "diferencias_s": min(tiempos), "cambios": resumen_cambios(dif)}
+
+# -----------------------------
+# Monitor continuo de ratios (movimientos de mayor)
+# -----------------------------
+
+def benchmark_monitor(n=1_000_000, ruta=None, semilla=0):
+    """Genera (si hace falta) un archivo de n movimientos y mide eventos/segundo al reproducirlo."""
+    import tempfile
+    rng = np.random.default_rng(semilla)
+    temporal = ruta is None
+    if temporal:
+        fd, ruta = tempfile.mkstemp(suffix=".csv"); os.close(fd)
+    try:
+        if temporal:
+            cuentas = np.array(CUENTAS_MONITOR)[rng.integers(0, len(CUENTAS_MONITOR), n)]
+            importes = np.round(rng.normal(0, 50, n), 2)
+            # Dos años de movimientos en orden de fecha
+            fechas = (np.datetime64("2025-01-01") + np.arange(n) * 730 // max(n, 1)).astype(str)
+            with open(ruta, "w", encoding="utf-8") as f:
+                f.write("marca,cuenta,importe\n")
+                f.writelines(f"{d},{c},{v}\n" for d, c, v in zip(fechas, cuentas, importes))
+        base = {"_Caja": 1100.0, "_Deudores": 1600.0, "_Inventario": 500.0, "_AC": 3800.0, "_PC": 1000.0, "_PNC": 1000.0,
+                "_Ventas": 1500.0, "_Costo": 600.0, "_dias_proveedores": 30.0}
+        monitor = MonitorRatios(base)
+        t0 = time.perf_counter()
+        eventos = reproducir_movimientos(ruta, monitor)
+        dt = time.perf_counter() - t0
+        return {"eventos": eventos, "segundos": dt, "eventos_por_segundo": eventos / dt, "alertas": len(monitor.alertas)}
+    finally:
+        if temporal:
+            os.remove(ruta)
+
+# -----------------------------
+# Validación y normalización de entradas
+# -----------------------------
+
+def benchmark_validacion(n=1_000_000, repeticiones=5, semilla=0):
+    """Compara el coste de validar_tabla con el del cálculo de ratios sobre la misma tabla."""
+    rng = np.random.default_rng(semilla)
+    t = {k: rng.uniform(0.0, 1000.0, n) for k in CAMPOS_ENTRADA}
+    t["i"] = rng.uniform(0.0, 0.2, n)
+    t["patrimonio_neto"] = t["activo_corriente"] + t["activo_no_corriente"] - t["pasivo_corriente"] - t["pasivo_no_corriente"]
+    t["activo_corriente"][rng.integers(0, n, n // 100)] = np.nan
+    def mejor(f):
+        tiempos = []
+        for _ in range(repeticiones):
+            t0 = time.perf_counter(); f(t); tiempos.append(time.perf_counter() - t0)
+        return min(tiempos)
+    t_val = mejor(validar_tabla); t_rat = mejor(calcular_ratios_vectorizado)
+    return {"filas": n, "validacion_s": t_val, "ratios_s": t_rat, "proporcion": t_val / t_rat}
+
+# -----------------------------
+# Conversión de moneda y precios constantes
+# -----------------------------
+
+def benchmark_conversion(n=1_000_000, repeticiones=5, semilla=0):
+    """Coste de convertir_tabla (tipo diario + IPC mensual) frente al cálculo de ratios."""
+    rng = np.random.default_rng(semilla)
+    t = {k: rng.uniform(0.0, 1000.0, n) for k in CAMPOS_ENTRADA}
+    t["i"] = rng.uniform(0.0, 0.2, n)
+    dias = np.arange("2023-01-01", "2025-01-01", dtype="datetime64[D]")
+    cot = {m: (dias, rng.uniform(0.5, 10.0, len(dias))) for m in ("BOB", "ARS", "PEN", "EUR")}
+    tipos = preparar_tipos_cambio(cot)
+    meses = np.arange("2023-01", "2025-01", dtype="datetime64[M]").astype("datetime64[D]")
+    ipc = preparar_ipc(meses, np.cumprod(rng.uniform(1.0, 1.02, len(meses))) * 100)
+    monedas = np.array(["BOB", "ARS", "PEN", "EUR", "USD"])[rng.integers(0, 5, n)]
+    fechas = dias[rng.integers(0, len(dias), n)]
+    def mejor(f):
+        tiempos = []
+        for _ in range(repeticiones):
+            t0 = time.perf_counter(); f(); tiempos.append(time.perf_counter() - t0)
+        return min(tiempos)
+    t_conv = mejor(lambda: convertir_tabla(t, monedas, fechas, tipos, "BOB", ipc))
+    t_rat = mejor(lambda: calcular_ratios_vectorizado(t))
+    return {"filas": n, "conversion_s": t_conv, "ratios_s": t_rat, "proporcion": t_conv / t_rat}
+
+# -----------------------------
+# Proyección plurianual de balances (escenarios)
+# -----------------------------
+
+def benchmark_proyeccion(empresas=10_000, escenarios=10, anios=10, repeticiones=3, semilla=0):
+    """Tiempo de proyectar_balances para empresas x escenarios x años celdas (mejor de `repeticiones`)."""
+    rng = np.random.default_rng(semilla)
+    t = {k: rng.uniform(100.0, 5000.0, empresas) for k in CAMPOS_ENTRADA}
+    t["i"] = rng.uniform(0.02, 0.10, empresas)
+    for k in ("dias_inventario", "dias_clientes", "dias_proveedores"):
+        t[k] = rng.uniform(15.0, 90.0, empresas)
+    escs = {f"E{s}": {"crecimiento_ventas": rng.uniform(-0.1, 0.15, anios).tolist(),
+                      "dias_clientes": None if s % 2 else float(rng.uniform(30, 90)),
+                      "amortizacion_deuda": 0.1} for s in range(escenarios)}
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter(); proyectar_balances(t, escs, anios=anios); tiempos.append(time.perf_counter() - t0)
+    celdas = empresas * escenarios * anios
+    return {"celdas": celdas, "segundos": min(tiempos), "celdas_por_s": celdas / min(tiempos)}
+
+# -----------------------------
+# Descomposición DuPont de la RRP
+# -----------------------------
+
+def benchmark_dupont(n=1_000_000, repeticiones=5, semilla=0):
+    """Tiempo de atribucion_dupont sobre n empresa-año (mejor de `repeticiones`)."""
+    rng = np.random.default_rng(semilla)
+    rv0 = {k: rng.uniform(-0.2, 3.0, n) for _, k in FACTORES_DUPONT}
+    rv1 = {k: v * rng.uniform(0.8, 1.2, n) for k, v in rv0.items()}
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter(); atribucion_dupont(rv0, rv1); tiempos.append(time.perf_counter() - t0)
+    return {"filas": n, "segundos": min(tiempos)}
+
+# -----------------------------
+# Puntuación de alerta temprana (estilo Z de Altman)
+# -----------------------------
+
+def benchmark_alerta(n=1_000_000, repeticiones=5, semilla=0):
+    """Tiempo de puntuar_cartera (componentes, Z, tramos y ranking) frente al cálculo de ratios, mejor de N."""
+    rng = np.random.default_rng(semilla)
+    t = {k: rng.uniform(0.0, 1000.0, n) for k in CAMPOS_ENTRADA}
+    t["patrimonio_neto"] = rng.uniform(-200.0, 1000.0, n)
+    def mejor(f):
+        tiempos = []
+        for _ in range(repeticiones):
+            t0 = time.perf_counter(); f(t); tiempos.append(time.perf_counter() - t0)
+        return min(tiempos)
+    compilar_modelo_alerta()
+    t_alerta = mejor(puntuar_cartera); t_rat = mejor(calcular_ratios_vectorizado)
+    return {"filas": n, "alerta_s": t_alerta, "ratios_s": t_rat, "empresas_s": n / t_alerta}
+
+# -----------------------------
+# Optimización de la salida PDF
+# -----------------------------
+
+def benchmark_salida_pdf(r23, r24, repeticiones=3, fecha=None):
+    """
+    Tamaño (KB) y tiempo (mejor de N, s) del PDF con drawImage directo
+    ("original"), con la salida optimizada y con gráficos en paleta.
+    "segundos" mide solo la escritura, con las secciones (gráficos incluidos)
+    preparadas una vez; "segundos_completo" el informe de principio a fin.
+    """
+    fecha = fecha or datetime.date(2000, 1, 1)
+    secciones = preparar_secciones(r23, r24, fecha=fecha)
+    resultados = {}
+    for nombre, opciones in (("original", {"optimizar": False}), ("optimizado", {}), ("paleta", {"paleta": True})):
+        mejor = mejor_completo = float("inf")
+        for _ in range(repeticiones):
+            buf = BytesIO()
+            t0 = time.perf_counter()
+            generar_pdf_final(r23, r24, filename=buf, secciones=secciones, fecha=fecha, reproducible=True, **opciones)
+            mejor = min(mejor, time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            generar_pdf_final(r23, r24, filename=BytesIO(), fecha=fecha, reproducible=True, **opciones)
+            mejor_completo = min(mejor_completo, time.perf_counter() - t0)
+        resultados[nombre] = {"kb": len(buf.getvalue()) / 1024, "segundos": mejor, "segundos_completo": mejor_completo}
+    return resultados
+
+# -----------------------------
+# Atípicos por sector (estadística robusta)
+# -----------------------------
+
+def benchmark_atipicos(n=1_000_000, sectores=40, repeticiones=3, semilla=0):
+    """Coste de atipicos_sector frente al cálculo de ratios sobre la misma cartera."""
+    rng = np.random.default_rng(semilla)
+    t = {k: rng.lognormal(5.0, 1.0, n) for k in CAMPOS_ENTRADA}
+    t["i"] = rng.uniform(0.0, 0.2, n)
+    sector = np.array([f"S{s:02d}" for s in range(sectores)])[rng.integers(0, sectores, n)]
+    rv = calcular_ratios_vectorizado(t)
+    def mejor(f):
+        tiempos = []
+        for _ in range(repeticiones):
+            t0 = time.perf_counter(); f(); tiempos.append(time.perf_counter() - t0)
+        return min(tiempos)
+    t_at = mejor(lambda: atipicos_sector(rv, sector))
+    t_rat = mejor(lambda: calcular_ratios_vectorizado(t))
+    return {"filas": n, "sectores": sectores, "atipicos_s": t_at, "ratios_s": t_rat, "proporcion": t_at / t_rat}
+
+# -----------------------------
+# Borrador inmediato + versión final en segundo plano
+# -----------------------------
+
+def benchmark_borrador(r23, r24, carpeta, repeticiones=3):
+    """
+    Latencias por separado: informe final completo, borrador en frío (sin
+    gráficos previos, calidad baja y marcador) y borrador tras cambiar una
+    entrada que solo afecta a un gráfico. El tiempo de borrador no incluye el
+    render final: se espera a que termine fuera de la medición.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    os.makedirs(carpeta, exist_ok=True)
+    ruta = os.path.join(carpeta, "benchmark_borrador.pdf")
+    def mejor(f):
+        tiempos = []
+        for _ in range(repeticiones):
+            t0 = time.perf_counter(); fut = f(); tiempos.append(time.perf_counter() - t0)
+            if fut is not None: fut.result()
+        return min(tiempos)
+    res = {"final_s": mejor(lambda: generar_pdf_final(r23, r24, filename=ruta))}
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        pool.submit(int).result()  # arranque del worker fuera de la medición
+        for calidad in ("baja", "marcador"):
+            res[f"borrador_{calidad}_s"] = mejor(lambda: InformeBorrador(pool, calidad).generar(r23, r24, ruta))
+        inf = InformeBorrador(pool)
+        inf.generar(r23, r24, ruta).result()
+        r24b = dict(r24, RAT=(r24.get("RAT") or 0.0) * 1.1)
+        res["borrador_incremental_s"] = mejor(lambda: inf.generar(r23, r24b, ruta))
+    return res
+
+# -----------------------------
+# Pool de procesos precalentado (servicio de informes)
+# -----------------------------
+
+def _informe_en_memoria(r23, r24):
+    buf = BytesIO()
+    generar_pdf_final(r23, r24, filename=buf, fecha=datetime.date(2000, 1, 1))
+    return len(buf.getvalue())
+
+def benchmark_arranque(informes=4, workers=2):
+    """
+    Latencia por informe enviado a un proceso nuevo (arranque en frío: importar
+    y cargar fuentes en cada uno) frente al pool precalentado, más el coste
+    único de crear ese pool.
+    """
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+    r23 = calcular_ratios_from_inputs({k: 1.0 for k in CAMPOS_ENTRADA})
+    r24 = calcular_ratios_from_inputs({k: 2.0 for k in CAMPOS_ENTRADA})
+    frio = []
+    for _ in range(informes):
+        t0 = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+            pool.submit(_informe_en_memoria, r23, r24).result()
+        frio.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    pool = crear_pool_precalentado(workers, trabajos_por_worker=max(2, informes // workers))
+    creacion = time.perf_counter() - t0
+    caliente = []
+    try:
+        for _ in range(informes):
+            t0 = time.perf_counter(); pool.submit(_informe_en_memoria, r23, r24).result(); caliente.append(time.perf_counter() - t0)
+    finally:
+        pool.shutdown()
+    return {"informe_frio_s": float(np.median(frio)), "informe_precalentado_s": float(np.median(caliente)),
+            "max_precalentado_s": max(caliente), "creacion_pool_s": creacion}
+
+# -----------------------------
+# Lotes de informes con memoria acotada
+# -----------------------------
+
+def prueba_resistencia(n=10_000, muestra_cada=100, ventana_traza=200, tolerancia_mb=20.0, semilla=0, limite_mb=None):
+    """
+    Genera n informes seguidos con generar_lote_pdf (entradas aleatorias,
+    escritos en un BytesIO que se descarta, con su techo `limite_mb`) y
+    muestrea el RSS y su pico cada `muestra_cada`.
+    Descartado el primer 10% (cachés de fuentes y de texto llenándose), la recta
+    ajustada al RSS no debe crecer más de tolerancia_mb en todo el tramo.
+    tracemalloc solo se activa en los últimos `ventana_traza` informes (ralentiza
+    mucho cada asignación): lo que crece entre el principio y el final de esa
+    ventana son las líneas de código que retienen memoria.
+    """
+    import tracemalloc
+    rng = np.random.default_rng(semilla)
+    def trabajo(j):
+        d23 = {k: float(v) for k, v in zip(CAMPOS_ENTRADA, rng.uniform(1.0, 5000.0, len(CAMPOS_ENTRADA)))}
+        d24 = {k: float(v) for k, v in zip(CAMPOS_ENTRADA, rng.uniform(1.0, 5000.0, len(CAMPOS_ENTRADA)))}
+        d23["i"] = d24["i"] = 0.05
+        return f"informe_{j}", calcular_ratios_from_inputs(d23), calcular_ratios_from_inputs(d24)
+    inicio_traza = max(0, n - ventana_traza)
+    informes, rss, picos, traza = [], [], [], []
+    inicio = None; crecen = []; liberaciones = 0
+    try:
+        for hechos in range(0, n, muestra_cada):
+            if inicio is None and hechos >= inicio_traza:
+                tracemalloc.start(); inicio = tracemalloc.take_snapshot()
+            lote = generar_lote_pdf((trabajo(j) for j in range(hechos, min(hechos + muestra_cada, n))), lambda nombre: BytesIO(),
+                                    limite_mb=limite_mb)
+            informes.append(min(hechos + muestra_cada, n)); rss.append(memoria_rss_mb())
+            picos.append(lote["rss_max_mb"]); liberaciones += lote["liberaciones"]
+            if inicio is not None:
+                traza.append(tracemalloc.get_traced_memory()[0] / 2**20)
+        if inicio is not None:
+            gc.collect()
+            crecen = [str(e) for e in tracemalloc.take_snapshot().compare_to(inicio, "lineno")[:10]]
+    finally:
+        tracemalloc.stop()
+    x = np.asarray(informes, dtype=float); y = np.asarray(rss)
+    desde = x > n // 10
+    crecimiento = 0.0
+    if desde.sum() >= 2:
+        pendiente = np.polyfit(x[desde], y[desde], 1)[0]
+        crecimiento = float(pendiente * (x[desde][-1] - x[desde][0]))
+    return {"informes": informes, "rss_mb": rss, "pico_rss_mb": picos, "tracemalloc_mb": traza, "crecimiento_rss_mb": crecimiento,
+            "estable": crecimiento <= tolerancia_mb, "liberaciones": liberaciones, "mayores_crecimientos": crecen}
+
+# -----------------------------
+# Exportación XLSX en streaming (matriz de ratios de la cartera)
+# -----------------------------
+
+def benchmark_xlsx(n=100_000, bloque=BLOQUE_XLSX, nivel_compresion=1, semilla=0):
+    """Filas por segundo de exportar_xlsx sobre una cartera aleatoria y RSS antes/después (MB)."""
+    import tempfile
+    rng = np.random.default_rng(semilla)
+    t23 = {k: rng.uniform(0.0, 5000.0, n) for k in CAMPOS_ENTRADA}
+    t24 = {k: rng.uniform(0.0, 5000.0, n) for k in CAMPOS_ENTRADA}
+    t23["i"] = t24["i"] = np.full(n, 0.05)
+    t24["activo_corriente"][rng.integers(0, n, n // 100)] = np.nan
+    empresas = np.array([f"Empresa {j}" for j in range(n)], dtype=object)
+    gc.collect()
+    rss_inicial = memoria_rss_mb()
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta = os.path.join(carpeta, "cartera.xlsx")
+        t0 = time.perf_counter()
+        exportar_xlsx(ruta, t23, t24, empresas, bloque=bloque, nivel_compresion=nivel_compresion)
+        segundos = time.perf_counter() - t0
+        tamanio = os.path.getsize(ruta) / 2**20
+    return {"filas": n, "segundos": segundos, "filas_s": n / segundos, "archivo_mb": tamanio,
+            "rss_inicial_mb": rss_inicial, "rss_final_mb": memoria_rss_mb()}
+
+# -----------------------------
+# EJECUTAR
+# -----------------------------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Ejecuta mediciones de panda sin argumentos obligatorios e imprime el resultado en JSON.")
+    ap.add_argument("nombres", nargs="+", help="nombre con o sin el prefijo benchmark_ (p. ej. registro, prueba_resistencia)")
+    args = ap.parse_args(argv)
+    for nombre in args.nombres:
+        f = globals().get(f"benchmark_{nombre}") or globals().get(nombre)
+        if not callable(f) or nombre.startswith("_"):
+            ap.error(f"medición desconocida: {nombre}")
+        obligatorios = [p.name for p in inspect.signature(f).parameters.values() if p.default is inspect.Parameter.empty]
+        if obligatorios:
+            ap.error(f"{nombre} necesita {', '.join(obligatorios)}: llamarla desde Python")
+        print(json.dumps({nombre: f()}, ensure_ascii=False, default=str))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+# lotes_distribuidos.py
+# Lote nocturno de una cartera repartido en fragmentos. Cualquier máquina que vea
+# la carpeta compartida reclama fragmentos de una cola SQLite, calcula sus ratios
+# (instantánea por fragmento), genera los PDF y marca cada empresa como hecha.
+# Si un nodo cae, su fragmento caduca y otro lo retoma sin repetir empresas.
+#
+#   python lotes_distribuidos.py preparar ENTRADA COMPARTIDA [--tam-fragmento 500] [--moneda ARS] [--tipos tipos.csv] [--moneda-informe BOB] [--ipc ipc.csv] [--cache CARPETA]
+#   python lotes_distribuidos.py trabajar COMPARTIDA [--id nodo1] [--caducidad 300] [--registro nodo1.log]
+#   python lotes_distribuidos.py local COMPARTIDA [--procesos 4] [--registro lote.log]    (varios nodos en una máquina)
+#   python lotes_distribuidos.py fusionar COMPARTIDA [--xlsx]
+#   python lotes_distribuidos.py estado COMPARTIDA
+#   python lotes_distribuidos.py comparar ANTERIOR ACTUAL [--csv cambios.csv]   (instantáneas de cartera de dos ejecuciones)
+#
+# Las rutas de ENTRADA (y de --tipos / --ipc / --cache) se guardan absolutas: todos los nodos deben verlas en la misma ruta.
+import os
+import re
+import sys
+import shutil
+import time
+import json
+import socket
+import sqlite3
+import logging
+import argparse
+import subprocess
+
+import numpy as np
+
+import panda
+
+ARCHIVO_COLA = "cola.sqlite"
+CARPETA_FRAGMENTOS = "fragmentos"
+CARPETA_PDF = "pdf"
+CARPETA_CARTERA = "cartera"
+ANIOS = ("2023", "2024")
+log = logging.getLogger("panda.lotes")
+
+# -----------------------------
+# Cola de trabajo (SQLite en la carpeta compartida)
+# -----------------------------
+# Diario de rollback (no WAL): WAL necesita memoria compartida y no funciona en
+# carpetas de red. Cada cambio de estado es una transacción BEGIN IMMEDIATE.
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT);
+CREATE TABLE IF NOT EXISTS fragmentos (
+    id INTEGER PRIMARY KEY,
+    estado TEXT NOT NULL DEFAULT 'pendiente',   -- pendiente | en_curso | hecho
+    trabajador TEXT,
+    latido REAL,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    calculado INTEGER NOT NULL DEFAULT 0       -- instantánea del fragmento ya escrita
+);
+CREATE TABLE IF NOT EXISTS empresas (
+    nombre TEXT PRIMARY KEY,
+    ruta TEXT NOT NULL,
+    fragmento INTEGER NOT NULL,
+    posicion INTEGER NOT NULL,
+    hecho INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS empresas_fragmento ON empresas (fragmento, posicion);
+"""
+
+def abrir_cola(compartida, timeout=60.0):
+    con = sqlite3.connect(os.path.join(compartida, ARCHIVO_COLA), timeout=timeout, isolation_level=None)
+    con.executescript(ESQUEMA)
+    return con
+
+def _transaccion(con, f, *args):
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        resultado = f(con, *args)
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    con.execute("COMMIT")
+    return resultado
+
+def preparar_cola(entrada, compartida, tam_fragmento=500, moneda=panda.MONEDA_INFORME, tipos=None, moneda_informe=panda.MONEDA_INFORME, ipc=None,
+                  carpeta_cache=None):
+    """
+    Crea la cola con los balances (.csv/.json) de `entrada` en fragmentos de
+    `tam_fragmento` empresas. No pisa una cola existente: para reanudar basta
+    con volver a lanzar los trabajadores. La conversión de moneda (ver
+    panda.opciones_conversion) se guarda en la cola para que todos los nodos
+    apliquen la misma; también `carpeta_cache` (ver panda.generar_pdf_cacheado),
+    con la que repetir una cartera solo dibuja las empresas que cambiaron.
+    """
+    panda.opciones_conversion(moneda, tipos, moneda_informe, ipc)  # falla aquí, no en cada nodo
+    conversion = {"moneda": moneda, "tipos": tipos and os.path.abspath(tipos),
+                  "moneda_informe": moneda_informe, "ipc": ipc and os.path.abspath(ipc)}
+    os.makedirs(compartida, exist_ok=True)
+    con = abrir_cola(compartida)
+    try:
+        if con.execute("SELECT COUNT(*) FROM fragmentos").fetchone()[0]:
+            raise RuntimeError(f"{compartida} ya tiene una cola; bórrela para empezar de cero")
+        nombres = sorted(n for n in os.listdir(entrada) if n.lower().endswith((".csv", ".json")) and not n.startswith("."))
+        filas = []
+        for i, n in enumerate(nombres):
+            filas.append((os.path.splitext(n)[0], os.path.abspath(os.path.join(entrada, n)), i // tam_fragmento, i % tam_fragmento))
+        if len({f[0] for f in filas}) != len(filas):
+            raise ValueError("Hay balances con el mismo nombre y distinta extensión")
+        def insertar(con):
+            con.execute("INSERT INTO meta VALUES ('entrada', ?)", (os.path.abspath(entrada),))
+            con.execute("INSERT INTO meta VALUES ('conversion', ?)", (json.dumps(conversion),))
+            if carpeta_cache:
+                con.execute("INSERT INTO meta VALUES ('cache', ?)", (os.path.abspath(carpeta_cache),))
+            con.executemany("INSERT INTO fragmentos (id) VALUES (?)", [(k,) for k in range(-(-len(filas) // tam_fragmento))])
+            con.executemany("INSERT INTO empresas (nombre, ruta, fragmento, posicion) VALUES (?, ?, ?, ?)", filas)
+        _transaccion(con, insertar)
+        return {"empresas": len(filas), "fragmentos": -(-len(filas) // tam_fragmento)}
+    finally:
+        con.close()
+
+def cargar_conversion(con):
+    """Opciones de conversión guardadas por preparar_cola (colas anteriores: sin conversión)."""
+    fila = con.execute("SELECT valor FROM meta WHERE clave = 'conversion'").fetchone()
+    return panda.opciones_conversion(**json.loads(fila[0])) if fila else panda.opciones_conversion()
+
+def reclamar_fragmento(con, trabajador, caducidad):
+    """Id del primer fragmento pendiente o con el latido caducado (lo marca en_curso), o None."""
+    def reclamar(con):
+        ahora = time.time()
+        fila = con.execute("SELECT id FROM fragmentos WHERE estado = 'pendiente' OR (estado = 'en_curso' AND latido < ?) "
+                           "ORDER BY id LIMIT 1", (ahora - caducidad,)).fetchone()
+        if fila is None:
+            return None
+        con.execute("UPDATE fragmentos SET estado = 'en_curso', trabajador = ?, latido = ?, intentos = intentos + 1 WHERE id = ?",
+                    (trabajador, ahora, fila[0]))
+        return fila[0]
+    return _transaccion(con, reclamar)
+
+def _latido(con, fragmento, trabajador, **cambios):
+    """Renueva el latido (y aplica `cambios`); False si otro trabajador se quedó con el fragmento."""
+    asignaciones = "".join(f", {k} = ?" for k in cambios)
+    cur = con.execute(f"UPDATE fragmentos SET latido = ?{asignaciones} WHERE id = ? AND trabajador = ? AND estado = 'en_curso'",
+                      (time.time(), *cambios.values(), fragmento, trabajador))
+    return cur.rowcount == 1
+
+# -----------------------------
+# Trabajo de un fragmento
+# -----------------------------
+def carpeta_fragmento(compartida, fragmento):
+    return os.path.join(compartida, CARPETA_FRAGMENTOS, f"{fragmento:05d}")
+
+def _sufijo(trabajador):
+    """Nombre de trabajador apto para nombres de archivo temporales."""
+    return re.sub(r"[^\w.-]", "_", trabajador)
+
+def _publicar_carpeta(tmp, destino):
+    """Sustituye `destino` por `tmp` con renombrados (lo que hubiera antes se borra después)."""
+    viejo = None
+    if os.path.exists(destino):
+        viejo = f"{tmp}.viejo"
+        os.replace(destino, viejo)
+    os.replace(tmp, destino)
+    if viejo:
+        shutil.rmtree(viejo, ignore_errors=True)
+
+def _calcular_fragmento(compartida, fragmento, empresas, trabajador, conversion=None):
+    """
+    Fase 1: lee los balances del fragmento y guarda una instantánea por año
+    (entradas con NaN si faltan) en carpetas temporales propias del trabajador;
+    procesar_fragmento las publica con _publicar_carpeta solo si conserva el
+    fragmento. Un balance ilegible queda como fila vacía y se devuelve en
+    {nombre: error} para no bloquear el resto del fragmento.
+    Devuelve (errores, {año: carpeta temporal}).
+    """
+    balances, errores = [], {}
+    for nombre, ruta in empresas:
+        try:
+            balances.append(panda.convertir_entrada(panda.leer_balance(ruta), conversion)[0])
+        except (OSError, ValueError) as e:
+            balances.append({yr: {} for yr in ANIOS}); errores[nombre] = f"{type(e).__name__}: {e}"
+    nombres = [nombre for nombre, _ in empresas]
+    temporales = {}
+    for yr in ANIOS:
+        t = panda.tabla_desde_inputs([b[yr] for b in balances], empresas=nombres, conservar_ausentes=True)
+        rv = panda.calcular_ratios_vectorizado(panda.normalizar_tabla(t))
+        temporales[yr] = os.path.join(carpeta_fragmento(compartida, fragmento), f".{yr}.{_sufijo(trabajador)}.tmp")
+        shutil.rmtree(temporales[yr], ignore_errors=True)
+        panda.guardar_instantanea(temporales[yr], t, rv)
+    return errores, temporales
+
+def _escribir_pdf(r23, r24, ruta, fecha, trabajador, moneda=panda.MONEDA_INFORME, carpeta_cache=None):
+    """Dibuja el PDF (o lo copia de la caché) en un temporal propio del trabajador; lo publica procesar_fragmento."""
+    tmp = ruta + f".{_sufijo(trabajador)}.tmp"
+    try:
+        if carpeta_cache:
+            panda.generar_pdf_cacheado(r23, r24, tmp, carpeta_cache, fecha=fecha, moneda=moneda)
+        else:
+            panda.generar_pdf_final(r23, r24, filename=tmp, fecha=fecha, moneda=moneda)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return tmp
+
+def procesar_fragmento(con, compartida, fragmento, trabajador, fecha=None, conversion=None, carpeta_cache=None):
+    """
+    Calcula (si no está ya) y genera los PDF pendientes del fragmento.
+    Cada empresa terminada queda marcada en la cola al momento, así que una
+    caída solo repite la empresa que estaba a medias. Devuelve el número de
+    PDF generados, o None si el fragmento pasó a otro trabajador.
+    Todo se escribe en temporales propios del trabajador y se publica (rename)
+    dentro de la transacción que comprueba el latido: un trabajador cuyo
+    fragmento caducó nunca pisa lo que lee o escribe el nuevo dueño.
+    """
+    empresas = con.execute("SELECT nombre, ruta FROM empresas WHERE fragmento = ? ORDER BY posicion", (fragmento,)).fetchall()
+    if not con.execute("SELECT calculado FROM fragmentos WHERE id = ?", (fragmento,)).fetchone()[0]:
+        if not _transaccion(con, lambda con: _latido(con, fragmento, trabajador)):
+            return None
+        errores, temporales = _calcular_fragmento(compartida, fragmento, empresas, trabajador, conversion)
+        def calculado(con):
+            if not _latido(con, fragmento, trabajador, calculado=1):
+                return False
+            for yr, tmp in temporales.items():
+                _publicar_carpeta(tmp, os.path.join(carpeta_fragmento(compartida, fragmento), yr))
+            con.executemany("UPDATE empresas SET hecho = 1, error = ? WHERE nombre = ?", [(e, n) for n, e in errores.items()])
+            return True
+        if not _transaccion(con, calculado):
+            for tmp in temporales.values():
+                shutil.rmtree(tmp, ignore_errors=True)
+            return None
+    # Fase 2: informes. Los ratios salen de la instantánea, no de releer los balances.
+    rv = {}
+    for yr in ANIOS:
+        inst = panda.cargar_instantanea(os.path.join(carpeta_fragmento(compartida, fragmento), yr))
+        rv[yr] = panda.calcular_ratios_vectorizado(panda.normalizar_tabla(inst.tabla()))
+    hechas = {n for (n,) in con.execute("SELECT nombre FROM empresas WHERE fragmento = ? AND hecho = 1", (fragmento,))}
+    os.makedirs(os.path.join(compartida, CARPETA_PDF), exist_ok=True)
+    moneda = conversion["moneda_informe"] if conversion else panda.MONEDA_INFORME
+    generados = 0
+    for j, (nombre, _) in enumerate(empresas):
+        if nombre in hechas:
+            continue
+        if not _transaccion(con, lambda con: _latido(con, fragmento, trabajador)):
+            return None
+        error = None; tmp = None
+        ruta = os.path.join(compartida, CARPETA_PDF, f"{nombre}.pdf")
+        try:
+            tmp = _escribir_pdf(panda.ratios_de_fila(rv["2023"], j), panda.ratios_de_fila(rv["2024"], j), ruta, fecha, trabajador, moneda, carpeta_cache)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            log.warning("informe fallido", extra={"empresa": nombre, "fragmento": fragmento, "error": error})
+        def marcar(con):
+            if not _latido(con, fragmento, trabajador):
+                return False
+            if tmp is not None:
+                os.replace(tmp, ruta)
+            con.execute("UPDATE empresas SET hecho = 1, error = ? WHERE nombre = ?", (error, nombre))
+            return True
+        if not _transaccion(con, marcar):
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+            return None
+        if tmp is not None:
+            generados += 1
+    if not _latido(con, fragmento, trabajador, estado="hecho"):
+        return None
+    return generados
+
+def trabajar(compartida, trabajador=None, caducidad=300.0, espera=2.0, fecha=None):
+    """
+    Bucle de un nodo: reclama fragmentos hasta que no quede ninguno sin hacer.
+    Si solo quedan fragmentos en curso en otros nodos, espera por si alguno
+    caduca (nodo caído) en lugar de terminar.
+    """
+    trabajador = trabajador or f"{socket.gethostname()}:{os.getpid()}"
+    con = abrir_cola(compartida)
+    resumen = {"trabajador": trabajador, "fragmentos": 0, "informes": 0}
+    try:
+        conversion = cargar_conversion(con)
+        fila = con.execute("SELECT valor FROM meta WHERE clave = 'cache'").fetchone()
+        carpeta_cache = fila[0] if fila else None
+        while True:
+            fragmento = reclamar_fragmento(con, trabajador, caducidad)
+            if fragmento is None:
+                if not con.execute("SELECT COUNT(*) FROM fragmentos WHERE estado != 'hecho'").fetchone()[0]:
+                    return resumen
+                time.sleep(espera)
+                continue
+            t0 = time.perf_counter()
+            generados = procesar_fragmento(con, compartida, fragmento, trabajador, fecha=fecha, conversion=conversion, carpeta_cache=carpeta_cache)
+            log.info("fragmento", extra={"fragmento": fragmento, "trabajador": trabajador, "informes": generados,
+                                         "segundos": round(time.perf_counter() - t0, 3)})
+            if generados is not None:
+                resumen["fragmentos"] += 1; resumen["informes"] += generados
+    finally:
+        con.close()
+
+def ejecutar_local(compartida, procesos=2, caducidad=300.0, registro=None):
+    """
+    Prueba en una sola máquina: `procesos` trabajadores independientes (un intérprete cada uno) como si fueran nodos.
+    Con `registro` cada trabajador escribe su propio archivo (registro.localN.log).
+    """
+    hijos = []
+    for k in range(procesos):
+        orden = [sys.executable, os.path.abspath(__file__), "trabajar", compartida, "--id", f"local{k}", "--caducidad", str(caducidad)]
+        if registro:
+            raiz, ext = os.path.splitext(registro)
+            orden += ["--registro", f"{raiz}.local{k}{ext or '.log'}"]
+        hijos.append(subprocess.Popen(orden))
+    return [h.wait() for h in hijos]
+
+# -----------------------------
+# Estado y fusión
+# -----------------------------
+def estado_cola(compartida):
+    con = abrir_cola(compartida)
+    try:
+        por_estado = dict(con.execute("SELECT estado, COUNT(*) FROM fragmentos GROUP BY estado").fetchall())
+        empresas, hechas, errores = con.execute(
+            "SELECT COUNT(*), COALESCE(SUM(hecho), 0), COUNT(error) FROM empresas").fetchone()
+        return {"fragmentos": por_estado, "empresas": empresas, "hechas": hechas, "errores": errores,
+                "ejemplos_error": con.execute("SELECT nombre, error FROM empresas WHERE error IS NOT NULL LIMIT 10").fetchall()}
+    finally:
+        con.close()
+
+def fusionar(compartida, xlsx=False):
+    """
+    Une las instantáneas de todos los fragmentos (en orden) en cartera/2023 y
+    cartera/2024, y opcionalmente cartera/matriz_ratios.xlsx. Exige que no
+    quede ningún fragmento sin hacer.
+    """
+    con = abrir_cola(compartida)
+    try:
+        pendientes = [f for (f,) in con.execute("SELECT id FROM fragmentos WHERE estado != 'hecho' ORDER BY id")]
+        fragmentos = [f for (f,) in con.execute("SELECT id FROM fragmentos ORDER BY id")]
+    finally:
+        con.close()
+    if pendientes:
+        raise RuntimeError(f"Fragmentos sin terminar: {pendientes[:20]}")
+    tablas = {}
+    for yr in ANIOS:
+        partes = [panda.cargar_instantanea(os.path.join(carpeta_fragmento(compartida, f), yr)).tabla() for f in fragmentos]
+        t = {k: np.concatenate([p[k] for p in partes]) for k in partes[0]} if partes else panda.tabla_desde_inputs([], empresas=[])
+        panda.guardar_instantanea(os.path.join(compartida, CARPETA_CARTERA, yr), t,
+                                  panda.calcular_ratios_vectorizado(panda.normalizar_tabla(t)))
+        tablas[yr] = t
+    if xlsx:
+        panda.exportar_xlsx(os.path.join(compartida, CARPETA_CARTERA, "matriz_ratios.xlsx"), tablas["2023"], tablas["2024"])
+    resumen = dict(estado_cola(compartida), fusionadas=int(len(tablas["2024"]["activo_corriente"])))
+    with open(os.path.join(compartida, CARPETA_CARTERA, "resumen.json"), "w", encoding="utf-8") as f:
+        json.dump(resumen, f, ensure_ascii=False, indent=1)
+    return resumen
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Lote de ratios e informes repartido en fragmentos con una cola compartida.")
+    sub = ap.add_subparsers(dest="orden", required=True)
+    p = sub.add_parser("preparar"); p.add_argument("entrada"); p.add_argument("compartida")
+    p.add_argument("--tam-fragmento", type=int, default=500)
+    p.add_argument("--moneda", default=panda.MONEDA_INFORME, help="moneda de los balances de entrada")
+    p.add_argument("--tipos", default=None, help="CSV fecha,moneda,tasa para pasar a --moneda-informe")
+    p.add_argument("--moneda-informe", default=panda.MONEDA_INFORME, help="moneda de los informes (requiere --tipos)")
+    p.add_argument("--ipc", default=None, help="CSV fecha,indice para expresar los importes a precios constantes")
+    p.add_argument("--cache", default=None, help="carpeta compartida de PDF por hash de entradas (ver panda.generar_pdf_cacheado)")
+    p = sub.add_parser("trabajar"); p.add_argument("compartida"); p.add_argument("--id", default=None)
+    p.add_argument("--caducidad", type=float, default=300.0, help="segundos sin latido antes de reasignar un fragmento")
+    p.add_argument("--registro", default=None, help="archivo de diagnóstico JSON (ver panda.configurar_registro)")
+    p = sub.add_parser("local"); p.add_argument("compartida"); p.add_argument("--procesos", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--caducidad", type=float, default=300.0)
+    p.add_argument("--registro", default=None)
+    p = sub.add_parser("fusionar"); p.add_argument("compartida"); p.add_argument("--xlsx", action="store_true")
+    p = sub.add_parser("estado"); p.add_argument("compartida")
+    p = sub.add_parser("comparar", help="cambios entre dos instantáneas de cartera (p. ej. cartera/2024 de dos noches)")
+    p.add_argument("anterior"); p.add_argument("actual"); p.add_argument("--csv", default=None)
+    p.add_argument("--movimiento", type=float, default=panda.UMBRAL_MOVIMIENTO, help="variación relativa de RAT/RRP a informar")
+    args = ap.parse_args()
+    if args.orden == "preparar":
+        print(json.dumps(preparar_cola(args.entrada, args.compartida, args.tam_fragmento,
+                                       args.moneda.upper(), args.tipos, args.moneda_informe.upper(), args.ipc, args.cache)))
+    elif args.orden == "trabajar":
+        if args.registro:
+            panda.configurar_registro(args.registro)
+        print(json.dumps(trabajar(args.compartida, args.id, args.caducidad)))
+    elif args.orden == "local":
+        sys.exit(max(ejecutar_local(args.compartida, args.procesos, args.caducidad, args.registro), default=0))
+    elif args.orden == "fusionar":
+        print(json.dumps(fusionar(args.compartida, args.xlsx), ensure_ascii=False))
+    elif args.orden == "comparar":
+        dif = panda.comparar_instantaneas(args.anterior, args.actual, movimiento=args.movimiento)
+        resumen = panda.escribir_informe_cambios(args.csv, dif) if args.csv else panda.resumen_cambios(dif)
+        print(json.dumps(resumen, ensure_ascii=False, indent=1))
+    else:
+        print(json.dumps(estado_cola(args.compartida), ensure_ascii=False, indent=1))
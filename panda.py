@@ -9,10 +9,31 @@ from reportlab.platypus import Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
 from reportlab.lib.enums import TA_LEFT, TA_CENTER
 from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfdoc
+from PIL import Image
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from io import BytesIO
 import math
 import datetime
+import time
+import ast
+import os
+import csv
+import json
+import shutil
+import hashlib
+import struct
+import re
+import gc
+from collections import deque
+import queue
+import threading
+import atexit
+import logging
+import logging.handlers
+import zipfile
+from xml.sax.saxutils import escape
 import numpy as np
 
 # Definición de colores
@@ -28,6 +49,112 @@ COLOR_ACENTO = colors.HexColor(HEX_ACENTO)
 COLOR_FONDO_TABLA_OBJ = colors.HexColor(HEX_FONDO_TABLA)
 COLOR_CAJA_OBJ = colors.HexColor(HEX_CAJA) 
 
+# -----------------------------
+# Registro de diagnóstico (JSON por cola, escritura en segundo plano)
+# -----------------------------
+# Sin configurar_registro() los debug() se descartan en la comprobación de nivel
+log_ratios = logging.getLogger("panda.ratios")
+log_pdf = logging.getLogger("panda.pdf")
+log_graficos = logging.getLogger("panda.graficos")
+_ATRIBUTOS_REGISTRO = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+_config_registro = None
+_oyente_registro = None
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro; los campos pasados en `extra` van como claves propias."""
+    def format(self, record):
+        datos = {"ts": round(record.created, 6), "nivel": record.levelname, "logger": record.name,
+                 "hilo": record.threadName, "msg": record.getMessage()}
+        for k, v in record.__dict__.items():
+            if k not in _ATRIBUTOS_REGISTRO:
+                datos[k] = v
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+class MuestreoPorLogger(logging.Filter):
+    """
+    Deja pasar 1 de cada N registros por debajo de WARNING según el logger
+    ({"panda.pdf": 10}; vale el prefijo más largo, "" para el resto).
+    WARNING y superiores pasan siempre. Va en el QueueHandler: lo descartado
+    ni siquiera se encola.
+    """
+    def __init__(self, muestreo=None):
+        super().__init__()
+        self.muestreo = dict(muestreo or {})
+        self._cada = {}
+        self._contador = {}
+
+    def _resolver(self, nombre):
+        while nombre:
+            if nombre in self.muestreo:
+                return self.muestreo[nombre]
+            nombre = nombre.rpartition(".")[0]
+        return self.muestreo.get("", 1)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        cada = self._cada.get(record.name)
+        if cada is None:
+            cada = self._cada[record.name] = max(1, int(self._resolver(record.name)))
+        if cada == 1:
+            return True
+        n = self._contador.get(record.name, 0)
+        self._contador[record.name] = n + 1
+        return n % cada == 0
+
+def configurar_registro(ruta="panda_debug.log", nivel=logging.DEBUG, muestreo=None, max_bytes=10 << 20, copias=5):
+    """
+    Activa el registro JSON de los loggers "panda.*". El hilo que calcula o
+    dibuja solo encola el registro (QueueHandler); un QueueListener en segundo
+    plano lo escribe en `ruta`, que rota al llegar a max_bytes (se guardan
+    `copias` archivos). `muestreo`: ver MuestreoPorLogger.
+    Devuelve el QueueListener (detener_registro lo vacía y cierra).
+    """
+    global _config_registro, _oyente_registro
+    detener_registro()
+    archivo = logging.handlers.RotatingFileHandler(ruta, maxBytes=max_bytes, backupCount=copias, encoding="utf-8", delay=True)
+    archivo.setFormatter(FormatoJSON())
+    cola = queue.SimpleQueue()
+    manejador = logging.handlers.QueueHandler(cola)
+    manejador.addFilter(MuestreoPorLogger(muestreo))
+    raiz = logging.getLogger("panda")
+    raiz.addHandler(manejador)
+    raiz.setLevel(nivel)
+    _oyente_registro = logging.handlers.QueueListener(cola, archivo)
+    _oyente_registro.start()
+    _config_registro = {"ruta": ruta, "nivel": nivel, "muestreo": muestreo, "max_bytes": max_bytes, "copias": copias}
+    return _oyente_registro
+
+def detener_registro():
+    """Escribe lo pendiente en la cola, cierra el archivo y quita el QueueHandler."""
+    global _config_registro, _oyente_registro
+    raiz = logging.getLogger("panda")
+    for h in [h for h in raiz.handlers if isinstance(h, logging.handlers.QueueHandler)]:
+        raiz.removeHandler(h)
+    raiz.setLevel(logging.NOTSET)
+    oyente, _oyente_registro, _config_registro = _oyente_registro, None, None
+    if oyente is not None:
+        oyente.stop()
+        for h in oyente.handlers:
+            h.close()
+
+def _registro_tras_fork():
+    # El hilo del listener no sobrevive a fork(): el hijo abre su propio archivo
+    global _oyente_registro
+    config = _config_registro
+    if config is None:
+        return
+    _oyente_registro = None
+    raiz, ext = os.path.splitext(config["ruta"])
+    configurar_registro(**dict(config, ruta=f"{raiz}.{os.getpid()}{ext}"))
+
+atexit.register(detener_registro)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_registro_tras_fork)
+
+def _traza_pdf(c, seccion, y):
+    log_pdf.debug("seccion", extra={"pagina": c.getPageNumber(), "seccion": seccion, "y": round(y, 1)})
+
 # -----------------------------
 # UTILIDADES (Funciones auxiliares, etc.)
 # -----------------------------
@@ -48,90 +175,9 @@ def fmt_num(val, digits=2):
 
 # Funciones de cálculos
 def calcular_ratios_from_inputs(d):
-    # Normalizar y sacar valores
-    AC = d.get("activo_corriente") or 0.0
-    ANC = d.get("activo_no_corriente") or 0.0
-    PC = d.get("pasivo_corriente") or 0.0
-    PNC = d.get("pasivo_no_corriente") or 0.0
-    PN = d.get("patrimonio_neto") or 0.0
-    Ventas = d.get("ventas") or 0.0
-    Costo = d.get("costo_ventas") or 0.0
-    BN = d.get("beneficio_neto") or 0.0
-    Deudores = d.get("deudores") or 0.0
-    Inventario = d.get("inventario") or 0.0
-    Caja = d.get("caja") or 0.0
-    i_input = d.get("i") if d.get("i") is not None else 0.05
-    GFin = d.get("gastos_financieros") or 0.0 # C5
-    # Datos CCE (A4)
-    dias_inv = d.get("dias_inventario") or 0.0
-    dias_clie = d.get("dias_clientes") or 0.0
-    dias_prov = d.get("dias_proveedores") or 0.0
-
-
-    Activo = AC + ANC
-    Pasivo = PC + PNC
-    DeudaTotal = Pasivo # PC + PNC
-
-    ratios = {}
-    
-    # C5.a: Calcular costo promedio de deuda (i)
-    costo_deuda_i = safe_div(GFin, DeudaTotal) if DeudaTotal != 0 else 0.0
-    ratios["Costo Deuda (i)"] = costo_deuda_i
-
-    # Fondo de Maniobra (A1)
-    ratios["Fondo Maniobra"] = AC - PC
-    ratios["Fondo Maniobra Alternativo"] = PN + PNC - ANC
-
-    # Liquidez (C1)
-    ratios["Liquidez General"] = safe_div(AC, PC)
-    ratios["Tesorería"] = safe_div((Caja + Deudores), PC)
-    ratios["Disponibilidad"] = safe_div(Caja, PC)
-
-    # Solvencia (C2)
-    ratios["Garantía"] = safe_div(Activo, Pasivo)
-    ratios["Autonomía"] = safe_div(PN, Pasivo)
-    ratios["Calidad Deuda"] = safe_div(PC, Pasivo)
-
-    # Rentabilidades (C3)
-    BAII = Ventas - Costo
-    ratios["RAT"] = safe_div(BAII, Activo)
-    ratios["RRP"] = safe_div(BN, PN) # RRP normal, sin apalancamiento
-
-    # C5.c: Apalancamiento Financiero (Usando la 'i' calculada)
-    D = DeudaTotal
-    if PN != 0:
-        RAT = ratios["RAT"] or 0.0
-        # RRP = RAT + (D/PN) * (RAT - i)
-        apalancamiento_term = safe_div(D, PN) * (RAT - costo_deuda_i)
-        ratios["RRP Apalancada"] = RAT + apalancamiento_term
-        ratios["Efecto Apalancamiento"] = apalancamiento_term
-    else:
-        ratios["RRP Apalancada"] = None
-        ratios["Efecto Apalancamiento"] = None
-
-    # Store raw items for later use
-    ratios["_AC"] = AC
-    ratios["_ANC"] = ANC
-    ratios["_PC"] = PC
-    ratios["_PNC"] = PNC
-    ratios["_PN"] = PN
-    ratios["_Ventas"] = Ventas
-    ratios["_Costo"] = Costo
-    ratios["_BAII"] = BAII
-    ratios["_BN"] = BN
-    ratios["_Deudores"] = Deudores
-    ratios["_Inventario"] = Inventario
-    ratios["_Caja"] = Caja
-    ratios["_i_input"] = i_input
-    ratios["_GastosFin"] = GFin
-    ratios["_ActivoTotal"] = Activo
-    ratios["_PasivoTotal"] = Pasivo
-    ratios["_DeudaTotal"] = DeudaTotal
-    ratios["_dias_inventario"] = dias_inv # A4
-    ratios["_dias_clientes"] = dias_clie # A4
-    ratios["_dias_proveedores"] = dias_prov # A4
-
-    return ratios
+    # Una fila del motor vectorizado: las fórmulas viven en REGISTRO_RATIOS.
+    # Valores ausentes cuentan como 0.0 (la tasa i como 0.05); N/A -> None.
+    return ratios_de_fila(calcular_ratios_vectorizado(tabla_desde_inputs([d])), 0)
 
 # Funciones de análisis y diagnóstico
 def clasificar_situacion_patrimonial_v2(r):
@@ -373,7 +419,10 @@ def generar_analisis_apalancamiento(r24):
         "d": recom_deuda
     }
 
-def generar_fortalezas_debilidades(r23, r24):
+def generar_fortalezas_debilidades(r23, r24, pares=None):
+    # Con `pares` (ver posicion_pares) los umbrales fijos se sustituyen por la posición frente al sector
+    if pares is not None:
+        return fortalezas_debilidades_pares(pares)
     fz = []
     db = []
     # ventas growth
@@ -407,9 +456,11 @@ def generar_fortalezas_debilidades(r23, r24):
     if not db: db.append("Dependencia de contratos/servicios (riesgo sectorial).")
     return fz[:6], db[:6]
 
-def generar_diagnostico(r23, r24):
+def generar_diagnostico(r23, r24, fecha=None):
+    # fecha inyectable para informes reproducibles (por defecto, hoy)
+    fecha = fecha or datetime.date.today()
     lines = []
-    lines.append(f"Diagnóstico ejecutivo — {datetime.date.today().isoformat()}")
+    lines.append(f"Diagnóstico ejecutivo — {fecha.isoformat()}")
     v23 = r23.get("_Ventas") or 0.0; v24 = r24.get("_Ventas") or 0.0
     if v23 and v24 and v23 != 0:
         pct = (v24 - v23) / abs(v23) * 100; lines.append(f"- Crecimiento de ventas: {fmt_num(pct)}%")
@@ -462,12 +513,1485 @@ def generar_recomendaciones(r23, r24):
     
     return texto
 
+# -----------------------------
+# Motor vectorizado (carteras y grupos)
+# -----------------------------
+CAMPOS_ENTRADA = [
+    "activo_corriente", "activo_no_corriente", "pasivo_corriente", "pasivo_no_corriente",
+    "patrimonio_neto", "ventas", "costo_ventas", "beneficio_neto", "deudores", "inventario",
+    "caja", "i", "gastos_financieros", "dias_inventario", "dias_clientes", "dias_proveedores"
+]
+# Partidas que se suman al consolidar; "i" y los días se promedian ponderados
+PARTIDAS_SUMABLES = [k for k in CAMPOS_ENTRADA if k != "i" and not k.startswith("dias_")]
+PONDERACION_CONSOLIDADO = {
+    "i": ("pasivo_corriente", "pasivo_no_corriente"),
+    "dias_inventario": ("costo_ventas",),
+    "dias_clientes": ("ventas",),
+    "dias_proveedores": ("costo_ventas",),
+}
+
+def tabla_desde_inputs(lista_inputs, empresas=None, conservar_ausentes=False):
+    """
+    Convierte una lista de dicts de entrada (formato de App.leer_inputs) en una
+    tabla columnar {campo: ndarray}. Igual que calcular_ratios_from_inputs,
+    los valores ausentes cuentan como 0.0 (y la tasa i como 0.05); con
+    conservar_ausentes=True quedan como NaN para validar_tabla / normalizar_tabla.
+    """
+    n = len(lista_inputs)
+    t = {}
+    for k in CAMPOS_ENTRADA:
+        if conservar_ausentes:
+            valores = (np.nan if d.get(k) is None else d.get(k) for d in lista_inputs)
+        elif k == "i":
+            valores = (0.05 if d.get(k) is None else d.get(k) for d in lista_inputs)
+        else:
+            valores = (d.get(k) or 0.0 for d in lista_inputs)
+        t[k] = np.fromiter(valores, dtype=float, count=n)
+    if empresas is not None:
+        t["empresa"] = np.asarray(empresas, dtype=object)
+    return t
+
+def inputs_de_fila(t, j):
+    """Dict de entrada (escalares) de la fila j de una tabla columnar."""
+    return {k: float(t[k][j]) for k in CAMPOS_ENTRADA if k in t}
+
+def _div(a, b):
+    """División vectorizada: NaN donde el denominador es 0 (equivale al None de safe_div)."""
+    a = np.asarray(a, dtype=float); b = np.asarray(b, dtype=float)
+    out = np.full(np.broadcast(a, b).shape, np.nan)
+    np.divide(a, b, out=out, where=(b != 0))
+    return out
+
+# -----------------------------
+# Registro declarativo de ratios
+# -----------------------------
+# Nombre corto usado en las fórmulas -> campo de entrada
+VARIABLES_FORMULA = {
+    "AC": "activo_corriente", "ANC": "activo_no_corriente", "PC": "pasivo_corriente",
+    "PNC": "pasivo_no_corriente", "PN": "patrimonio_neto", "Ventas": "ventas",
+    "Costo": "costo_ventas", "BN": "beneficio_neto", "Deudores": "deudores",
+    "Inventario": "inventario", "Caja": "caja", "i_input": "i", "GFin": "gastos_financieros",
+    "DiasInv": "dias_inventario", "DiasClie": "dias_clientes", "DiasProv": "dias_proveedores",
+}
+# Variables intermedias, en orden de cálculo
+VARIABLES_DERIVADAS = {
+    "Activo": "AC + ANC",
+    "Pasivo": "PC + PNC",
+    "DeudaTotal": "Pasivo",
+    "BAII": "Ventas - Costo",
+    "i_deuda": "where(DeudaTotal != 0, GFin / DeudaTotal, 0.0)",
+}
+# Funciones permitidas en las fórmulas (todas vectorizadas)
+FUNCIONES_FORMULA = {"where": np.where, "nan0": np.nan_to_num, "abs": np.abs, "minimo": np.minimum, "maximo": np.maximum}
+
+REGISTRO_RATIOS = {}
+_kernel_cache = {}
+
+def registrar_ratio(nombre, formula, categoria, optimo=None, optimo_texto=None, formula_texto=None):
+    """
+    Añade (o reemplaza) un ratio en el registro. `formula` es una expresión
+    sobre VARIABLES_FORMULA / VARIABLES_DERIVADAS; las divisiones por cero dan
+    NaN. `optimo` = (mínimo, máximo) con None para extremos abiertos.
+    """
+    _arbol_formula(formula)  # valida antes de registrar
+    REGISTRO_RATIOS[nombre] = {
+        "formula": formula,
+        "formula_texto": formula_texto or formula,
+        "categoria": categoria,
+        "optimo": optimo,
+        "optimo_texto": optimo_texto,
+    }
+    _kernel_cache.clear()
+
+class _DivisionSegura(ast.NodeTransformer):
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Div):
+            return ast.copy_location(ast.Call(func=ast.Name(id="_div", ctx=ast.Load()), args=[node.left, node.right], keywords=[]), node)
+        return node
+
+_NODOS_PERMITIDOS = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Constant, ast.Load,
+                     ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd,
+                     ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+def _arbol_formula(formula):
+    """Valida una fórmula y devuelve su AST con las '/' traducidas a _div."""
+    try:
+        arbol = ast.parse(formula, mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Fórmula inválida '{formula}': {e.msg}")
+    nombres = set(VARIABLES_FORMULA) | set(VARIABLES_DERIVADAS)
+    for nodo in ast.walk(arbol):
+        if not isinstance(nodo, _NODOS_PERMITIDOS):
+            raise ValueError(f"Fórmula inválida '{formula}': elemento no permitido ({type(nodo).__name__}).")
+        if isinstance(nodo, ast.Call) and not (isinstance(nodo.func, ast.Name) and nodo.func.id in FUNCIONES_FORMULA):
+            raise ValueError(f"Fórmula inválida '{formula}': solo se permiten las funciones {', '.join(FUNCIONES_FORMULA)}.")
+        if isinstance(nodo, ast.Name) and nodo.id not in nombres and nodo.id not in FUNCIONES_FORMULA:
+            raise ValueError(f"Fórmula inválida '{formula}': variable desconocida '{nodo.id}'.")
+    return _DivisionSegura().visit(arbol).body
+
+_NODOS_CALCULO = (ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call)
+
+class _Subexpresiones(ast.NodeTransformer):
+    """Sustituye las subexpresiones repetidas entre fórmulas por temporales (se calculan una vez)."""
+    def __init__(self, repetidas):
+        self.repetidas = repetidas
+        self.nombres = {}
+        self.pendientes = []
+
+    def _sustituir(self, nodo):
+        clave = ast.dump(nodo)  # clave de la expresión original, antes de sustituir sus hijos
+        nodo = self.generic_visit(nodo)
+        if clave not in self.repetidas:
+            return nodo
+        if clave not in self.nombres:
+            self.nombres[clave] = f"_c{len(self.nombres)}"
+            self.pendientes.append((self.nombres[clave], ast.unparse(nodo)))
+        return ast.Name(id=self.nombres[clave], ctx=ast.Load())
+
+    visit_BinOp = visit_UnaryOp = visit_Compare = visit_Call = _sustituir
+
+def compilar_registro():
+    """
+    Genera y compila una única función NumPy que evalúa todo el registro:
+    carga de columnas, variables intermedias y cada ratio, calculando una
+    sola vez las subexpresiones que comparten varias fórmulas.
+    """
+    clave = tuple((k, v["formula"]) for k, v in REGISTRO_RATIOS.items())
+    if clave not in _kernel_cache:
+        _kernel_cache[clave] = compilar_formulas({k: v["formula"] for k, v in REGISTRO_RATIOS.items()}, "<registro_ratios>")
+    return _kernel_cache[clave]
+
+def compilar_formulas(formulas, origen="<formulas>"):
+    """
+    Compila {nombre: fórmula} (mismo lenguaje que registrar_ratio) en una
+    función t -> {nombre: ndarray}, con las subexpresiones comunes calculadas una vez.
+    """
+    sentencias = [(var, _arbol_formula(f)) for var, f in VARIABLES_DERIVADAS.items()]
+    sentencias += [(f"out[{nombre!r}]", _arbol_formula(f)) for nombre, f in formulas.items()]
+    conteo = {}
+    for _, arbol in sentencias:
+        for nodo in ast.walk(arbol):
+            if isinstance(nodo, _NODOS_CALCULO):
+                conteo[ast.dump(nodo)] = conteo.get(ast.dump(nodo), 0) + 1
+    cse = _Subexpresiones({k for k, veces in conteo.items() if veces > 1})
+
+    lineas = ["def _kernel(t):"]
+    for var, campo in VARIABLES_FORMULA.items():
+        lineas.append(f"    {var} = t[{campo!r}]")
+    lineas.append("    n = len(AC)")
+    lineas.append("    out = {}")
+    for destino, arbol in sentencias:
+        expr = ast.unparse(cse.visit(arbol))
+        lineas.extend(f"    {tmp} = {e}" for tmp, e in cse.pendientes)
+        cse.pendientes.clear()
+        if destino.startswith("out["):
+            expr = f"_columna({expr}, n)"
+        lineas.append(f"    {destino} = {expr}")
+    lineas.append("    return out")
+    fuente = "\n".join(lineas)
+    espacio = dict(FUNCIONES_FORMULA, _div=_div, _columna=_columna)
+    exec(compile(fuente, origen, "exec"), espacio)
+    kernel = espacio["_kernel"]
+    kernel.fuente = fuente
+    return kernel
+
+def _columna(v, n):
+    v = np.asarray(v, dtype=float)
+    return v if v.ndim else np.full(n, float(v))
+
+def evaluar_registro(t):
+    """Evalúa todos los ratios registrados sobre una tabla columnar."""
+    return compilar_registro()(t)
+
+registrar_ratio("Costo Deuda (i)", "i_deuda", "Apalancamiento", formula_texto="Gastos Fin / Deuda Total")
+registrar_ratio("Fondo Maniobra", "AC - PC", "Patrimonial", optimo=(0.0, None), formula_texto="AC - PC")
+registrar_ratio("Fondo Maniobra Alternativo", "PN + PNC - ANC", "Patrimonial", optimo=(0.0, None), formula_texto="PN + PNC - ANC")
+registrar_ratio("Liquidez General", "AC / PC", "Liquidez", optimo=(1.5, 2.0), optimo_texto="óptimo 1.5-2.0")
+registrar_ratio("Tesorería", "(Caja + Deudores) / PC", "Liquidez", optimo=(1.0, None), optimo_texto="óptimo ~1.0", formula_texto="(Caja+Deudores) / PC")
+registrar_ratio("Disponibilidad", "Caja / PC", "Liquidez", optimo=(0.2, 0.3), optimo_texto="óptimo 0.2-0.3")
+registrar_ratio("Garantía", "Activo / Pasivo", "Solvencia", optimo=(1.5, None), optimo_texto="óptimo > 1.5")
+registrar_ratio("Autonomía", "PN / Pasivo", "Solvencia", optimo=(1.0, None), optimo_texto="óptimo > 1.0")
+registrar_ratio("Calidad Deuda", "PC / Pasivo", "Solvencia", optimo=(None, 0.6), optimo_texto="vigilancia si es > 0.6")
+registrar_ratio("RAT", "BAII / Activo", "Rentabilidad", formula_texto="BAII / Activo")
+registrar_ratio("RRP", "BN / PN", "Rentabilidad", formula_texto="BN / PN")
+# DuPont: RRP = Margen Neto x Rotación Activo x Multiplicador Capital
+registrar_ratio("Margen Neto", "BN / Ventas", "DuPont", formula_texto="BN / Ventas")
+registrar_ratio("Rotación Activo", "Ventas / Activo", "DuPont", formula_texto="Ventas / Activo")
+registrar_ratio("Multiplicador Capital", "Activo / PN", "DuPont", formula_texto="Activo / PN")
+# RRP = RAT + (D/PN) * (RAT - i); sin PN no hay apalancamiento definido
+registrar_ratio("RRP Apalancada", "nan0(BAII / Activo) + DeudaTotal / PN * (nan0(BAII / Activo) - i_deuda)", "Apalancamiento", formula_texto="RAT + D/PN·(RAT − i)")
+registrar_ratio("Efecto Apalancamiento", "DeudaTotal / PN * (nan0(BAII / Activo) - i_deuda)", "Apalancamiento", formula_texto="D/PN·(RAT − i)")
+registrar_ratio("Endeudamiento", "Pasivo / (PN + Pasivo)", "Solvencia", formula_texto="Pasivo / (PN + Pasivo)")
+
+def formula_corta(nombre):
+    """Fórmula del registro sin espacios, para los textos en línea (p.ej. 'AC/PC')."""
+    return REGISTRO_RATIOS[nombre]["formula_texto"].replace(" ", "")
+
+def calcular_ratios_vectorizado(t):
+    """
+    Versión columnar de calcular_ratios_from_inputs: mismas claves de salida,
+    pero cada valor es un ndarray con una posición por empresa (NaN = N/A).
+    Los ratios salen del registro compilado; se añaden las partidas base (_AC, ...).
+    """
+    t0 = time.perf_counter()
+    AC = t["activo_corriente"]; ANC = t["activo_no_corriente"]
+    PC = t["pasivo_corriente"]; PNC = t["pasivo_no_corriente"]
+    Ventas = t["ventas"]; Costo = t["costo_ventas"]
+
+    ratios = evaluar_registro(t)
+    ratios["_AC"] = AC; ratios["_ANC"] = ANC; ratios["_PC"] = PC; ratios["_PNC"] = PNC
+    ratios["_PN"] = t["patrimonio_neto"]; ratios["_Ventas"] = Ventas; ratios["_Costo"] = Costo
+    ratios["_BAII"] = Ventas - Costo; ratios["_BN"] = t["beneficio_neto"]; ratios["_Deudores"] = t["deudores"]
+    ratios["_Inventario"] = t["inventario"]; ratios["_Caja"] = t["caja"]; ratios["_i_input"] = t["i"]
+    ratios["_GastosFin"] = t["gastos_financieros"]; ratios["_ActivoTotal"] = AC + ANC
+    ratios["_PasivoTotal"] = PC + PNC; ratios["_DeudaTotal"] = PC + PNC
+    ratios["_dias_inventario"] = t["dias_inventario"]
+    ratios["_dias_clientes"] = t["dias_clientes"]
+    ratios["_dias_proveedores"] = t["dias_proveedores"]
+    log_ratios.debug("ratios", extra={"filas": len(AC), "segundos": round(time.perf_counter() - t0, 6)})
+    return ratios
+
+def ratios_de_fila(rv, j):
+    """Dict de ratios escalares (NaN -> None) de la fila j, apto para las funciones de informe."""
+    fila = {}
+    for k, col in rv.items():
+        v = col[j]
+        if isinstance(v, (float, np.floating)):
+            v = None if np.isnan(v) else float(v)
+        fila[k] = v
+    return fila
+
+# Etiquetas de clasificar_situacion_patrimonial_v2 / calcular_cce como códigos enteros
+ETIQUETAS_SITUACION = [
+    "Crisis / Desequilibrio a L/P (Quiebra técnica)",
+    "Equilibrio Total / Estabilidad Máxima",
+    "Insolvencia / Suspensión de pagos",
+    "Desequilibrio/Tensión Financiera Normal",
+    "Equilibrio Normal / Estabilidad Normal",
+]
+ETIQUETAS_CCE = [
+    "Ideal (la empresa cobra antes de pagar el inventario).",
+    "Sostenible (aunque positivo, el ciclo de caja es corto).",
+    "Insostenible/Riesgoso (el ciclo de caja es muy largo).",
+    "Datos insuficientes (días = 0 o N/A).",
+]
+
+def clasificar_situacion_vectorizado(rv):
+    """Mismas reglas y orden que clasificar_situacion_patrimonial_v2; devuelve índices de ETIQUETAS_SITUACION."""
+    AC = rv["_AC"]; PC = rv["_PC"]; PN = rv["_PN"]; Activo = rv["_ActivoTotal"]; fm = rv["Fondo Maniobra"]
+    pn_activo = _div(PN, Activo)
+    return np.select(
+        [PN < 0, (Activo > 0) & (pn_activo > 0.85), (fm < 0) & (AC < PC), fm < 0],
+        [0, 1, 2, 3], default=4).astype(np.int8)
+
+def clasificar_cce_vectorizado(rv):
+    """Mismas reglas que calcular_cce; devuelve (cce con NaN si faltan datos, índices de ETIQUETAS_CCE)."""
+    d_inv = rv["_dias_inventario"]; d_clie = rv["_dias_clientes"]; d_prov = rv["_dias_proveedores"]
+    faltan = (d_inv == 0) | (d_clie == 0) | (d_prov == 0)
+    cce = np.where(faltan, np.nan, d_inv + d_clie - d_prov)
+    codigo = np.select([faltan, cce < 0, cce <= 60], [3, 0, 1], default=2).astype(np.int8)
+    return cce, codigo
+
+def consolidar_tabla(t, grupo=None, eliminaciones=None):
+    """
+    Consolida filiales en una tabla columnar con una fila por grupo.
+    - grupo: array de índices de grupo (0..G-1) por filial; None = un solo grupo.
+    - eliminaciones: tabla intercompañía {partida: importes} (opcionalmente con
+      columna "grupo") cuyos importes se restan de las partidas sumables.
+    Las partidas se suman con np.bincount; i y los días se ponderan por su base.
+    """
+    n = len(t["activo_corriente"])
+    grupo = np.zeros(n, dtype=np.intp) if grupo is None else np.asarray(grupo, dtype=np.intp)
+    G = int(grupo.max()) + 1 if n else 1
+    tc = {}
+    for k in PARTIDAS_SUMABLES:
+        tc[k] = np.bincount(grupo, weights=t[k], minlength=G)
+    if eliminaciones:
+        g_el = eliminaciones.get("grupo")
+        for k, importes in eliminaciones.items():
+            if k not in PARTIDAS_SUMABLES:
+                continue
+            importes = np.atleast_1d(np.asarray(importes, dtype=float))
+            g = np.zeros(len(importes), dtype=np.intp) if g_el is None else np.asarray(g_el, dtype=np.intp)
+            tc[k] = tc[k] - np.bincount(g, weights=importes, minlength=G)
+    for k, bases in PONDERACION_CONSOLIDADO.items():
+        peso = sum(t[b] for b in bases)
+        media = _div(np.bincount(grupo, weights=peso * t[k], minlength=G), np.bincount(grupo, weights=peso, minlength=G))
+        tc[k] = np.where(np.isnan(media), 0.05 if k == "i" else 0.0, media)
+    return tc
+
+# Numerador (suma de partidas) y denominador de cada ratio cociente
+COMPONENTES_RATIO = {
+    "Liquidez General": (("_AC",), "_PC"),
+    "Tesorería": (("_Caja", "_Deudores"), "_PC"),
+    "Disponibilidad": (("_Caja",), "_PC"),
+    "Garantía": (("_ActivoTotal",), "_PasivoTotal"),
+    "Autonomía": (("_PN",), "_PasivoTotal"),
+    "Calidad Deuda": (("_PC",), "_PasivoTotal"),
+    "RAT": (("_BAII",), "_ActivoTotal"),
+    "RRP": (("_BN",), "_PN"),
+    "Costo Deuda (i)": (("_GastosFin",), "_DeudaTotal"),
+    "Margen Neto": (("_BN",), "_Ventas"),
+    "Rotación Activo": (("_Ventas",), "_ActivoTotal"),
+    "Multiplicador Capital": (("_ActivoTotal",), "_PN"),
+}
+
+def contribuciones_filiales(rv, r_grupo):
+    """
+    Aporte de cada filial a los ratios del grupo: numerador de la filial sobre
+    el denominador consolidado. Sin eliminaciones, los aportes suman el ratio
+    del grupo; con eliminaciones la diferencia es el efecto intercompañía.
+    Fondo de Maniobra es aditivo y se reparte directamente.
+    """
+    aportes = {"Fondo Maniobra": rv["Fondo Maniobra"]}
+    for nombre, (nums, den) in COMPONENTES_RATIO.items():
+        num = sum(rv[k] for k in nums)
+        aportes[nombre] = _div(num, r_grupo.get(den) or 0.0)
+    return aportes
+
+def anexo_contribuciones(t, rv, aportes, top=15):
+    """Anexo (tabla) con las filiales de mayor activo y su aporte a los ratios clave."""
+    claves = ["Fondo Maniobra", "Liquidez General", "Garantía", "RAT", "RRP"]
+    orden = np.argsort(-rv["_ActivoTotal"], kind="stable")[:top]
+    empresas = t.get("empresa")
+    filas = [["Filial"] + claves]
+    for j in orden:
+        nombre = str(empresas[j]) if empresas is not None else f"Filial {j + 1}"
+        filas.append([nombre] + [fmt_num(aportes[k][j], 3) for k in claves])
+    titulo = f"Aporte de las {len(orden)} principales filiales (de {len(rv['_ActivoTotal'])}) a los ratios consolidados 2024"
+    return {"titulo": titulo, "filas": filas}
+
+def generar_pdf_consolidado(t23, t24, filename="Informe_Consolidado.pdf", eliminaciones23=None, eliminaciones24=None, executor=None, moneda=None):
+    """Informe único del grupo a partir de las tablas de filiales de 2023 y 2024."""
+    r23 = calcular_ratios_from_inputs(inputs_de_fila(consolidar_tabla(t23, eliminaciones=eliminaciones23), 0))
+    r24 = calcular_ratios_from_inputs(inputs_de_fila(consolidar_tabla(t24, eliminaciones=eliminaciones24), 0))
+    rv24 = calcular_ratios_vectorizado(t24)
+    anexo = anexo_contribuciones(t24, rv24, contribuciones_filiales(rv24, r24))
+    generar_pdf_final(r23, r24, filename=filename, executor=executor, anexos=[anexo], moneda=moneda or MONEDA_INFORME)
+    return r23, r24
+
+# -----------------------------
+# Instantáneas columnares (.npy por columna + manifiesto)
+# -----------------------------
+VERSION_INSTANTANEA = 1
+
+def guardar_instantanea(carpeta, t, rv=None):
+    """
+    Guarda entradas, ratios calculados y códigos de clasificación de una
+    cartera como un .npy por columna más manifiesto.json (escrito al final,
+    así una instantánea a medio escribir no se considera válida).
+    Cada escritura usa nombres de archivo propios (c###.<generación>.npy): al
+    reescribir una carpeta nunca se truncan columnas que otro proceso tenga
+    mapeadas. Se conserva la generación anterior (la que lista el manifiesto
+    reemplazado) y se borra la previa a esa.
+    Las claves de texto (columna "empresa") se guardan como unicode fijo para
+    poder mapearlas en memoria.
+    """
+    rv = calcular_ratios_vectorizado(t) if rv is None else rv
+    os.makedirs(carpeta, exist_ok=True)
+    try:
+        with open(os.path.join(carpeta, "manifiesto.json"), encoding="utf-8") as f:
+            anterior = json.load(f)
+    except (OSError, ValueError):
+        anterior = None
+    generacion = f"{time.time_ns():x}{os.getpid():x}"
+    _, cce_codigo = clasificar_cce_vectorizado(rv)
+    columnas = [(k, "entrada", t[k]) for k in CAMPOS_ENTRADA]
+    columnas += [(k, "ratio", rv[k]) for k in rv if not k.startswith("_")]
+    columnas += [("situacion_codigo", "codigo", clasificar_situacion_vectorizado(rv)), ("cce_codigo", "codigo", cce_codigo)]
+    if "empresa" in t:
+        claves = np.asarray(t["empresa"]).astype(str)
+        columnas.insert(0, ("empresa", "clave", claves))
+        # Orden de las claves precalculado: comparar_instantaneas cruza sin reordenar
+        columnas.append(("orden_empresa", "indice", np.argsort(claves, kind="stable")))
+    manifiesto = {"version": VERSION_INSTANTANEA, "filas": int(len(t["activo_corriente"])), "columnas": [],
+                  "etiquetas": {"situacion_codigo": ETIQUETAS_SITUACION, "cce_codigo": ETIQUETAS_CCE}}
+    for i, (nombre, grupo, col) in enumerate(columnas):
+        archivo = f"c{i:03d}.{generacion}.npy"
+        col = np.ascontiguousarray(col)
+        np.save(os.path.join(carpeta, archivo), col, allow_pickle=False)
+        manifiesto["columnas"].append({"nombre": nombre, "grupo": grupo, "archivo": archivo, "dtype": col.dtype.str})
+    manifiesto["anteriores"] = [c["archivo"] for c in anterior["columnas"]] if anterior else []
+    tmp = os.path.join(carpeta, f"manifiesto.json.{generacion}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, os.path.join(carpeta, "manifiesto.json"))
+    # Solo se borran archivos de manifiestos ya reemplazados, nunca los de otra escritura en curso
+    vigentes = {c["archivo"] for c in manifiesto["columnas"]} | set(manifiesto["anteriores"])
+    for archivo in (anterior or {}).get("anteriores", []):
+        if archivo not in vigentes:
+            try:
+                os.remove(os.path.join(carpeta, archivo))
+            except FileNotFoundError:
+                pass
+    return manifiesto
+
+class Instantanea:
+    """
+    Instantánea abierta con cargar_instantanea(): cada columna se abre con
+    np.load(mmap_mode="r") la primera vez que se pide, de modo que solo se
+    leen de disco las páginas que toca la consulta.
+    """
+    def __init__(self, carpeta):
+        self.carpeta = carpeta
+        with open(os.path.join(carpeta, "manifiesto.json"), encoding="utf-8") as f:
+            self.manifiesto = json.load(f)
+        if self.manifiesto.get("version") != VERSION_INSTANTANEA:
+            raise ValueError(f"Versión de instantánea no soportada: {self.manifiesto.get('version')}")
+        self.filas = self.manifiesto["filas"]
+        self.etiquetas = self.manifiesto.get("etiquetas", {})
+        self._info = {c["nombre"]: c for c in self.manifiesto["columnas"]}
+        self._abiertas = {}
+
+    def __getitem__(self, nombre):
+        if nombre not in self._abiertas:
+            info = self._info[nombre]
+            self._abiertas[nombre] = np.load(os.path.join(self.carpeta, info["archivo"]), mmap_mode="r", allow_pickle=False)
+        return self._abiertas[nombre]
+
+    def __contains__(self, nombre):
+        return nombre in self._info
+
+    def __len__(self):
+        return self.filas
+
+    def columnas(self, grupo=None):
+        return [n for n, c in self._info.items() if grupo is None or c["grupo"] == grupo]
+
+    def tabla(self):
+        """Entradas como tabla columnar (mapeadas), lista para calcular_ratios_vectorizado."""
+        t = {k: self[k] for k in self.columnas("entrada")}
+        if "empresa" in self:
+            t["empresa"] = self["empresa"]
+        return t
+
+    def etiqueta(self, nombre_codigo, codigos):
+        """Traduce códigos de clasificación a sus etiquetas en texto."""
+        return np.asarray(self.etiquetas[nombre_codigo], dtype=object)[np.asarray(codigos)]
+
+def cargar_instantanea(carpeta):
+    return Instantanea(carpeta)
+
+# -----------------------------
+# Diferencias entre instantáneas (ejecución anterior vs actual)
+# -----------------------------
+RATIOS_MOVIMIENTO = ("RAT", "RRP")
+UMBRAL_MOVIMIENTO = 0.10
+
+def umbrales_por_defecto():
+    """Límites finitos del rango óptimo de cada ratio del registro: {ratio: [umbrales]}."""
+    umbrales = {}
+    for nombre, info in REGISTRO_RATIOS.items():
+        limites = [u for u in (info["optimo"] or ()) if u is not None]
+        if limites:
+            umbrales[nombre] = limites
+    return umbrales
+
+def _claves_ordenadas(inst):
+    claves = np.asarray(inst["empresa"])
+    if "orden_empresa" in inst:
+        orden = np.asarray(inst["orden_empresa"])
+    else:
+        orden = np.argsort(claves, kind="stable")
+    ordenadas = claves[orden]
+    repetidas = np.flatnonzero(ordenadas[1:] == ordenadas[:-1])
+    if len(repetidas):
+        raise ValueError(f"Clave de empresa repetida en la instantánea: {ordenadas[repetidas[0]]!r}")
+    return orden, ordenadas
+
+def emparejar_claves(a, b):
+    """
+    Cruce de dos arrays de claves ordenadas y sin repetir. Como `b` también
+    está ordenado, searchsorted avanza como un merge sobre `a`.
+    Devuelve (ia, ib, solo_a, solo_b): posiciones emparejadas y las que solo
+    están en uno de los dos lados.
+    """
+    pos = np.searchsorted(a, b)
+    if len(a):
+        en_a = (pos < len(a)) & (a[np.minimum(pos, len(a) - 1)] == b)
+    else:
+        en_a = np.zeros(len(b), dtype=bool)
+    ib = np.flatnonzero(en_a)
+    ia = pos[ib]
+    libres = np.ones(len(a), dtype=bool)
+    libres[ia] = False
+    return ia, ib, np.flatnonzero(libres), np.flatnonzero(~en_a)
+
+def comparar_instantaneas(anterior, actual, umbrales=None, movimiento=UMBRAL_MOVIMIENTO, ratios_movimiento=RATIOS_MOVIMIENTO):
+    """
+    Cambios entre dos instantáneas (carpetas, Instantanea o dicts con las mismas
+    columnas) alineadas por la columna "empresa":
+    - altas / bajas: empresas que solo están en una de las dos.
+    - situacion / cce: cambios de código de clasificación.
+    - umbrales: ratios que cruzan alguno de sus umbrales ({ratio: [valores]};
+      por defecto los límites del rango óptimo del registro).
+    - movimientos: variación relativa |actual/anterior - 1| > `movimiento` en ratios_movimiento.
+    Todo se calcula con operaciones sobre columnas; solo se materializan las filas que cambian.
+    """
+    if isinstance(anterior, str):
+        anterior = cargar_instantanea(anterior)
+    if isinstance(actual, str):
+        actual = cargar_instantanea(actual)
+    orden_a, claves_a = _claves_ordenadas(anterior)
+    orden_b, claves_b = _claves_ordenadas(actual)
+    ia, ib, solo_a, solo_b = emparejar_claves(claves_a, claves_b)
+    fa = orden_a[ia]; fb = orden_b[ib]
+    empresas = claves_b[ib]
+    dif = {
+        "emparejadas": int(len(ia)),
+        "altas": claves_b[solo_b],
+        "bajas": claves_a[solo_a],
+        "situacion": {}, "cce": {}, "umbrales": [], "movimientos": {},
+    }
+    for nombre, codigo in (("situacion", "situacion_codigo"), ("cce", "cce_codigo")):
+        antes = np.asarray(anterior[codigo])[fa]; despues = np.asarray(actual[codigo])[fb]
+        cambia = np.flatnonzero(antes != despues)
+        dif[nombre] = {"empresa": empresas[cambia], "antes": antes[cambia], "despues": despues[cambia]}
+    umbrales = umbrales_por_defecto() if umbrales is None else umbrales
+    for ratio, valores in umbrales.items():
+        if ratio not in anterior or ratio not in actual:
+            continue
+        antes = np.asarray(anterior[ratio])[fa]; despues = np.asarray(actual[ratio])[fb]
+        finitos = np.isfinite(antes) & np.isfinite(despues)
+        for u in np.atleast_1d(valores):
+            cambia = np.flatnonzero(finitos & ((antes >= u) != (despues >= u)))
+            if len(cambia):
+                dif["umbrales"].append({"ratio": ratio, "umbral": float(u), "empresa": empresas[cambia],
+                                        "antes": antes[cambia], "despues": despues[cambia]})
+    for ratio in ratios_movimiento:
+        if ratio not in anterior or ratio not in actual:
+            continue
+        antes = np.asarray(anterior[ratio])[fa]; despues = np.asarray(actual[ratio])[fb]
+        variacion = _div(despues - antes, np.abs(antes))
+        cambia = np.flatnonzero(np.abs(variacion) > movimiento)
+        dif["movimientos"][ratio] = {"empresa": empresas[cambia], "antes": antes[cambia],
+                                     "despues": despues[cambia], "variacion": variacion[cambia]}
+    return dif
+
+def filas_informe_cambios(dif):
+    """Informe compacto: [empresa, tipo, campo, antes, después] por cada cambio detectado."""
+    filas = [[str(e), "alta", "", "", ""] for e in dif["altas"]]
+    filas += [[str(e), "baja", "", "", ""] for e in dif["bajas"]]
+    for nombre, etiquetas in (("situacion", ETIQUETAS_SITUACION), ("cce", ETIQUETAS_CCE)):
+        c = dif[nombre]
+        filas += [[str(e), "clasificacion", nombre, etiquetas[a], etiquetas[d]] for e, a, d in zip(c["empresa"], c["antes"], c["despues"])]
+    for c in dif["umbrales"]:
+        campo = f"{c['ratio']} {fmt_num(c['umbral'])}"
+        filas += [[str(e), "umbral", campo, fmt_num(a, 3), fmt_num(d, 3)] for e, a, d in zip(c["empresa"], c["antes"], c["despues"])]
+    for ratio, c in dif["movimientos"].items():
+        filas += [[str(e), "movimiento", f"{ratio} ({fmt_num(v * 100, 1)}%)", fmt_num(a, 4), fmt_num(d, 4)]
+                  for e, a, d, v in zip(c["empresa"], c["antes"], c["despues"], c["variacion"])]
+    return filas
+
+def resumen_cambios(dif):
+    return {
+        "emparejadas": dif["emparejadas"],
+        "altas": int(len(dif["altas"])),
+        "bajas": int(len(dif["bajas"])),
+        "situacion": int(len(dif["situacion"]["empresa"])),
+        "cce": int(len(dif["cce"]["empresa"])),
+        "umbrales": {f"{c['ratio']} {c['umbral']:g}": int(len(c["empresa"])) for c in dif["umbrales"]},
+        "movimientos": {r: int(len(c["empresa"])) for r, c in dif["movimientos"].items()},
+    }
+
+def escribir_informe_cambios(ruta, dif):
+    """CSV con una fila por cambio (ver filas_informe_cambios)."""
+    tmp = ruta + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["empresa", "tipo", "campo", "antes", "despues"])
+        w.writerows(filas_informe_cambios(dif))
+    os.replace(tmp, ruta)
+    return resumen_cambios(dif)
+
+# -----------------------------
+# Monitor continuo de ratios (movimientos de mayor)
+# -----------------------------
+# Cuentas que admite el monitor y a qué agregado pertenecen
+CUENTAS_AC = ("caja", "deudores", "inventario", "otros_ac")
+CUENTAS_PC = ("proveedores", "otros_pc")
+CUENTAS_FLUJO = ("ventas", "costo_ventas")
+CUENTAS_MONITOR = CUENTAS_AC + CUENTAS_PC + ("pasivo_no_corriente",) + CUENTAS_FLUJO
+VENTANA_FLUJOS = 365  # días: las cuentas de flujo son la suma móvil del último año
+
+# (ratio, operador, límite, descripción). Calidad Deuda usa el umbral del registro.
+REGLAS_MONITOR = [
+    ("Liquidez General", "<", 1.0, "Liquidez General < 1"),
+    ("Calidad Deuda", ">", REGISTRO_RATIOS["Calidad Deuda"]["optimo"][1], REGISTRO_RATIOS["Calidad Deuda"]["optimo_texto"]),
+    ("CCE", ">", 60.0, "CCE > 60 días"),
+]
+
+def _m_liquidez(m): return m.ac / m.pc if m.pc else None
+def _m_tesoreria(m): return (m.saldos["caja"] + m.saldos["deudores"]) / m.pc if m.pc else None
+def _m_disponibilidad(m): return m.saldos["caja"] / m.pc if m.pc else None
+def _m_calidad(m):
+    pasivo = m.pc + m.saldos["pasivo_no_corriente"]
+    return m.pc / pasivo if pasivo else None
+def _m_cce(m):
+    s = m.saldos; ventas = s["ventas"]; costo = s["costo_ventas"]
+    if not ventas or not costo:
+        return None
+    # CCE = días inventario + días clientes - días proveedores
+    return (s["inventario"] - s["proveedores"]) * 365 / costo + s["deudores"] * 365 / ventas
+
+_CALCULO_MONITOR = {
+    "Liquidez General": _m_liquidez, "Tesorería": _m_tesoreria, "Disponibilidad": _m_disponibilidad,
+    "Calidad Deuda": _m_calidad, "CCE": _m_cce,
+}
+# Ratios que cambian con cada cuenta (solo esos se recalculan)
+_AFECTADOS_POR_CUENTA = {
+    "caja": ("Liquidez General", "Tesorería", "Disponibilidad"),
+    "deudores": ("Liquidez General", "Tesorería", "CCE"),
+    "inventario": ("Liquidez General", "CCE"),
+    "otros_ac": ("Liquidez General",),
+    "proveedores": ("Liquidez General", "Tesorería", "Disponibilidad", "Calidad Deuda", "CCE"),
+    "otros_pc": ("Liquidez General", "Tesorería", "Disponibilidad", "Calidad Deuda"),
+    "pasivo_no_corriente": ("Calidad Deuda",),
+    "ventas": ("CCE",),
+    "costo_ventas": ("CCE",),
+}
+
+def _dia_de_marca(marca):
+    """Ordinal del día de una marca 'AAAA-MM-DD...' o date/datetime; None si no es una fecha."""
+    if isinstance(marca, datetime.date):
+        return marca.toordinal()
+    if isinstance(marca, str) and len(marca) >= 10:
+        try:
+            return datetime.date.fromisoformat(marca[:10]).toordinal()
+        except ValueError:
+            return None
+    return None
+
+class MonitorRatios:
+    """
+    Saldos acumulados a partir de movimientos (cuenta, importe) con
+    actualización O(1): cada movimiento ajusta su saldo y los agregados AC/PC
+    y recalcula solo los ratios que dependen de esa cuenta. Al cruzar un
+    umbral de REGLAS_MONITOR (en cualquier sentido) se registra una alerta.
+    Los días del CCE se derivan de saldos: Inventario y Proveedores sobre
+    Costo de ventas, Deudores sobre Ventas (x365).
+    Ventas y Costo de ventas son flujos anuales: se suman en una ventana móvil
+    de VENTANA_FLUJOS días según la fecha de la marca de cada movimiento, y
+    los importes anuales de `r` (ejercicio cerrado en `fecha_base`, por
+    defecto la víspera del primer movimiento con fecha) salen de la ventana
+    a prorrata. Los movimientos se suponen en orden; una marca sin fecha o
+    anterior a la última cuenta en el día en curso.
+    """
+    def __init__(self, r=None, reglas=None, al_alertar=None, fecha_base=None):
+        r = r or {}
+        self.saldos = {c: 0.0 for c in CUENTAS_MONITOR}
+        s = self.saldos
+        s["caja"] = r.get("_Caja") or 0.0
+        s["deudores"] = r.get("_Deudores") or 0.0
+        s["inventario"] = r.get("_Inventario") or 0.0
+        s["otros_ac"] = (r.get("_AC") or 0.0) - s["caja"] - s["deudores"] - s["inventario"]
+        s["ventas"] = r.get("_Ventas") or 0.0
+        s["costo_ventas"] = r.get("_Costo") or 0.0
+        pc = r.get("_PC") or 0.0
+        s["proveedores"] = min(pc, (r.get("_dias_proveedores") or 0.0) * s["costo_ventas"] / 365)
+        s["otros_pc"] = pc - s["proveedores"]
+        s["pasivo_no_corriente"] = r.get("_PNC") or 0.0
+        self.ac = sum(s[c] for c in CUENTAS_AC)
+        self.pc = sum(s[c] for c in CUENTAS_PC)
+        self._flujo_base = {c: s[c] for c in CUENTAS_FLUJO}
+        self._ventana = {c: deque() for c in CUENTAS_FLUJO}   # [día, importe del día]
+        self._suma_ventana = {c: 0.0 for c in CUENTAS_FLUJO}
+        self._dia_base = None if fecha_base is None else _dia_de_marca(fecha_base)
+        self._dia = self._dia_base
+        self._ultima_marca = None
+        self.al_alertar = al_alertar
+        self.alertas = []
+        self.eventos = 0
+        self._reglas = {}
+        for i, (ratio, op, limite, texto) in enumerate(reglas or REGLAS_MONITOR):
+            self._reglas.setdefault(ratio, []).append((i, op == "<", limite, texto))
+        self._en_alerta = set()
+        self._afectados = {c: tuple((n, _CALCULO_MONITOR[n], self._reglas.get(n, ())) for n in nombres)
+                           for c, nombres in _AFECTADOS_POR_CUENTA.items()}
+        self.ratios = {}
+        for nombre, f in _CALCULO_MONITOR.items():
+            self.ratios[nombre] = v = f(self)
+            self._evaluar(nombre, v, self._reglas.get(nombre, ()), "inicial")
+
+    def _evaluar(self, nombre, v, reglas, marca):
+        for i, menor, limite, texto in reglas:
+            violada = v is not None and (v < limite if menor else v > limite)
+            if violada != (i in self._en_alerta):
+                if violada: self._en_alerta.add(i)
+                else: self._en_alerta.discard(i)
+                alerta = {"marca": marca, "ratio": nombre, "valor": v, "regla": texto, "estado": "alerta" if violada else "normal"}
+                self.alertas.append(alerta)
+                if self.al_alertar: self.al_alertar(alerta)
+
+    def aplicar(self, cuenta, importe, marca=None):
+        """Aplica un movimiento (importe con signo) y devuelve los ratios actualizados."""
+        try:
+            afectados = self._afectados[cuenta]
+        except KeyError:
+            raise ValueError(f"Cuenta desconocida para el monitor: {cuenta!r}")
+        if marca is not None and marca != self._ultima_marca:
+            self._ultima_marca = marca
+            dia = _dia_de_marca(marca)
+            if dia is not None and (self._dia is None or dia > self._dia):
+                self._avanzar(dia, marca)
+        self.saldos[cuenta] += importe
+        if cuenta in CUENTAS_AC: self.ac += importe
+        elif cuenta in CUENTAS_PC: self.pc += importe
+        elif cuenta in CUENTAS_FLUJO:
+            q = self._ventana[cuenta]
+            if q and q[-1][0] == self._dia:
+                q[-1][1] += importe
+            else:
+                q.append([self._dia, importe])
+            self._suma_ventana[cuenta] += importe
+        self.eventos += 1
+        ratios = self.ratios
+        for nombre, f, reglas in afectados:
+            ratios[nombre] = v = f(self)
+            if reglas: self._evaluar(nombre, v, reglas, marca)
+        return ratios
+
+    def _avanzar(self, dia, marca):
+        """Mueve la ventana de flujos al día `dia` y reevalúa el CCE."""
+        if self._dia_base is None:
+            self._dia_base = dia - 1
+        self._dia = dia
+        limite = dia - VENTANA_FLUJOS
+        resto = max(0.0, 1.0 - (dia - self._dia_base) / VENTANA_FLUJOS)
+        for c in CUENTAS_FLUJO:
+            q = self._ventana[c]
+            while q and q[0][0] is not None and q[0][0] <= limite:
+                self._suma_ventana[c] -= q.popleft()[1]
+            self.saldos[c] = self._flujo_base[c] * resto + self._suma_ventana[c]
+        self.ratios["CCE"] = v = _m_cce(self)
+        self._evaluar("CCE", v, self._reglas.get("CCE", ()), marca)
+
+def reproducir_movimientos(ruta, monitor):
+    """Aplica al monitor un archivo CSV 'marca,cuenta,importe' (con cabecera). Devuelve nº de eventos."""
+    aplicar = monitor.aplicar
+    n = 0
+    with open(ruta, newline="", encoding="utf-8") as f:
+        lector = csv.reader(f)
+        next(lector, None)
+        for marca, cuenta, importe in lector:
+            aplicar(cuenta, float(importe), marca)
+            n += 1
+    return n
+
+# -----------------------------
+# Lectura de archivos de balance
+# -----------------------------
+def _a_float(txt):
+    txt = str(txt).strip() if txt is not None else ""
+    if txt == "":
+        return None
+    try:
+        return float(txt)
+    except ValueError:
+        return None
+
+def leer_balance(ruta):
+    """
+    Lee un archivo de balance con el mismo formato que App.leer_inputs
+    ({"2023": {campo: valor}, "2024": {...}}). Admite:
+    - .json: {"2023": {...}, "2024": {...}}
+    - .csv:  cabecera "campo,2023,2024" y una fila por campo.
+    Los campos desconocidos se ignoran; los ilegibles quedan en None.
+    """
+    data = {"2023": {}, "2024": {}}
+    if ruta.lower().endswith(".json"):
+        with open(ruta, encoding="utf-8") as f:
+            crudo = json.load(f)
+        for yr in data:
+            for k in CAMPOS_ENTRADA:
+                data[yr][k] = _a_float((crudo.get(yr) or {}).get(k))
+        return data
+    with open(ruta, newline="", encoding="utf-8") as f:
+        for fila in csv.DictReader(f):
+            k = (fila.get("campo") or "").strip()
+            if k in CAMPOS_ENTRADA:
+                for yr in data:
+                    data[yr][k] = _a_float(fila.get(yr))
+    for yr in data:
+        for k in CAMPOS_ENTRADA:
+            data[yr].setdefault(k, None)
+    return data
+
+# -----------------------------
+# Validación y normalización de entradas
+# -----------------------------
+# El orden fija el bit de cada código en la máscara de validar_tabla
+CODIGOS_VALIDACION = [
+    ("E01_AUSENTE", "Falta una partida del balance (AC, ANC, PC, PNC o PN) o no es numérica"),
+    ("E02_NO_FINITO", "Valor infinito"),
+    ("E03_SIGNO", "Partida con signo negativo (solo PN y Beneficio Neto pueden serlo)"),
+    ("E04_IDENTIDAD", "Activo distinto de Pasivo + Patrimonio Neto"),
+    ("E05_DESGLOSE_AC", "Deudores + Inventario + Caja superan el Activo Corriente"),
+    ("E06_TASA", "Tasa de interés (i) fuera de [0, 1]"),
+]
+BIT_VALIDACION = {codigo: np.uint8(1 << b) for b, (codigo, _) in enumerate(CODIGOS_VALIDACION)}
+CAMPOS_OBLIGATORIOS = ["activo_corriente", "activo_no_corriente", "pasivo_corriente", "pasivo_no_corriente", "patrimonio_neto"]
+CAMPOS_CON_SIGNO = ("patrimonio_neto", "beneficio_neto")
+CAMPOS_NO_NEGATIVOS = [k for k in CAMPOS_ENTRADA if k not in CAMPOS_CON_SIGNO and k != "i"]
+BLOQUE_VALIDACION = 1 << 14
+
+def _marcar(mascara, codigo, condicion):
+    # Multiplicar el bool (visto como 0/1) por el bit evita el where= con saltos
+    mascara |= condicion.view(np.uint8) * BIT_VALIDACION[codigo]
+
+def _validar_bloque(t, sl, mascara, tolerancia, tolerancia_abs):
+    col = {k: t[k][sl] for k in CAMPOS_ENTRADA}
+    malo = np.isnan(col[CAMPOS_OBLIGATORIOS[0]])
+    for k in CAMPOS_OBLIGATORIOS[1:]:
+        malo |= np.isnan(col[k])
+    _marcar(mascara, "E01_AUSENTE", malo)
+    # Infinitos: la suma de todas las columnas solo deja de ser finita si alguna
+    # es inf o NaN; el detalle se mira únicamente en esas filas (pocas)
+    total = col[CAMPOS_ENTRADA[0]].copy()
+    for k in CAMPOS_ENTRADA[1:]:
+        total += col[k]
+    sospechosas = np.flatnonzero(~np.isfinite(total))
+    if len(sospechosas):
+        inf = np.zeros(len(sospechosas), dtype=bool)
+        for k in CAMPOS_ENTRADA:
+            inf |= np.isinf(col[k][sospechosas])
+        mascara[sospechosas[inf]] |= BIT_VALIDACION["E02_NO_FINITO"]
+    # Signo: mínimo (ignorando NaN) de las columnas que no pueden ser negativas
+    np.fmin(col[CAMPOS_NO_NEGATIVOS[0]], col[CAMPOS_NO_NEGATIVOS[1]], out=total)
+    for k in CAMPOS_NO_NEGATIVOS[2:]:
+        np.fmin(total, col[k], out=total)
+    _marcar(mascara, "E03_SIGNO", total < 0)
+    # Las comparaciones con NaN dan False: una fila incompleta solo lleva E01
+    activo = col["activo_corriente"] + col["activo_no_corriente"]
+    np.add(col["pasivo_corriente"], col["pasivo_no_corriente"], out=total); total += col["patrimonio_neto"]
+    total -= activo; np.abs(total, out=total)
+    np.abs(activo, out=activo); activo *= tolerancia; activo += tolerancia_abs
+    _marcar(mascara, "E04_IDENTIDAD", total > activo)
+    np.add(col["deudores"], col["inventario"], out=total); total += col["caja"]
+    total -= col["activo_corriente"]
+    _marcar(mascara, "E05_DESGLOSE_AC", total > tolerancia_abs)
+    _marcar(mascara, "E06_TASA", (col["i"] < 0) | (col["i"] > 1))
+
+def validar_tabla(t, tolerancia=0.005, tolerancia_abs=0.5, bloque=BLOQUE_VALIDACION):
+    """
+    Comprobaciones vectorizadas sobre una tabla columnar (idealmente creada con
+    conservar_ausentes=True). Devuelve una máscara uint8 por fila con un bit por
+    código de CODIGOS_VALIDACION (0 = fila correcta). La identidad
+    Activo = Pasivo + PN admite una diferencia de tolerancia_abs + tolerancia * |Activo|.
+    Se recorre por bloques de filas para que los temporales quepan en caché.
+    """
+    n = len(t["activo_corriente"])
+    mascara = np.zeros(n, dtype=np.uint8)
+    for ini in range(0, n, bloque):
+        sl = slice(ini, min(ini + bloque, n))
+        _validar_bloque(t, sl, mascara[sl], tolerancia, tolerancia_abs)
+    return mascara
+
+def normalizar_tabla(t):
+    """Rellena los NaN de una tabla validada como lo hace el cálculo escalar: 0.0, o 0.05 en la tasa i."""
+    out = dict(t)
+    for k in CAMPOS_ENTRADA:
+        faltan = np.isnan(t[k])
+        if faltan.any():
+            out[k] = np.where(faltan, 0.05 if k == "i" else 0.0, t[k])
+    return out
+
+def codigos_de_mascara(valor):
+    """Códigos activos en la máscara de una fila."""
+    return [codigo for codigo, _ in CODIGOS_VALIDACION if int(valor) & int(BIT_VALIDACION[codigo])]
+
+def validar_inputs(d):
+    """Códigos de error de un único dict de entrada (formato de App.leer_inputs)."""
+    return codigos_de_mascara(validar_tabla(tabla_desde_inputs([d], conservar_ausentes=True))[0])
+
+def resumen_validacion(mascara, empresas=None, ejemplos=10):
+    """Recuento por código y las primeras filas afectadas con sus códigos."""
+    filas = np.flatnonzero(mascara)
+    por_codigo = {codigo: int(np.count_nonzero(mascara & bit)) for codigo, bit in BIT_VALIDACION.items()}
+    return {
+        "filas": int(len(mascara)),
+        "con_errores": int(len(filas)),
+        "por_codigo": {k: v for k, v in por_codigo.items() if v},
+        "ejemplos": [(str(empresas[j]) if empresas is not None else int(j), codigos_de_mascara(mascara[j])) for j in filas[:ejemplos]],
+    }
+
+# -----------------------------
+# Conversión de moneda y precios constantes
+# -----------------------------
+# Las cotizaciones se expresan como unidades de cada moneda por una unidad de
+# la moneda pivote; el tipo cruzado es cot[informe] / cot[origen] a la misma fecha.
+MONEDA_INFORME = "BOB"
+MONEDA_PIVOTE = "USD"
+SIMBOLOS_MONEDA = {"BOB": "Bs.", "USD": "US$", "EUR": "€", "ARS": "AR$", "PEN": "S/", "CLP": "CLP$", "BRL": "R$", "PYG": "₲"}
+FECHAS_CIERRE = {"2023": "2023-12-31", "2024": "2024-12-31"}
+_DESPLAZAMIENTO_DIAS = 1 << 31
+
+def simbolo_moneda(moneda):
+    return SIMBOLOS_MONEDA.get(moneda, moneda)
+
+def _dias(fechas):
+    """Fechas ('AAAA-MM-DD', date o datetime64) -> días desde 1970 como int64 no negativo."""
+    return np.asarray(fechas, dtype="datetime64[D]").astype(np.int64) + _DESPLAZAMIENTO_DIAS
+
+def preparar_series(series):
+    """
+    {clave: (fechas, valores)} -> índice con una única llave ordenada
+    codigo_clave * 2**32 + día, para resolver todas las consultas con un solo
+    searchsorted aunque cada fila pida una clave distinta.
+    """
+    claves = np.array(sorted(series), dtype=str)
+    llaves, valores = [], []
+    for codigo, clave in enumerate(claves):
+        fechas, v = series[clave]
+        llaves.append((np.int64(codigo) << 32) | _dias(fechas))
+        valores.append(np.asarray(v, dtype=float))
+    llaves = np.concatenate(llaves) if llaves else np.zeros(0, dtype=np.int64)
+    valores = np.concatenate(valores) if valores else np.zeros(0)
+    orden = np.argsort(llaves, kind="stable")
+    return {"claves": claves, "llaves": llaves[orden], "valores": valores[orden]}
+
+def _codigos_clave(serie, claves):
+    claves = np.asarray(claves, dtype=str)
+    if not len(serie["claves"]):
+        return np.zeros(claves.shape, dtype=np.int64), np.zeros(claves.shape, dtype=bool)
+    codigos = np.minimum(np.searchsorted(serie["claves"], claves), len(serie["claves"]) - 1)
+    return codigos.astype(np.int64), serie["claves"][codigos] == claves
+
+def consultar_series(serie, claves, fechas):
+    """
+    Valor vigente (último publicado en o antes de la fecha) para cada par
+    (clave, fecha). NaN si la clave no existe o la fecha es anterior al primer dato.
+    `claves` y `fechas` pueden ser escalares o arrays (se difunden).
+    """
+    codigos, validas = _codigos_clave(serie, claves)
+    dias = _dias(fechas)
+    codigos, validas, dias = np.broadcast_arrays(codigos, validas, dias)
+    llave = (codigos << 32) | dias
+    pos = np.searchsorted(serie["llaves"], llave, side="right") - 1
+    ok = validas & (pos >= 0)
+    pos = np.maximum(pos, 0)
+    if len(serie["llaves"]):
+        ok &= (serie["llaves"][pos] >> 32) == codigos
+        return np.where(ok, serie["valores"][pos], np.nan)
+    return np.full(llave.shape, np.nan)
+
+def preparar_tipos_cambio(cotizaciones, pivote=MONEDA_PIVOTE):
+    """{moneda: (fechas, unidades por 1 `pivote`)}; la propia moneda pivote vale 1 siempre."""
+    cotizaciones = dict(cotizaciones)
+    cotizaciones.setdefault(pivote, (np.array([-_DESPLAZAMIENTO_DIAS], dtype="datetime64[D]"), [1.0]))
+    return preparar_series(cotizaciones)
+
+def preparar_ipc(fechas, indices):
+    return preparar_series({"IPC": (fechas, indices)})
+
+def factor_conversion(tipos, monedas, fechas, moneda_informe=MONEDA_INFORME):
+    """Multiplicador de cada fila para pasar de su moneda a `moneda_informe` a la fecha dada."""
+    monedas = np.asarray(monedas, dtype=str)
+    destino = consultar_series(tipos, moneda_informe, fechas)
+    factor = destino / consultar_series(tipos, monedas, fechas)
+    return np.where(monedas == moneda_informe, 1.0, factor)
+
+def factor_deflactor(ipc, fechas, fecha_base):
+    """IPC(fecha_base) / IPC(fecha): lleva los importes a precios constantes de fecha_base."""
+    return consultar_series(ipc, "IPC", fecha_base) / consultar_series(ipc, "IPC", fechas)
+
+def convertir_tabla(t, monedas, fechas, tipos=None, moneda_informe=MONEDA_INFORME, ipc=None, fecha_base=None):
+    """
+    Pasa los importes (PARTIDAS_SUMABLES) de una tabla columnar a `moneda_informe`
+    y, si se da `ipc`, a precios constantes de `fecha_base` (por defecto la
+    fecha más reciente). La tasa i y los días no cambian. Se aplica el tipo y el
+    IPC de la fecha de cierre a todas las partidas, también a las de resultados.
+    Sin cotización o IPC para una fila, sus importes quedan NaN (E01 en validar_tabla).
+    """
+    n = len(t["activo_corriente"])
+    factor = np.ones(n)
+    if tipos is not None:
+        factor = factor * factor_conversion(tipos, monedas, fechas, moneda_informe)
+    if ipc is not None:
+        if fecha_base is None:
+            fecha_base = np.asarray(fechas, dtype="datetime64[D]").max()
+        factor = factor * factor_deflactor(ipc, fechas, fecha_base)
+    out = dict(t)
+    for k in PARTIDAS_SUMABLES:
+        out[k] = t[k] * factor
+    return out
+
+def convertir_balance(data, moneda, tipos=None, moneda_informe=MONEDA_INFORME, ipc=None, fecha_base=None, fechas=None):
+    """
+    Versión de convertir_tabla para un balance de leer_balance / App.leer_inputs
+    ({"2023": {...}, "2024": {...}}): deja ambos ejercicios comparables en
+    generar_analisis_horizontal y en la matriz D1. Los valores ausentes siguen en None.
+    """
+    fechas = dict(FECHAS_CIERRE, **(fechas or {}))
+    anios = [yr for yr in ("2023", "2024") if yr in data]
+    t = tabla_desde_inputs([data[yr] for yr in anios], conservar_ausentes=True)
+    t = convertir_tabla(t, [moneda] * len(anios), [fechas[yr] for yr in anios], tipos, moneda_informe, ipc, fecha_base)
+    out = {}
+    for j, yr in enumerate(anios):
+        out[yr] = {k: (None if np.isnan(t[k][j]) else float(t[k][j])) for k in CAMPOS_ENTRADA}
+    return out
+
+def leer_tipos_cambio(ruta, pivote=MONEDA_PIVOTE):
+    """CSV con cabecera fecha,moneda,tasa (unidades de `moneda` por 1 `pivote`)."""
+    cotizaciones = {}
+    with open(ruta, newline="", encoding="utf-8") as f:
+        for fila in csv.DictReader(f):
+            tasa = _a_float(fila.get("tasa"))
+            moneda = (fila.get("moneda") or "").strip().upper()
+            if tasa is None or not moneda:
+                continue
+            fechas, tasas = cotizaciones.setdefault(moneda, ([], []))
+            fechas.append(fila["fecha"].strip()); tasas.append(tasa)
+    return preparar_tipos_cambio(cotizaciones, pivote)
+
+def leer_ipc(ruta):
+    """CSV con cabecera fecha,indice."""
+    fechas, indices = [], []
+    with open(ruta, newline="", encoding="utf-8") as f:
+        for fila in csv.DictReader(f):
+            indice = _a_float(fila.get("indice"))
+            if indice is not None:
+                fechas.append(fila["fecha"].strip()); indices.append(indice)
+    return preparar_ipc(fechas, indices)
+
+def opciones_conversion(moneda=MONEDA_INFORME, tipos=None, moneda_informe=MONEDA_INFORME, ipc=None, fecha_base=None):
+    """
+    Parámetros de convertir_balance para las rutas de entrada (App, vigilancia, lotes).
+    `tipos` e `ipc` son rutas CSV (leer_tipos_cambio / leer_ipc) o series ya preparadas.
+    Sin tipos de cambio los importes se quedan en `moneda`.
+    """
+    if isinstance(tipos, str): tipos = leer_tipos_cambio(tipos)
+    if isinstance(ipc, str): ipc = leer_ipc(ipc)
+    if tipos is None:
+        moneda_informe = moneda
+    else:
+        faltan = [m for m in (moneda, moneda_informe) if m not in tipos["claves"]]
+        if faltan:
+            raise ValueError(f"Sin cotizaciones para {', '.join(faltan)}")
+    return {"moneda": moneda, "tipos": tipos, "moneda_informe": moneda_informe, "ipc": ipc, "fecha_base": fecha_base}
+
+def convertir_entrada(data, conversion=None):
+    """Aplica opciones_conversion a un balance; devuelve (balance, moneda de sus importes)."""
+    if conversion is None:
+        return data, MONEDA_INFORME
+    if conversion["tipos"] is not None or conversion["ipc"] is not None:
+        data = convertir_balance(data, conversion["moneda"], conversion["tipos"], conversion["moneda_informe"],
+                                 conversion["ipc"], conversion["fecha_base"])
+    return data, conversion["moneda_informe"]
+
+# -----------------------------
+# Búsqueda de objetivos (recomendaciones dirigidas)
+# -----------------------------
+OBJETIVOS_POR_DEFECTO = {"liquidez_min": 1.5, "rrp_min": None, "cce_max": 60.0, "z_min": None}
+
+def tabla_de_ratios(r):
+    """Convierte un dict de ratios escalares en una tabla de una fila (None -> NaN)."""
+    return {k: np.array([np.nan if v is None else v], dtype=float) for k, v in r.items() if not isinstance(v, str)}
+
+def buscar_objetivo(f, objetivo, lo, hi, iteraciones=60):
+    """
+    Bisección vectorizada: para cada fila busca el menor x en [lo, hi] con
+    f(x) >= objetivo, suponiendo f creciente en x. Devuelve NaN donde ni hi
+    alcanza el objetivo. f recibe y devuelve arrays.
+    """
+    lo, hi = np.broadcast_arrays(np.asarray(lo, dtype=float), np.asarray(hi, dtype=float))
+    inicio = lo.copy(); hi = hi.copy(); lo = inicio
+    alcanzable = f(hi) >= objetivo
+    ya_cumple = f(lo) >= objetivo
+    for _ in range(iteraciones):
+        medio = (lo + hi) / 2
+        ok = f(medio) >= objetivo
+        hi = np.where(ok, medio, hi)
+        lo = np.where(ok, lo, medio)
+    x = np.where(ya_cumple, inicio, hi)
+    return np.where(alcanzable | ya_cumple, x, np.nan)
+
+def resolver_objetivos(rv, liquidez_min=1.5, rrp_min=None, cce_max=60.0, z_min=None):
+    """
+    Acción mínima por empresa para alcanzar las metas, vectorizada sobre una
+    tabla de ratios (salida de calcular_ratios_vectorizado):
+    - Liquidez General >= liquidez_min: PC a refinanciar a L/P, AC/(PC-x) >= L.
+    - RRP >= rrp_min: aumento de Beneficio Neto (reducción de gastos) necesario.
+    - CCE <= cce_max: días de clientes a reducir y caja liberada (días*Ventas/365).
+    - Z' (MODELO_ALERTA) >= z_min: ampliación de capital en efectivo. Sin forma
+      cerrada (el modelo es configurable): se resuelve con buscar_objetivo.
+    Los importes son 0 donde la meta ya se cumple y NaN donde no es alcanzable.
+    """
+    AC = rv["_AC"]; PC = rv["_PC"]; PN = rv["_PN"]; BN = rv["_BN"]; Ventas = rv["_Ventas"]
+    res = {}
+
+    refinanciar = np.clip(PC - _div(AC, liquidez_min), 0.0, None)
+    res["refinanciar_PC"] = np.where((AC > 0) | (PC == 0), np.minimum(refinanciar, PC), np.nan)
+    res["refinanciar_pct_PC"] = _div(res["refinanciar_PC"], PC) * 100
+
+    if rrp_min is not None:
+        res["aumento_BN"] = np.where(PN > 0, np.clip(rrp_min * PN - BN, 0.0, None), np.nan)
+        res["aumento_BN_pct_costos"] = _div(res["aumento_BN"], rv["_Costo"]) * 100
+
+    # Sin días de clientes informados se estiman con Deudores*365/Ventas (igual que D4)
+    dias_clie = rv["_dias_clientes"]
+    dias_clie = np.where(dias_clie > 0, dias_clie, np.nan_to_num(_div(rv["_Deudores"] * 365, Ventas)))
+    cce = rv["_dias_inventario"] + dias_clie - rv["_dias_proveedores"]
+    reduccion = np.clip(cce - cce_max, 0.0, None)
+    res["cce_actual"] = cce
+    res["dias_clientes_actual"] = dias_clie
+    res["reduccion_dias_clientes"] = np.where(reduccion <= dias_clie, reduccion, np.nan)
+    res["liberacion_caja"] = res["reduccion_dias_clientes"] * Ventas / 365
+
+    if z_min is not None:
+        res["ampliacion_capital"] = _resolver_ampliacion_capital(rv, z_min)
+        res["ampliacion_pct_PN"] = _div(res["ampliacion_capital"], PN) * 100
+    return res
+
+def _resolver_ampliacion_capital(rv, z_min, tope_activo=10.0):
+    """
+    Menor aportación de capital en efectivo x (suma x a Caja, AC y PN) con Z' >= z_min.
+    Con el modelo por defecto Z(x) baja y luego sube (o solo sube): si Z(0) < meta
+    el cruce es único y la bisección lo encuentra. Se busca hasta `tope_activo` veces el Activo.
+    """
+    entradas = entradas_de_ratios(rv)
+    kernel = compilar_modelo_alerta()
+    def z_con_capital(x):
+        t = dict(entradas)
+        for k in ("caja", "activo_corriente", "patrimonio_neto"):
+            t[k] = entradas[k] + x
+        return kernel(t)["Z"]
+    activo = entradas["activo_corriente"] + entradas["activo_no_corriente"]
+    return buscar_objetivo(z_con_capital, z_min, 0.0, tope_activo * np.maximum(activo, 1.0))
+
+def generar_recomendaciones_objetivo(r24, objetivos=None):
+    """Versión de D4 basada en las metas (solver) en lugar de los porcentajes fijos."""
+    obj = dict(OBJETIVOS_POR_DEFECTO, **(objetivos or {}))
+    sol = ratios_de_fila(resolver_objetivos(tabla_de_ratios(r24), **obj), 0)
+    texto = {}
+
+    liq = r24.get("Liquidez General")
+    monto = sol["refinanciar_PC"]
+    if monto is None:
+        texto["a) Liquidez"] = f"La meta de Liquidez General ≥ {fmt_num(obj['liquidez_min'])} no es alcanzable solo refinanciando el PC (AC insuficiente)"
+        texto["a_cuantif"] = "Monto a refinanciar: **N/A**."
+    elif monto == 0:
+        texto["a) Liquidez"] = f"La Liquidez General actual ({fmt_num(liq)}) ya cumple la meta ≥ {fmt_num(obj['liquidez_min'])}; mantener la estructura de vencimientos"
+        texto["a_cuantif"] = "Monto a refinanciar: **0**."
+    else:
+        texto["a) Liquidez"] = f"Refinanciar a largo plazo el **{fmt_num(sol['refinanciar_pct_PC'], 1)}% del Pasivo Corriente (PC)**, el mínimo para llevar la Liquidez General de {fmt_num(liq)} a {fmt_num(obj['liquidez_min'])}"
+        texto["a_cuantif"] = f"Monto mínimo a refinanciar: **{fmt_num(monto)}**."
+
+    if obj["rrp_min"] is not None:
+        aumento = sol["aumento_BN"]
+        texto["b) Rentabilidad"] = f"Reducir gastos hasta aumentar el Beneficio Neto lo necesario para una RRP ≥ {fmt_num(obj['rrp_min']*100)}% (actual {fmt_num((r24.get('RRP') or 0.0)*100)}%)"
+        texto["b_cuantif"] = f"Aumento mínimo del BN: **{fmt_num(aumento)}** ({fmt_num(sol['aumento_BN_pct_costos'], 1)}% del costo de ventas)."
+    else:
+        texto.update({k: v for k, v in generar_recomendaciones({}, r24).items() if k.startswith("b")})
+
+    red = sol["reduccion_dias_clientes"]
+    if red is None:
+        texto["c) Eficiencia operativa"] = f"El CCE ({fmt_num(sol['cce_actual'], 0)} días) no baja a {fmt_num(obj['cce_max'], 0)} días solo con cobros; revisar inventario y plazos de proveedores"
+        texto["c_cuantif"] = "Mejora estimada de flujo de caja: **N/A**."
+    else:
+        dias_nuevo = sol["dias_clientes_actual"] - red
+        texto["c) Eficiencia operativa"] = f"Reducir los **Días Clientes** de {fmt_num(sol['dias_clientes_actual'], 0)} a **{fmt_num(dias_nuevo, 0)} días** para un CCE ≤ {fmt_num(obj['cce_max'], 0)} días"
+        texto["c_cuantif"] = f"Mejora estimada de flujo de caja: **{fmt_num(sol['liberacion_caja'])}**."
+
+    if obj["z_min"] is not None:
+        aporte = sol["ampliacion_capital"]
+        z24 = puntuar_cartera(entradas_de_ratios(tabla_de_ratios(r24)))["Z"][0]
+        z24 = fmt_num(None if np.isnan(z24) else float(z24))
+        if aporte is None:
+            texto["d) Solvencia"] = f"La puntuación Z' ({z24}) no llega a {fmt_num(obj['z_min'])} con una ampliación de capital razonable; revisar rentabilidad y rotación"
+            texto["d_cuantif"] = "Ampliación de capital: **N/A**."
+        elif aporte == 0:
+            texto["d) Solvencia"] = f"La puntuación Z' actual ({z24}) ya cumple la meta ≥ {fmt_num(obj['z_min'])}"
+            texto["d_cuantif"] = "Ampliación de capital: **0**."
+        else:
+            texto["d) Solvencia"] = f"Ampliar capital en efectivo lo mínimo para llevar la puntuación Z' de {z24} a {fmt_num(obj['z_min'])}"
+            texto["d_cuantif"] = f"Ampliación mínima: **{fmt_num(aporte)}** ({fmt_num(sol['ampliacion_pct_PN'], 1)}% del PN)."
+    return texto
+
+# -----------------------------
+# Proyección plurianual de balances (escenarios)
+# -----------------------------
+# Palancas de cada escenario: escalar (igual todos los años) o lista de `anios`
+# valores. None = se mantiene el valor del año base de cada empresa.
+DRIVERS_PROYECCION = {
+    "crecimiento_ventas": 0.0,      # tasa anual; el ANC y las partidas "otras" crecen igual (intensidad constante)
+    "costo_pct": None,              # Costo de ventas / Ventas
+    "margen_explotacion": None,     # (BN antes de impuestos + Gastos Fin) / Ventas
+    "dias_inventario": None,
+    "dias_clientes": None,
+    "dias_proveedores": None,
+    "amortizacion_deuda": 0.0,      # fracción del PNC inicial que se devuelve cada año (lineal)
+    "nueva_deuda_pct_ventas": 0.0,  # nueva deuda a L/P emitida cada año, en % de las ventas
+    "i": None,                      # coste de la deuda a L/P
+    "reparto": 0.0,                 # dividendos / BN
+}
+ESCENARIOS_POR_DEFECTO = {
+    "Base": {"crecimiento_ventas": 0.05},
+    "Pesimista": {"crecimiento_ventas": [-0.30, 0.0, 0.02, 0.02, 0.02], "dias_clientes": 75.0},
+    "Optimista": {"crecimiento_ventas": 0.12, "nueva_deuda_pct_ventas": 0.02},
+}
+
+def _por_anio(valor, anios, nombre, escenario):
+    """Escalar -> mismo valor todos los años; lista por año -> se completa repitiendo el último o se recorta."""
+    v = np.asarray(0.0 if valor is None else valor, dtype=float)
+    if v.ndim == 0:
+        return np.full(anios, float(v))
+    if v.ndim != 1 or not len(v):
+        raise ValueError(f"Escenario {escenario!r}: '{nombre}' debe ser un número o una lista de valores por año")
+    if len(v) >= anios:
+        return v[:anios]
+    return np.concatenate([v, np.full(anios - len(v), v[-1])])
+
+def _trayectoria(escenarios, nombre, base, anios):
+    """Palanca como array (S, N|1, Y); solo ocupa N filas si algún escenario usa el valor base."""
+    valores = [esc.get(nombre, DRIVERS_PROYECCION[nombre]) for esc in escenarios.values()]
+    if all(v is None for v in valores):
+        return base[None, :, None]
+    fijos = np.stack([_por_anio(v, anios, nombre, esc) for esc, v in zip(escenarios, valores)])[:, None, :]
+    if any(v is None for v in valores):
+        return np.where(np.array([v is None for v in valores])[:, None, None], base[None, :, None], fijos)
+    return fijos
+
+def proyectar_balances(t, escenarios=None, anios=5, anio_base=2024, impuesto=0.0):
+    """
+    Proyecta el balance de todas las empresas de `t` (tabla columnar del año
+    base) en todos los escenarios a la vez: cada partida es un array
+    (escenario, empresa, año). Ventas y ANC se componen con cumprod, la deuda y
+    el PN se acumulan con cumsum; Deudores, Inventario y Proveedores salen de
+    los días; la Caja cuadra el balance y, si fuera negativa, el déficit se
+    cubre con una línea de crédito a C/P (sin intereses en el modelo).
+    Las palancas por año más cortas que `anios` se completan con su último valor.
+    Los Gastos Fin de cada año son i * PNC del año anterior.
+    Devuelve {"escenarios", "anios", "partidas", "ratios", "linea_credito"}.
+    """
+    escenarios = escenarios or ESCENARIOS_POR_DEFECTO
+    tray = lambda nombre, base: _trayectoria(escenarios, nombre, base, anios)
+    V0 = t["ventas"]; C0 = t["costo_ventas"]
+    # Días base: los informados o, si faltan, los implícitos en el balance
+    dias_clie0 = np.where(t["dias_clientes"] > 0, t["dias_clientes"], np.nan_to_num(_div(t["deudores"] * 365, V0)))
+    dias_inv0 = np.where(t["dias_inventario"] > 0, t["dias_inventario"], np.nan_to_num(_div(t["inventario"] * 365, C0)))
+    dias_prov0 = t["dias_proveedores"]
+    prov0 = dias_prov0 * C0 / 365
+    ac_otros0 = t["activo_corriente"] - t["caja"] - t["deudores"] - t["inventario"]
+    pc_otros0 = t["pasivo_corriente"] - prov0
+    margen0 = np.nan_to_num(_div(t["beneficio_neto"] / (1 - impuesto) + t["gastos_financieros"], V0))
+
+    g = tray("crecimiento_ventas", None)
+    escala = np.cumprod(1 + g, axis=-1)
+    e = lambda x: x[None, :, None]
+    ventas = e(V0) * escala
+    costo = tray("costo_pct", np.nan_to_num(_div(C0, V0))) * ventas
+    # El inmovilizado acompaña el crecimiento pero no se liquida cuando las ventas caen
+    anc = e(t["activo_no_corriente"]) * np.maximum.accumulate(np.maximum(escala, 1.0), axis=-1)
+    dias_inv = tray("dias_inventario", dias_inv0); dias_clie = tray("dias_clientes", dias_clie0); dias_prov = tray("dias_proveedores", dias_prov0)
+    deudores = dias_clie * ventas / 365
+    inventario = dias_inv * costo / 365
+    proveedores = dias_prov * costo / 365
+    ac_otros = e(ac_otros0) * escala
+
+    amort = np.clip(np.cumsum(tray("amortizacion_deuda", None), axis=-1), 0.0, 1.0)
+    pnc = e(t["pasivo_no_corriente"]) * (1 - amort) + np.cumsum(tray("nueva_deuda_pct_ventas", None) * ventas, axis=-1)
+    pnc_anterior = np.concatenate([np.broadcast_to(e(t["pasivo_no_corriente"]), pnc.shape[:2] + (1,)), pnc[..., :-1]], axis=-1)
+    tasa = tray("i", t["i"])
+    gfin = tasa * pnc_anterior
+    bn = (tray("margen_explotacion", margen0) * ventas - gfin) * (1 - impuesto)
+    pn = e(t["patrimonio_neto"]) + np.cumsum(bn * (1 - tray("reparto", None)), axis=-1)
+
+    # Otros pasivos C/P crecen con la financiación permanente (PN + PNC), no con las ventas
+    permanente0 = e(t["patrimonio_neto"] + t["pasivo_no_corriente"])
+    crecimiento_balance = np.where(permanente0 > 0, np.nan_to_num(_div(np.maximum(pn + pnc, 0.0), permanente0), nan=1.0), 1.0)
+    pc_otros = e(pc_otros0) * crecimiento_balance
+
+    caja = pn + pnc + pc_otros + proveedores - anc - deudores - inventario - ac_otros
+    linea = np.clip(-caja, 0.0, None); caja = np.clip(caja, 0.0, None)
+    forma = ventas.shape
+    partidas = {
+        "activo_corriente": ac_otros + deudores + inventario + caja, "activo_no_corriente": anc,
+        "pasivo_corriente": pc_otros + proveedores + linea, "pasivo_no_corriente": pnc,
+        "patrimonio_neto": pn, "ventas": ventas, "costo_ventas": costo, "beneficio_neto": bn,
+        "deudores": deudores, "inventario": inventario, "caja": caja, "i": tasa, "gastos_financieros": gfin,
+        "dias_inventario": dias_inv, "dias_clientes": dias_clie, "dias_proveedores": dias_prov,
+    }
+    partidas = {k: np.broadcast_to(v, forma) for k, v in partidas.items()}
+    # Una sola pasada del motor de ratios sobre todas las celdas (escenario x empresa x año)
+    rv = calcular_ratios_vectorizado({k: v.reshape(-1) for k, v in partidas.items()})
+    ratios = {k: v.reshape(forma) for k, v in rv.items() if not k.startswith("_")}
+    return {"escenarios": list(escenarios), "anios": list(range(anio_base + 1, anio_base + 1 + anios)),
+            "partidas": partidas, "ratios": ratios, "linea_credito": linea}
+
+def trayectorias_ratio(proy, ratio, j=0):
+    """{escenario: [valor por año]} de un ratio para la empresa j de una proyección."""
+    return {esc: proy["ratios"][ratio][s, j] for s, esc in enumerate(proy["escenarios"])}
+
+def verificar_proyeccion(t, horizontes=(3, 5, 10), escenarios=None, tolerancia=1e-6):
+    """
+    Comprobación rápida de proyectar_balances con los escenarios por defecto
+    en varios horizontes: forma (escenario, empresa, año) y Activo = Pasivo + PN
+    en todas las celdas. Lanza ValueError si algo no cuadra; devuelve los horizontes probados.
+    """
+    n = len(t["activo_corriente"])
+    for anios in horizontes:
+        proy = proyectar_balances(t, escenarios, anios=anios)
+        q = proy["partidas"]
+        forma = (len(proy["escenarios"]), n, anios)
+        if q["ventas"].shape != forma or len(proy["anios"]) != anios:
+            raise ValueError(f"Proyección a {anios} años con forma {q['ventas'].shape}, se esperaba {forma}")
+        descuadre = np.abs(q["activo_corriente"] + q["activo_no_corriente"] - q["pasivo_corriente"] - q["pasivo_no_corriente"] - q["patrimonio_neto"])
+        if np.nanmax(descuadre, initial=0.0) > tolerancia * max(1.0, float(np.nanmax(np.abs(q["patrimonio_neto"]), initial=1.0))):
+            raise ValueError(f"Proyección a {anios} años: el balance no cuadra (diferencia {np.nanmax(descuadre):.6g})")
+    return list(horizontes)
+
+# -----------------------------
+# Descomposición DuPont de la RRP
+# -----------------------------
+FACTORES_DUPONT = [("margen", "Margen Neto"), ("rotacion", "Rotación Activo"), ("apalancamiento", "Multiplicador Capital")]
+
+def atribucion_dupont(rv0, rv1):
+    """
+    Reparte la variación de la RRP entre dos periodos (tablas de ratios, o
+    dicts de arrays con las claves del registro) entre margen, rotación y
+    apalancamiento. Con RRP = m * r * a, cada factor recibe su valor de Shapley
+    en forma cerrada, p.ej. para el margen:
+        dm * ((r0*a0 + r1*a1) / 3 + (r0*a1 + r1*a0) / 6)
+    Es exacta (las tres suman dRRP) y, a diferencia del reparto logarítmico,
+    admite márgenes o PN negativos. Donde falta algún factor el resultado es NaN.
+    """
+    m0, r0, a0 = (np.asarray(rv0[k], dtype=float) for _, k in FACTORES_DUPONT)
+    m1, r1, a1 = (np.asarray(rv1[k], dtype=float) for _, k in FACTORES_DUPONT)
+    def peso(x0, x1, y0, y1):
+        return (x0 * y0 + x1 * y1) / 3 + (x0 * y1 + x1 * y0) / 6
+    res = {
+        "margen": (m1 - m0) * peso(r0, r1, a0, a1),
+        "rotacion": (r1 - r0) * peso(m0, m1, a0, a1),
+        "apalancamiento": (a1 - a0) * peso(m0, m1, r0, r1),
+    }
+    res["RRP_inicial"] = m0 * r0 * a0
+    res["RRP_final"] = m1 * r1 * a1
+    return res
+
+def preparar_dupont(r23, r24):
+    """Filas de la tabla E1 (factores por año y su aporte a la variación de la RRP)."""
+    at = atribucion_dupont(tabla_de_ratios(r23), tabla_de_ratios(r24))
+    aporte = lambda v: fmt_num(None if np.isnan(v[0]) else v[0] * 100) + " pp"
+    filas = [["Factor", "Fórmula", "2023", "2024", "Aporte a la RRP"]]
+    for clave, nombre in FACTORES_DUPONT:
+        filas.append([nombre, REGISTRO_RATIOS[nombre]["formula_texto"], fmt_num(r23.get(nombre)), fmt_num(r24.get(nombre)), aporte(at[clave])])
+    variacion = at["RRP_final"] - at["RRP_inicial"]
+    filas.append(["RRP", "BN / PN", fmt_num(r23.get("RRP")), fmt_num(r24.get("RRP")), aporte(variacion)])
+    return filas
+
+# -----------------------------
+# Puntuación de alerta temprana (estilo Z de Altman)
+# -----------------------------
+# Z' de Altman (empresas no cotizadas) sin el término de beneficios retenidos,
+# que no está entre las entradas; sin él la puntuación sale algo más baja, así
+# que el modelo peca de prudente. Componentes: (descripción, fórmula, coeficiente).
+MODELO_ALERTA = {
+    "componentes": {
+        "X1": ("Fondo de maniobra / Activo", "(AC - PC) / Activo", 0.717),
+        "X2": ("BAII / Activo", "BAII / Activo", 3.107),
+        "X3": ("PN / Pasivo", "PN / Pasivo", 0.420),
+        "X4": ("Ventas / Activo", "Ventas / Activo", 0.998),
+    },
+    "constante": 0.0,
+    # Cortes ascendentes de Z y, por tramo (uno más que cortes), índice de ETIQUETAS_SITUACION
+    "cortes": [0.5, 1.23, 2.9, 5.0],
+    "etiquetas": [0, 2, 3, 4, 1],
+}
+# Campo de entrada -> partida base que calcular_ratios_vectorizado añade a su salida
+PARTIDAS_EN_RATIOS = {
+    "activo_corriente": "_AC", "activo_no_corriente": "_ANC", "pasivo_corriente": "_PC",
+    "pasivo_no_corriente": "_PNC", "patrimonio_neto": "_PN", "ventas": "_Ventas", "costo_ventas": "_Costo",
+    "beneficio_neto": "_BN", "deudores": "_Deudores", "inventario": "_Inventario", "caja": "_Caja",
+    "i": "_i_input", "gastos_financieros": "_GastosFin", "dias_inventario": "_dias_inventario",
+    "dias_clientes": "_dias_clientes", "dias_proveedores": "_dias_proveedores",
+}
+_modelos_alerta = {}
+
+def entradas_de_ratios(rv):
+    """Tabla de entradas reconstruida desde una salida de calcular_ratios_vectorizado (o tabla_de_ratios)."""
+    return {k: np.asarray(rv[p], dtype=float) for k, p in PARTIDAS_EN_RATIOS.items()}
+
+def compilar_modelo_alerta(modelo=None):
+    """
+    Kernel del modelo (compilar_formulas): cada componente y "Z" en una sola
+    pasada; los componentes repetidos dentro de Z se calculan una vez. Se cachea por modelo.
+    """
+    modelo = modelo or MODELO_ALERTA
+    clave = json.dumps(modelo, sort_keys=True)
+    if clave not in _modelos_alerta:
+        componentes = modelo["componentes"]
+        if len(modelo["etiquetas"]) != len(modelo["cortes"]) + 1 or list(modelo["cortes"]) != sorted(modelo["cortes"]):
+            raise ValueError("El modelo necesita cortes ascendentes y una etiqueta más que cortes.")
+        formulas = {x: formula for x, (_, formula, _) in componentes.items()}
+        formulas["Z"] = " + ".join([repr(float(modelo.get("constante", 0.0)))] +
+                                   [f"{float(coef)!r} * ({formula})" for _, formula, coef in componentes.values()])
+        _modelos_alerta[clave] = compilar_formulas(formulas, "<modelo_alerta>")
+    return _modelos_alerta[clave]
+
+def puntuar_cartera(t, modelo=None):
+    """
+    Puntuación Z, componentes, tramo y ranking de toda una cartera (tabla de
+    entradas). "codigo" es el índice de ETIQUETAS_SITUACION del tramo (-1 si Z
+    es NaN, p.ej. sin activo o sin pasivo); "rango" = 1 para la de más riesgo,
+    con las NaN al final.
+    """
+    modelo = modelo or MODELO_ALERTA
+    res = compilar_modelo_alerta(modelo)(t)
+    z = res["Z"]
+    tramo = np.searchsorted(np.asarray(modelo["cortes"], dtype=float), z, side="right")
+    res["codigo"] = np.where(np.isnan(z), -1, np.asarray(modelo["etiquetas"], dtype=np.int8)[tramo]).astype(np.int8)
+    orden = np.argsort(z, kind="stable")
+    res["rango"] = np.empty(len(z), dtype=np.int64)
+    res["rango"][orden] = np.arange(1, len(z) + 1)
+    return res
+
+def etiquetas_alerta(codigos):
+    """Etiquetas de texto de los códigos de puntuar_cartera ('N/A' para -1)."""
+    return np.asarray(ETIQUETAS_SITUACION + ["N/A"], dtype=object)[np.asarray(codigos)]
+
+def generar_alerta_temprana(r23, r24, modelo=None):
+    """(texto Z 2023/2024, etiqueta del tramo 2024, detalle de componentes 2024) para el informe."""
+    modelo = modelo or MODELO_ALERTA
+    t = {k: np.concatenate([a, b]) for (k, a), b in zip(entradas_de_ratios(tabla_de_ratios(r23)).items(),
+                                                           entradas_de_ratios(tabla_de_ratios(r24)).values())}
+    res = puntuar_cartera(t, modelo)
+    z23, z24 = (None if np.isnan(v) else float(v) for v in res["Z"])
+    evolucion = "" if z23 is None or z24 is None else (" (mejora)" if z24 > z23 else (" (empeora)" if z24 < z23 else " (sin cambios)"))
+    texto = f"Z' 2023: {fmt_num(z23)} | Z' 2024: {fmt_num(z24)}{evolucion}"
+    detalle = " · ".join(f"{x} {desc}: {fmt_num(None if np.isnan(res[x][1]) else float(res[x][1]))}"
+                         for x, (desc, _, _) in modelo["componentes"].items())
+    return texto, str(etiquetas_alerta(res["codigo"][1])), detalle
+
 # -----------------------------
 # Funciones de Soporte Gráfico
 # -----------------------------
 
-def generar_pie_chart_financiacion(r):
-    """Genera un gráfico de pastel para la estructura financiera (PN, PNC, PC)"""
+def _nueva_figura(figsize, nrows=1, ncols=1):
+    """
+    Figura fuera de pyplot: no queda registrada en su estado global, así que
+    si el dibujo lanza una excepción no se acumula y el GC la libera.
+    """
+    fig = Figure(figsize=figsize)
+    return fig, fig.subplots(nrows, ncols)
+
+def _figura_a_png(fig, dpi=150, bbox_inches='tight'):
+    """Serializa una figura de Matplotlib a bytes PNG y la cierra."""
+    buf = BytesIO()
+    t0 = time.perf_counter()
+    try:
+        fig.savefig(buf, format='PNG', dpi=dpi, bbox_inches=bbox_inches)
+        png = buf.getvalue()
+        log_graficos.debug("grafico", extra={"titulo": fig.get_suptitle() or (fig.axes[0].get_title() if fig.axes else ""),
+                                             "dpi": dpi, "bytes": len(png), "segundos": round(time.perf_counter() - t0, 6)})
+        return png
+    finally:
+        plt.close(fig)
+        buf.close()
+
+def renderizar_pie_financiacion_png(r, dpi=150):
+    """PNG del gráfico de pastel de la estructura financiera (PN, PNC, PC)."""
     PC = r.get("_PC") or 0.0
     PNC = r.get("_PNC") or 0.0
     PN = r.get("_PN") or 0.0
@@ -480,19 +2004,14 @@ def generar_pie_chart_financiacion(r):
     sizes = [PN, PNC, PC]
     colors_list = ['#4CAF50', '#FFC107', '#E91E63'] # Verde, Amarillo, Rosa
     
-    fig, ax = plt.subplots(figsize=(6, 6))
+    fig, ax = _nueva_figura((6, 6))
     ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90, colors=colors_list, wedgeprops={'edgecolor': 'black'})
     ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
     ax.set_title('Estructura de Financiación 2024', fontsize=14)
-    
-    buf = BytesIO()
-    plt.savefig(buf, format='PNG', dpi=150, bbox_inches='tight')
-    plt.close(fig)
-    buf.seek(0)
-    return ImageReader(buf)
+    return _figura_a_png(fig, dpi=dpi)
 
-def generar_draw_rat_rrp(r):
-    """Genera un gráfico de barras comparando RAT y RRP."""
+def dibujar_rat_rrp(ax, r):
+    """Barras RAT / RRP / RRP Apalancada sobre un eje de Matplotlib."""
     RAT = r.get("RAT") or 0.0
     RRP = r.get("RRP") or 0.0
     RAT_apal = r.get("RRP Apalancada") or 0.0
@@ -502,7 +2021,6 @@ def generar_draw_rat_rrp(r):
     values = [RAT * 100, RRP * 100, RAT_apal * 100]
     colors_list = [HEX_PRINCIPAL, HEX_ACENTO, '#E91E63'] 
 
-    fig, ax = plt.subplots(figsize=(8, 3.5))
     x = np.arange(len(labels))
     ax.bar(x - 0.18, values, width=0.35, color=colors_list)
 
@@ -515,13 +2033,274 @@ def generar_draw_rat_rrp(r):
     ax.set_ylabel('Rentabilidad (%)')
     ax.set_title('C4. Comparación de Rentabilidades 2024', fontsize=12)
     ax.grid(axis='y', linestyle='--', alpha=0.7)
-    plt.tight_layout()
 
-    buf = BytesIO()
-    plt.savefig(buf, format='PNG', dpi=150, bbox_inches='tight')
-    plt.close(fig)
-    buf.seek(0)
-    return ImageReader(buf)
+def renderizar_rat_rrp_png(r, dpi=150):
+    """PNG del gráfico de barras comparando RAT y RRP."""
+    fig, ax = _nueva_figura((8, 3.5))
+    dibujar_rat_rrp(ax, r)
+    fig.tight_layout()
+    return _figura_a_png(fig, dpi=dpi)
+
+PLOT_KEYS_D1 = ["Liquidez General", "Tesorería", "Garantía", "Autonomía", "RAT", "RRP"]
+
+def dibujar_comparativo(ax, r23, r24):
+    """Barras 2023 vs 2024 de los ratios clave sobre un eje de Matplotlib."""
+    vals23 = [r23.get(k) or 0 for k in PLOT_KEYS_D1]; vals24 = [r24.get(k) or 0 for k in PLOT_KEYS_D1]
+    x = np.arange(len(PLOT_KEYS_D1))
+    
+    # CORRECCIÓN CLAVE: Usamos las cadenas HEX directamente para Matplotlib
+    ax.bar(x - 0.18, vals23, width=0.35, label="2023", color=HEX_PRINCIPAL); 
+    ax.bar(x + 0.18, vals24, width=0.35, label="2024", color=HEX_ACENTO)
+    
+    ax.set_xticks(x); ax.set_xticklabels(PLOT_KEYS_D1, rotation=30, ha="right"); 
+    ax.legend(); ax.grid(axis='y', linestyle='--', alpha=0.7); 
+    ax.set_title('Evolución de Ratios Clave (2023 vs 2024)')
+
+def renderizar_comparativo_png(r23, r24, dpi=150):
+    """PNG del gráfico D1 de evolución de ratios clave 2023 vs 2024."""
+    fig, ax = _nueva_figura((8.5, 3.5))
+    dibujar_comparativo(ax, r23, r24)
+    fig.tight_layout()
+    return _figura_a_png(fig, dpi=dpi, bbox_inches=None)
+
+def dibujar_cascada_dupont(ax, r23, r24):
+    """Cascada RRP 2023 -> aporte de margen, rotación y apalancamiento -> RRP 2024 (en %)."""
+    at = atribucion_dupont(tabla_de_ratios(r23), tabla_de_ratios(r24))
+    pasos = [float(np.nan_to_num(at[k][0])) * 100 for k, _ in FACTORES_DUPONT]
+    inicio = float(np.nan_to_num(at["RRP_inicial"][0])) * 100
+    fin = inicio + sum(pasos)
+    etiquetas = ["RRP 2023", "Margen", "Rotación", "Apalancamiento", "RRP 2024"]
+    bases = [0.0]; alturas = [inicio]; colores = [HEX_PRINCIPAL]
+    acumulado = inicio
+    for v in pasos:
+        bases.append(acumulado if v >= 0 else acumulado + v); alturas.append(abs(v))
+        colores.append(HEX_ACENTO if v >= 0 else '#E91E63'); acumulado += v
+    bases.append(0.0); alturas.append(fin); colores.append(HEX_PRINCIPAL)
+    x = np.arange(len(etiquetas))
+    ax.bar(x, alturas, bottom=bases, color=colores, width=0.6, edgecolor='black', linewidth=0.5)
+    for i, v in enumerate([inicio] + pasos + [fin]):
+        signo = "+" if 0 < i < 4 and v >= 0 else ""
+        ax.text(x[i], bases[i] + alturas[i], f"{signo}{fmt_num(v)}%", ha='center', va='bottom', fontsize=9)
+    ax.axhline(0, color='black', linewidth=0.8)
+    ax.margins(y=0.15)
+    ax.set_xticks(x); ax.set_xticklabels(etiquetas)
+    ax.set_ylabel('RRP (%)'); ax.set_title('E2. Variación de la RRP por factor DuPont', fontsize=12)
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+
+def renderizar_dupont_png(r23, r24, dpi=150):
+    """PNG de la cascada DuPont 2023 -> 2024."""
+    fig, ax = _nueva_figura((8.5, 3.5))
+    dibujar_cascada_dupont(ax, r23, r24)
+    fig.tight_layout()
+    return _figura_a_png(fig, dpi=dpi, bbox_inches=None)
+
+def _png_a_imagen(png):
+    return ImageReader(BytesIO(png)) if png and png != GRAFICO_PENDIENTE else None
+
+# Marcador de gráfico aún no renderizado (borradores): ocupa el mismo hueco que la imagen
+GRAFICO_PENDIENTE = "pendiente"
+
+def dibujar_grafico(c, png, x, y, width, height, optimizar=True, paleta=False, **kw):
+    """
+    Dibuja el PNG, o un recuadro gris del mismo tamaño si el gráfico está pendiente.
+    Con optimizar=True pasa por dibujar_png_compartido (ver "Optimización de la
+    salida PDF"); con False usa drawImage tal cual.
+    """
+    if png == GRAFICO_PENDIENTE:
+        c.saveState()
+        c.setFillColor(COLOR_FONDO_TABLA_OBJ); c.setStrokeColor(colors.grey); c.setDash(3, 3)
+        c.rect(x, y, width, height, stroke=1, fill=1)
+        c.setFillColor(colors.grey); c.setFont("Helvetica-Oblique", 9)
+        c.drawCentredString(x + width / 2, y + height / 2, "Gráfico en preparación (borrador)")
+        c.restoreState()
+    elif png and optimizar:
+        dibujar_png_compartido(c, png, x, y, width, height, paleta=paleta)
+    elif png:
+        c.drawImage(_png_a_imagen(png), x, y, width=width, height=height, **kw)
+
+def generar_pie_chart_financiacion(r):
+    """Genera un gráfico de pastel para la estructura financiera (PN, PNC, PC)"""
+    return _png_a_imagen(renderizar_pie_financiacion_png(r))
+
+def generar_draw_rat_rrp(r):
+    """Genera un gráfico de barras comparando RAT y RRP."""
+    return _png_a_imagen(renderizar_rat_rrp_png(r))
+
+# -----------------------------
+# Optimización de la salida PDF
+# -----------------------------
+# drawImage decodifica cada PNG a RGB crudo, lo vuelve a comprimir sin predictor
+# y lo pasa a ASCII85 (en Python puro sin rl_accel): más bytes y más tiempo.
+# Aquí el PNG se incrusta tal cual (sus IDAT con /Predictor 15), una sola vez por
+# documento aunque se dibuje en varias páginas.
+_PNG_FIRMA = b"\x89PNG\r\n\x1a\n"
+_PNG_COLORES = {0: ("DeviceGray", 1), 2: ("DeviceRGB", 3), 3: ("Indexed", 1)}
+
+def png_para_pdf(png, paleta=False, colores=256):
+    """
+    Re-codifica un PNG de Matplotlib (RGBA) sobre fondo blanco y sin canal alfa:
+    RGB sin pérdida o, con paleta=True, indexado con `colores` colores.
+    """
+    with Image.open(BytesIO(png)) as im:
+        im.load()
+        if im.mode in ("RGBA", "LA", "P"):
+            im = im.convert("RGBA")
+            fondo = Image.new("RGB", im.size, "white")
+            fondo.paste(im, mask=im.getchannel("A"))
+            im = fondo
+        elif im.mode != "RGB":
+            im = im.convert("RGB")
+        if paleta:
+            im = im.quantize(colores, method=Image.Quantize.FASTOCTREE)
+        buf = BytesIO()
+        im.save(buf, format="PNG", compress_level=9 if paleta else 6)
+        return buf.getvalue()
+
+class _CadenaHex(pdfdoc.PDFObject):
+    def __init__(self, datos):
+        self.datos = datos
+    def format(self, document):
+        return b"<" + self.datos.hex().encode() + b">"
+
+class ImagenPNG(pdfdoc.PDFImageXObject):
+    """XObject de imagen con los datos IDAT de un PNG no entrelazado de 8 bits o menos (gris, RGB o paleta)."""
+    def __init__(self, name, png):
+        if not png.startswith(_PNG_FIRMA):
+            raise ValueError("no es un PNG")
+        self.name = name
+        self.mask = None
+        idat = []; plte = b""
+        pos = len(_PNG_FIRMA)
+        while pos < len(png):
+            largo, tipo = struct.unpack(">I4s", png[pos:pos + 8])
+            datos = png[pos + 8:pos + 8 + largo]
+            pos += largo + 12
+            if tipo == b"IHDR":
+                self.width, self.height, self.bitsPerComponent, tipo_color, _, _, entrelazado = struct.unpack(">IIBBBBB", datos)
+            elif tipo == b"PLTE":
+                plte = datos
+            elif tipo == b"IDAT":
+                idat.append(datos)
+            elif tipo == b"IEND":
+                break
+        if tipo_color not in _PNG_COLORES or entrelazado or self.bitsPerComponent > 8:
+            raise ValueError(f"PNG no soportado (tipo {tipo_color}, {self.bitsPerComponent} bits, entrelazado={entrelazado})")
+        espacio, self.componentes = _PNG_COLORES[tipo_color]
+        if espacio == "Indexed":
+            self.colorSpace = pdfdoc.PDFArray([pdfdoc.PDFName("Indexed"), pdfdoc.PDFName("DeviceRGB"), len(plte) // 3 - 1, _CadenaHex(plte)])
+            self.colorSpace.multiline = False
+        else:
+            self.colorSpace = pdfdoc.PDFName(espacio)
+        self.streamContent = b"".join(idat)
+
+    def format(self, document):
+        S = pdfdoc.PDFStream(content=self.streamContent)
+        d = S.dictionary
+        d["Type"] = pdfdoc.PDFName("XObject")
+        d["Subtype"] = pdfdoc.PDFName("Image")
+        d["Width"] = self.width
+        d["Height"] = self.height
+        d["BitsPerComponent"] = self.bitsPerComponent
+        d["ColorSpace"] = self.colorSpace
+        d["Filter"] = pdfdoc.PDFName("FlateDecode")
+        d["DecodeParms"] = pdfdoc.PDFDictionary({"Predictor": 15, "Colors": self.componentes,
+                                                 "BitsPerComponent": self.bitsPerComponent, "Columns": self.width})
+        return S.format(document)
+
+def dibujar_png_compartido(c, png, x, y, width, height, paleta=False):
+    """
+    Dibuja el PNG como XObject compartido: el mismo gráfico (mismos bytes y
+    misma opción de paleta) se incrusta una vez y las demás apariciones solo lo
+    referencian. Si el PNG no se puede incrustar directamente se usa drawImage.
+    """
+    nombre = ("PNGP" if paleta else "PNG") + hashlib.sha1(png).hexdigest()[:20]
+    if not c.hasForm(nombre):
+        try:
+            c._doc.addForm(nombre, ImagenPNG(nombre, png_para_pdf(png, paleta=paleta)))
+        except (ValueError, OSError):
+            c.drawImage(_png_a_imagen(png), x, y, width=width, height=height)
+            return
+    c.saveState()
+    c.translate(x, y); c.scale(width, height)
+    c.doForm(nombre)
+    c.restoreState()
+
+# -----------------------------
+# Preparación concurrente de secciones
+# -----------------------------
+D1_KEYS = ["Fondo Maniobra", "Liquidez General", "Tesorería", "Disponibilidad", "Garantía", "Autonomía", "Calidad Deuda", "RAT", "RRP"]
+
+def preparar_narrativa(r23, r24, objetivos=None, fecha=None, pares=None):
+    """
+    Textos de análisis de todas las secciones (A-D), sin dibujar nada.
+    Con `objetivos` (p.ej. {"liquidez_min": 1.5, "cce_max": 60}) D4 usa el solver de metas.
+    Con `pares` (posicion_pares) D2 se redacta frente al sector.
+    """
+    d_inv = r24.get("_dias_inventario"); d_clie = r24.get("_dias_clientes"); d_prov = r24.get("_dias_proveedores")
+    return {
+        "equilibrio": clasificar_situacion_patrimonial_v2(r24),
+        "alerta": generar_alerta_temprana(r23, r24),
+        "vertical": generar_analisis_vertical(r24),
+        "horizontal": generar_analisis_horizontal(r23, r24),
+        "cce": calcular_cce(d_inv, d_clie, d_prov),
+        "financiero": generar_analisis_financiero(r24),
+        "estres": generar_estres_financiero(r24),
+        "apalancamiento": generar_analisis_apalancamiento(r24),
+        "fortalezas": generar_fortalezas_debilidades(r23, r24, pares),
+        "diagnostico": generar_diagnostico(r23, r24, fecha),
+        "recomendaciones": generar_recomendaciones(r23, r24) if objetivos is None else generar_recomendaciones_objetivo(r24, objetivos),
+    }
+
+def _nivel_liquidez(liquidez):
+    if liquidez is None or (isinstance(liquidez, float) and math.isnan(liquidez)):
+        return "N/A"
+    return "Alto" if liquidez > 1.5 else ("Bajo" if liquidez < 1.0 else "Aceptable")
+
+def preparar_tablas(r23, r24):
+    """Filas (texto) de las tablas B1, B2 y D1; los flowables se crean al dibujar."""
+    b1 = [
+        ["Ratio", "Fórmula", "Resultado (2024)", "Interpretación"],
+        ["Liquidez General", REGISTRO_RATIOS["Liquidez General"]["formula_texto"], fmt_num(r24.get("Liquidez General")), f"Nivel {_nivel_liquidez(r24.get('Liquidez General'))}"],
+        ["Tesorería", REGISTRO_RATIOS["Tesorería"]["formula_texto"], fmt_num(r24.get("Tesorería")), f"Capacidad de pago inmediata sin Inventario"],
+        ["Disponibilidad", REGISTRO_RATIOS["Disponibilidad"]["formula_texto"], fmt_num(r24.get("Disponibilidad")), f"Capacidad de pago con efectivo"],
+    ]
+    b2 = [
+        ["Ratio", "Fórmula", "Resultado (2024)", "Interpretación"],
+        ["Garantía", REGISTRO_RATIOS["Garantía"]["formula_texto"], fmt_num(r24.get("Garantía")), f"Solvencia: El Activo cubre el Pasivo {fmt_num(r24.get('Garantía'), 1)} veces"],
+        ["Autonomía", REGISTRO_RATIOS["Autonomía"]["formula_texto"], fmt_num(r24.get("Autonomía")), f"Autofinanciación: Proporción de Recursos Propios"],
+        ["Calidad Deuda", REGISTRO_RATIOS["Calidad Deuda"]["formula_texto"], fmt_num(r24.get("Calidad Deuda")), f"Corto Plazo sobre Deuda Total"],
+    ]
+    d1 = [["Ratio", "2023", "2024", "Cambio (abs)", "Cambio (%)"]]
+    for k in D1_KEYS:
+        v23 = r23.get(k); v24 = r24.get(k); abs_ch = (v24 - v23) if (v23 is not None and v24 is not None) else None
+        pct_ch = safe_div(abs_ch, abs(v23)) * 100 if (abs_ch is not None and v23 not in (None,0)) else None
+        d1.append([k, fmt_num(v23), fmt_num(v24), fmt_num(abs_ch), (fmt_num(pct_ch) + "%" if pct_ch is not None else "N/A")])
+    return {"B1": b1, "B2": b2, "D1": d1, "E1": preparar_dupont(r23, r24)}
+
+def preparar_secciones(r23, r24, executor=None, objetivos=None, fecha=None, dpi=150, reutilizar=None, pares=None):
+    """
+    Prepara las piezas independientes del informe: rasters de gráficos,
+    filas de tablas y textos. Con un executor (p.ej. ProcessPoolExecutor)
+    se calculan en paralelo; la colocación en el canvas sigue siendo secuencial.
+    `reutilizar` ({pieza: valor}) evita recalcular piezas ya disponibles.
+    """
+    tareas = {
+        "pie": (renderizar_pie_financiacion_png, (r24, dpi)),
+        "rat_rrp": (renderizar_rat_rrp_png, (r24, dpi)),
+        "comparativo": (renderizar_comparativo_png, (r23, r24, dpi)),
+        "dupont": (renderizar_dupont_png, (r23, r24, dpi)),
+        "tablas": (preparar_tablas, (r23, r24)),
+        "narrativa": (preparar_narrativa, (r23, r24, objetivos, fecha, pares)),
+    }
+    reutilizar = reutilizar or {}
+    tareas = {k: v for k, v in tareas.items() if k not in reutilizar}
+    if executor is None:
+        secciones = {k: f(*args) for k, (f, args) in tareas.items()}
+    else:
+        futuros = {k: executor.submit(f, *args) for k, (f, args) in tareas.items()}
+        secciones = {k: fut.result() for k, fut in futuros.items()}
+    secciones.update(reutilizar)
+    return secciones
 
 
 def draw_section_box(c, x, y_start, content_elements, width, box_color=COLOR_CAJA_OBJ):
@@ -614,9 +2393,25 @@ def generar_table_style(num_filas=None):
 # -----------------------------
 # PDF: generar informe completo
 # -----------------------------
-def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
+def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf", secciones=None, executor=None, anexos=None, objetivos=None, fecha=None, reproducible=False, optimizar=True, paleta=False, moneda=MONEDA_INFORME, pares=None):
+    """
+    Dibuja el informe completo. `secciones` son las piezas ya calculadas por
+    preparar_secciones(); si no se pasan se calculan aquí (en paralelo si hay executor).
+    `anexos` es una lista de {"titulo", "filas"} que se añaden como tablas al final.
+    Con reproducible=True el PDF no lleva fecha de creación ni ID aleatorio
+    (mismas entradas y misma `fecha` -> mismos bytes).
+    optimizar / paleta: ver dibujar_png_compartido y png_para_pdf.
+    `moneda`: código de la moneda de los importes (ver convertir_balance).
+    `pares`: posición frente al sector para el D2 (ver posicion_pares).
+    """
+    t0 = time.perf_counter()
+    if secciones is None:
+        secciones = preparar_secciones(r23, r24, executor=executor, objetivos=objetivos, fecha=fecha, pares=pares)
+    narrativa = secciones["narrativa"]; tablas = secciones["tablas"]
     width, height = A4
-    c = canvas.Canvas(filename, pagesize=A4)
+    c = canvas.Canvas(filename, pagesize=A4, invariant=1 if reproducible else 0, pageCompression=1)
+    salida = {"optimizar": optimizar, "paleta": paleta}
+    c.setTitle("Informe Financiero y Económico"); c.setAuthor("Informe Financiero"); c.setCreator("panda.py")
     x_margin = 2*cm
     y = height - 2*cm
     content_width = width - 4*cm
@@ -660,26 +2455,29 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
     
     # A1. Fondo de Maniobra (DENTRO DE CAJA)
     fm23 = r23.get("Fondo Maniobra"); fm24 = r24.get("Fondo Maniobra")
-    equilibrio24, justif_eq = clasificar_situacion_patrimonial_v2(r24)
+    equilibrio24, justif_eq = narrativa["equilibrio"]
+    alerta_z, alerta_etiqueta, alerta_detalle = narrativa["alerta"]
     
+    simbolo = simbolo_moneda(moneda)
     p_fm = Paragraph(f"<font size=11><b>A1. Fondo de Maniobra (FM) y Equilibrio Patrimonial</b></font>", estilo_contenido)
     
     # Usamos HEX_ACENTO (string) en <font color>
-    p_content_fm = Paragraph(f"<b>FM 2023:</b> Bs. {fmt_num(fm23)} | <b>FM 2024:</b> Bs. {fmt_num(fm24)}.<br/><b>Evolución:</b> {'Mejora' if fm24 > fm23 else ('Empeora' if fm24 < fm23 else 'Se mantiene')}.<br/><b>Equilibrio Patrimonial (2024):</b> <font color='{HEX_ACENTO}'><b>{equilibrio24}</b></font>.", estilo_contenido)
+    p_content_fm = Paragraph(f"<b>FM 2023:</b> {simbolo} {fmt_num(fm23)} | <b>FM 2024:</b> {simbolo} {fmt_num(fm24)}.<br/><b>Evolución:</b> {'Mejora' if fm24 > fm23 else ('Empeora' if fm24 < fm23 else 'Se mantiene')}.<br/><b>Equilibrio Patrimonial (2024):</b> <font color='{HEX_ACENTO}'><b>{equilibrio24}</b></font>."
+                              f"<br/><b>Alerta temprana (Z'):</b> {alerta_z} → <font color='{HEX_PRINCIPAL}'><b>{alerta_etiqueta}</b></font>.<br/><font size=8>{alerta_detalle}</font>", estilo_contenido)
     
     y = draw_section_box(c, x_margin, y, [p_fm, p_content_fm], content_width, box_color=COLOR_CAJA_OBJ)
+    _traza_pdf(c, "A1", y)
 
     # A2. Análisis Vertical + Gráfico de Pastel 
-    av24, econo_str, finan_str = generar_analisis_vertical(r24)
+    av24, econo_str, finan_str = narrativa["vertical"]
     
     p = Paragraph("<font size=11><b>A2. Análisis Vertical del Balance 2024</b></font>", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 5
     
     # Dibujar Pie Chart
-    pie_chart = generar_pie_chart_financiacion(r24)
-    if pie_chart:
+    if secciones["pie"]:
         img_x = x_margin + content_width - 7.5*cm 
         img_y = y - 7*cm
-        c.drawImage(pie_chart, img_x, img_y, width=7*cm, height=7*cm)
+        dibujar_grafico(c, secciones["pie"], img_x, img_y, 7*cm, 7*cm, **salida)
 
         # Mover la explicación a la izquierda del gráfico
         y_text_start = y - 5
@@ -699,7 +2497,7 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
     if y < 4*cm: c.showPage(); y = height - 2*cm
     
     # A3. Análisis Horizontal
-    ah = generar_analisis_horizontal(r23, r24)
+    ah = narrativa["horizontal"]
     p = Paragraph("<font size=11><b>A3. Análisis Horizontal del Balance</b></font>", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 5
     
     # Usamos HEX_ACENTO (string) en <font color>
@@ -709,7 +2507,7 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
 
     # A4. Ciclo de Conversión de Efectivo (DENTRO DE CAJA)
     d_inv = r24.get("_dias_inventario"); d_clie = r24.get("_dias_clientes"); d_prov = r24.get("_dias_proveedores")
-    cce_24, sosten_24 = calcular_cce(d_inv, d_clie, d_prov)
+    cce_24, sosten_24 = narrativa["cce"]
     
     p_cce_title = Paragraph(f"<font size=11><b>A4. Ciclo de Conversión de Efectivo (CCE) 2024</b></font>", estilo_contenido)
     # Usamos HEX_ACENTO (string) en <font color>
@@ -724,6 +2522,7 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
     p_diag = Paragraph(f"Estado patrimonial: <font color='{HEX_PRINCIPAL}'><b>{equilibrio24}</b></font>.<br/>**Justificación numérica:** {justif_eq}", estilo_contenido)
     
     w, h = p_diag.wrapOn(c, content_width, y); p_diag.drawOn(c, x_margin, y - h); y -= h + 15
+    _traza_pdf(c, "A5", y)
     
     # -----------------------------
     # PAGE 2: Cuestionario B y C
@@ -739,12 +2538,7 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
     # B1. Ratios Liquidez (Liquidez, Tesorería, Disponibilidad)
     p = Paragraph("<font size=11><b>B1. Ratios de Liquidez (2024)</b></font>", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 5
     
-    table_data_liq = [
-        ["Ratio", "Fórmula", "Resultado (2024)", "Interpretación"],
-        ["Liquidez General", "AC / PC", fmt_num(r24.get("Liquidez General")), f"Nivel {'Alto' if r24.get('Liquidez General') > 1.5 else ('Bajo' if r24.get('Liquidez General') < 1.0 else 'Aceptable')}"],
-        ["Tesorería", "(Caja+Deudores) / PC", fmt_num(r24.get("Tesorería")), f"Capacidad de pago inmediata sin Inventario"],
-        ["Disponibilidad", "Caja / PC", fmt_num(r24.get("Disponibilidad")), f"Capacidad de pago con efectivo"],
-    ]
+    table_data_liq = tablas["B1"]
     t_data_liq = [[Paragraph(str(k[0]), estilo_contenido), Paragraph(str(k[1]), estilo_contenido), Paragraph(str(k[2]), estilo_contenido), Paragraph(str(k[3]), estilo_contenido)] for k in table_data_liq]
     t_liq = Table(t_data_liq, colWidths=[3.5*cm, 4.5*cm, 3*cm, 3.5*cm])
     t_liq.setStyle(generar_table_style())
@@ -753,27 +2547,24 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
     # B2. Ratios Solvencia (Garantía, Autonomía, Calidad Deuda)
     p = Paragraph("<font size=11><b>B2. Ratios de Solvencia y Estructura (2024)</b></font>", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 5
 
-    table_data_sol = [
-        ["Ratio", "Fórmula", "Resultado (2024)", "Interpretación"],
-        ["Garantía", "Activo / Pasivo", fmt_num(r24.get("Garantía")), f"Solvencia: El Activo cubre el Pasivo {fmt_num(r24.get('Garantía'), 1)} veces"],
-        ["Autonomía", "PN / Pasivo", fmt_num(r24.get("Autonomía")), f"Autofinanciación: Proporción de Recursos Propios"],
-        ["Calidad Deuda", "PC / Pasivo", fmt_num(r24.get("Calidad Deuda")), f"Corto Plazo sobre Deuda Total"],
-    ]
+    table_data_sol = tablas["B2"]
     t_data_sol = [[Paragraph(str(k[0]), estilo_contenido), Paragraph(str(k[1]), estilo_contenido), Paragraph(str(k[2]), estilo_contenido), Paragraph(str(k[3]), estilo_contenido)] for k in table_data_sol]
     t_sol = Table(t_data_sol, colWidths=[3.5*cm, 4.5*cm, 3*cm, 3.5*cm])
     t_sol.setStyle(generar_table_style())
     w, t_h = t_sol.wrapOn(c, content_width, y); t_sol.drawOn(c, x_margin, y - t_h); y -= t_h + 10
+    _traza_pdf(c, "B2", y)
     
     if y < 4*cm: c.showPage(); y = height - 2*cm
 
     # B3. Ratios Rentabilidad y Apalancamiento (Gráfico y Texto)
     p = Paragraph("<font size=11><b>B3. Análisis de Rentabilidad y Apalancamiento (2024)</b></font>", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 5
     
-    img_rat_rrp = generar_draw_rat_rrp(r24)
-    c.drawImage(img_rat_rrp, x_margin + 0.5*cm, y - 5*cm, width=7*cm, height=4*cm, mask='auto')
+    # El mismo raster se reutiliza en C4 (con optimizar=True se incrusta una sola vez)
+    img_rat_rrp = secciones["rat_rrp"]
+    dibujar_grafico(c, img_rat_rrp, x_margin + 0.5*cm, y - 5*cm, 7*cm, 4*cm, mask='auto', **salida)
     
     # Análisis de Apalancamiento (Texto)
-    apal_res = generar_analisis_apalancamiento(r24)
+    apal_res = narrativa["apalancamiento"]
     p_apal_title = Paragraph(f"<font size=11><b>Efecto Apalancamiento Financiero</b></font>", estilo_contenido)
     p_apal_content = Paragraph(f"<b>Costo Deuda (i):</b> {apal_res['a']}<br/><b>Comparación:</b> {apal_res['b']}<br/><font color='{HEX_ACENTO}'><b>Conclusión:</b> {apal_res['apal_efecto_str']} | **RRP Apalancada:** {apal_res['c_rrp']}</font><br/><b>Recomendación de Deuda:</b> {apal_res['d']}", estilo_contenido)
     
@@ -783,7 +2574,7 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
 
 
     # B4. Análisis de Estructura Financiera 
-    comentarios, eq_str = generar_analisis_financiero(r24)
+    comentarios, eq_str = narrativa["financiero"]
     p = Paragraph("<font size=11><b>B4. Análisis de Estructura Financiera (2024)</b></font>", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 5
     p_b4 = Paragraph(f"{comentarios.replace('\n', '<br/>')}<br/><b>¿Estructura equilibrada para software?:</b> **{eq_str}**", estilo_contenido)
     w, h = p_b4.wrapOn(c, content_width, y); p_b4.drawOn(c, x_margin, y - h); y -= h + 10
@@ -793,7 +2584,7 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
         c.showPage()
         y = height - 2*cm
     #
-    estres = generar_estres_financiero(r24)
+    estres = narrativa["estres"]
     p = Paragraph("<font size=11><b>B5. Estrés Financiero - Escenario Pesimista (Ventas -30% en 2025)</b></font>", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 5
     
     # Usamos HEX_PRINCIPAL (string) en <font color>
@@ -803,6 +2594,7 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
                      f"c) Punto de Quiebra (Ventas mínimas): **{fmt_num(estres['PQ_Ventas'])}**", estilo_contenido)
     
     w, h = p_b5.wrapOn(c, content_width, y); p_b5.drawOn(c, x_margin, y - h); y -= h + 15
+    _traza_pdf(c, "B5", y)
 
     # SECCIÓN C (Completa)
     p = Paragraph("SECCIÓN C: ANÁLISIS DE RATIOS FINANCIEROS Y APALANCAMIENTO", estilo_titulo_seccion); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 15
@@ -810,18 +2602,18 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
     # C1. Liquidez
     p = Paragraph("<font size=11><b>C1. Ratios de Liquidez (Corto Plazo)</b></font>", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 5
     # Usamos HEX_ACENTO (string) en <font color>
-    p_c1 = Paragraph(f"<b>Liquidez General (AC/PC):</b> <font color='{HEX_ACENTO}'><b>{fmt_num(r24.get('Liquidez General'))}</b></font> (óptimo 1.5-2.0)<br/>"
-                     f"<b>Razón de Tesorería (C+D/PC):</b> {fmt_num(r24.get('Tesorería'))} (óptimo ~1.0)<br/>"
-                     f"<b>Disponibilidad (C/PC):</b> {fmt_num(r24.get('Disponibilidad'))} (óptimo 0.2-0.3)", estilo_contenido)
+    p_c1 = Paragraph(f"<b>Liquidez General ({formula_corta('Liquidez General')}):</b> <font color='{HEX_ACENTO}'><b>{fmt_num(r24.get('Liquidez General'))}</b></font> ({REGISTRO_RATIOS['Liquidez General']['optimo_texto']})<br/>"
+                     f"<b>Razón de Tesorería ({formula_corta('Tesorería')}):</b> {fmt_num(r24.get('Tesorería'))} ({REGISTRO_RATIOS['Tesorería']['optimo_texto']})<br/>"
+                     f"<b>Disponibilidad ({formula_corta('Disponibilidad')}):</b> {fmt_num(r24.get('Disponibilidad'))} ({REGISTRO_RATIOS['Disponibilidad']['optimo_texto']})", estilo_contenido)
     w, h = p_c1.wrapOn(c, content_width, y); p_c1.drawOn(c, x_margin, y - h); y -= h + 10
     
     # C2. Solvencia y Endeudamiento
     if y < 4*cm: c.showPage(); y = height - 2*cm
     p = Paragraph("<font size=11><b>C2. Ratios de Solvencia y Endeudamiento (Largo Plazo)</b></font>", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 5
     # Usamos HEX_ACENTO (string) en <font color>
-    p_c2 = Paragraph(f"<b>Garantía (Activo/Pasivo):</b> <font color='{HEX_ACENTO}'><b>{fmt_num(r24.get('Garantía'))}</b></font> (óptimo > 1.5)<br/>"
-                     f"<b>Autonomía (PN/Pasivo):</b> {fmt_num(r24.get('Autonomía'))} (óptimo > 1.0)<br/>"
-                     f"<b>Calidad de la Deuda (PC/Pasivo):</b> {fmt_num(r24.get('Calidad Deuda'))} (vigilancia si es > 0.6)", estilo_contenido)
+    p_c2 = Paragraph(f"<b>Garantía ({formula_corta('Garantía')}):</b> <font color='{HEX_ACENTO}'><b>{fmt_num(r24.get('Garantía'))}</b></font> ({REGISTRO_RATIOS['Garantía']['optimo_texto']})<br/>"
+                     f"<b>Autonomía ({formula_corta('Autonomía')}):</b> {fmt_num(r24.get('Autonomía'))} ({REGISTRO_RATIOS['Autonomía']['optimo_texto']})<br/>"
+                     f"<b>Calidad de la Deuda ({formula_corta('Calidad Deuda')}):</b> {fmt_num(r24.get('Calidad Deuda'))} ({REGISTRO_RATIOS['Calidad Deuda']['optimo_texto']})", estilo_contenido)
     w, h = p_c2.wrapOn(c, content_width, y); p_c2.drawOn(c, x_margin, y - h); y -= h + 10
 
     # C3. Rentabilidad (RAT vs RRP)
@@ -834,14 +2626,14 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
     w, h = p_c3.wrapOn(c, content_width, y); p_c3.drawOn(c, x_margin, y - h); y -= h + 10
     
     # C4. Gráfico RAT vs RRP 
-    rat_rrp_chart = generar_draw_rat_rrp(r24)
+    rat_rrp_chart = img_rat_rrp
     if rat_rrp_chart:
-        c.drawImage(rat_rrp_chart, x_margin, y - 4*cm, width=content_width, height=4*cm)
+        dibujar_grafico(c, rat_rrp_chart, x_margin, y - 4*cm, content_width, 4*cm, **salida)
         y -= 4.5*cm
 
     # C5. Apalancamiento Financiero
     if y < 6*cm: c.showPage(); y = height - 2*cm
-    apal = generar_analisis_apalancamiento(r24)
+    apal = apal_res
     p = Paragraph("<font size=11><b>C5. Apalancamiento Financiero</b></font>", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 5
     
     c5_color_choice = HEX_ACENTO if apal['apal_efecto_str'].find('POSITIVO')!=-1 else HEX_PRINCIPAL
@@ -853,6 +2645,7 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
         f"c) RRP Apalancada: {apal['c_rrp']}<br/>"
         f"d) ¿Convendría aumentar deuda?: **{apal['d']}**", estilo_contenido)
     w, h = p_c5.wrapOn(c, content_width, y); p_c5.drawOn(c, x_margin, y - h); y -= h + 15
+    _traza_pdf(c, "C5", y)
 
     
     # -----------------------------
@@ -865,13 +2658,7 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
 
     # D1 Matriz de ratios comparativa 
     c.setFont("Helvetica-Bold", 10); c.drawString(x_margin, y, "D1. Matriz de Ratios Comparativos 2023 vs 2024"); y -= 12
-    keys = ["Fondo Maniobra", "Liquidez General", "Tesorería", "Disponibilidad", "Garantía", "Autonomía", "Calidad Deuda", "RAT", "RRP"]
-    header = [Paragraph("Ratio", estilo_contenido), Paragraph("2023", estilo_contenido), Paragraph("2024", estilo_contenido), Paragraph("Cambio (abs)", estilo_contenido), Paragraph("Cambio (%)", estilo_contenido)]
-    table_data = [header]
-    for k in keys:
-        v23 = r23.get(k); v24 = r24.get(k); abs_ch = (v24 - v23) if (v23 is not None and v24 is not None) else None
-        pct_ch = safe_div(abs_ch, abs(v23)) * 100 if (abs_ch is not None and v23 not in (None,0)) else None
-        table_data.append([Paragraph(k, estilo_contenido), Paragraph(fmt_num(v23), estilo_contenido), Paragraph(fmt_num(v24), estilo_contenido), Paragraph(fmt_num(abs_ch), estilo_contenido), Paragraph((fmt_num(pct_ch) + "%" if pct_ch is not None else "N/A"), estilo_contenido)])
+    table_data = [[Paragraph(celda, estilo_contenido) for celda in fila] for fila in tablas["D1"]]
     colw = [4.5*cm, 2.8*cm, 2.8*cm, 3.2*cm, 3.2*cm]
     t = Table(table_data, colWidths=colw)
     t.setStyle(TableStyle([
@@ -884,26 +2671,14 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
     ])); w,t_h = t.wrapOn(c, content_width, y); t.drawOn(c, x_margin, y - t_h); y -= t_h + 10
 
     # Gráfico comparativo 
-    plot_keys = ["Liquidez General", "Tesorería", "Garantía", "Autonomía", "RAT", "RRP"]
-    vals23 = [r23.get(k) or 0 for k in plot_keys]; vals24 = [r24.get(k) or 0 for k in plot_keys]
-    fig, ax = plt.subplots(figsize=(8.5,3.5)); x = np.arange(len(plot_keys))
-    
-    # CORRECCIÓN CLAVE: Usamos las cadenas HEX directamente para Matplotlib
-    ax.bar(x - 0.18, vals23, width=0.35, label="2023", color=HEX_PRINCIPAL); 
-    ax.bar(x + 0.18, vals24, width=0.35, label="2024", color=HEX_ACENTO)
-    
-    ax.set_xticks(x); ax.set_xticklabels(plot_keys, rotation=30, ha="right"); 
-    ax.legend(); ax.grid(axis='y', linestyle='--', alpha=0.7); 
-    ax.set_title('Evolución de Ratios Clave (2023 vs 2024)')
-    plt.tight_layout()
-    buf = BytesIO(); plt.savefig(buf, format='PNG', dpi=150); plt.close(fig); buf.seek(0); img = ImageReader(buf)
     if y - 7*cm < 2*cm: c.showPage(); y = height - 2*cm
-    c.drawImage(img, x_margin, y - 7*cm, width=content_width, height=7*cm); y -= 7.5*cm
+    dibujar_grafico(c, secciones["comparativo"], x_margin, y - 7*cm, content_width, 7*cm, **salida); y -= 7.5*cm
+    _traza_pdf(c, "D1", y)
 
     # D2 Fortalezas y Debilidades
     if y < 6*cm: c.showPage(); y = height - 2*cm
     c.setFont("Helvetica-Bold", 10); c.drawString(x_margin, y, "D2. Fortalezas y Debilidades"); y -= 12
-    fz, db = generar_fortalezas_debilidades(r23, r24)
+    fz, db = narrativa["fortalezas"]
     
     # Dividir el espacio para dos columnas (Fortalezas y Debilidades)
     col1_x = x_margin
@@ -924,19 +2699,18 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
         p_item = Paragraph("• " + it, estilo_contenido); w, h = p_item.wrapOn(c, col_width, y_current_db - h); p_item.drawOn(c, col2_x, y_current_db - h); y_current_db -= h + 5
 
     y = min(y_current, y_current_db) - 10
+    _traza_pdf(c, "D2", y)
 
     # D3 Diagnóstico ejecutivo
     if y < 6*cm: c.showPage(); y = height - 2*cm
     c.setFont("Helvetica-Bold", 10); c.drawString(x_margin, y, "D3. Diagnóstico Ejecutivo Integral"); y -= 12
-    c.setFont("Helvetica", 9); diag = generar_diagnostico(r23, r24)
+    c.setFont("Helvetica", 9); diag = narrativa["diagnostico"]
     p_diag_final = Paragraph(diag.replace('\n', '<br/>'), estilo_contenido)
     w, h = p_diag_final.wrapOn(c, content_width, y); p_diag_final.drawOn(c, x_margin, y - h); y -= h + 10
 
     # D4 Recomendaciones (DENTRO DE CAJA)
     if y < 6*cm: c.showPage(); y = height - 2*cm
-    c.setFont("Helvetica-Bold", 10); c.drawString(x_margin, y, "D4. Recomendaciones Estratégicas (3 medidas cuantificadas)"); y -= 12
-    c.setFont("Helvetica", 9)
-    recs = generar_recomendaciones(r23, r24)
+    recs = narrativa["recomendaciones"]
     
     # Usamos HEX_PRINCIPAL (string) en <font color>
     items_recs = [
@@ -944,22 +2718,969 @@ def generar_pdf_final(r23, r24, filename="Informe_Financiero_Elegante.pdf"):
         f"**2) Rentabilidad:** {recs['b) Rentabilidad']}. Cuantificación: <font color='{HEX_PRINCIPAL}'>{recs['b_cuantif']}</font>",
         f"**3) Eficiencia operativa:** {recs['c) Eficiencia operativa']}. Cuantificación: <font color='{HEX_PRINCIPAL}'>{recs['c_cuantif']}</font>"
     ]
+    if "d) Solvencia" in recs:
+        items_recs.append(f"**4) Solvencia:** {recs['d) Solvencia']}. Cuantificación: <font color='{HEX_PRINCIPAL}'>{recs['d_cuantif']}</font>")
+    c.setFont("Helvetica-Bold", 10); c.drawString(x_margin, y, f"D4. Recomendaciones Estratégicas ({len(items_recs)} medidas cuantificadas)"); y -= 12
+    c.setFont("Helvetica", 9)
     
     p_recs_title = Paragraph(f"<font size=11><b>Prioridades Estratégicas</b></font>", estilo_contenido)
     p_recs_content = Paragraph("<br/>".join(items_recs), estilo_contenido)
     
     y = draw_section_box(c, x_margin, y, [p_recs_title, p_recs_content], content_width, box_color=COLOR_CAJA_OBJ)
+    _traza_pdf(c, "D4", y)
+
+    # SECCIÓN E: DuPont
+    c.showPage(); y = height - 2*cm
+    p = Paragraph("SECCIÓN E: DESCOMPOSICIÓN DUPONT DE LA RENTABILIDAD FINANCIERA", estilo_titulo_seccion); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 15
+    p = Paragraph("<font size=11><b>E1. RRP = Margen Neto × Rotación del Activo × Multiplicador de Capital</b></font>", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 5
+    t_dup = Table([[Paragraph(str(celda), estilo_contenido) for celda in fila] for fila in tablas["E1"]], colWidths=[3.8*cm, 3.4*cm, 2.6*cm, 2.6*cm, 4.1*cm])
+    t_dup.setStyle(generar_table_style())
+    w, t_h = t_dup.wrapOn(c, content_width, y); t_dup.drawOn(c, x_margin, y - t_h); y -= t_h + 5
+    p = Paragraph("Aporte de cada factor en puntos porcentuales de RRP (reparto de Shapley: los tres aportes suman exactamente la variación).", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 10
+    dibujar_grafico(c, secciones["dupont"], x_margin, y - 7*cm, content_width, 7*cm, **salida); y -= 7.5*cm
+    _traza_pdf(c, "E1", y)
 
+    # ANEXOS (tablas adicionales, p.ej. aportes de filiales en el consolidado)
+    if anexos:
+        c.showPage(); y = height - 2*cm
+        p = Paragraph("ANEXOS", estilo_titulo_seccion); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 15
+        for anexo in anexos:
+            y = dibujar_anexo(c, anexo, x_margin, y, content_width, height, estilo_contenido, **salida)
+            _traza_pdf(c, f"Anexo: {anexo.get('titulo', '')}", y)
+
+    paginas = c.getPageNumber()
     c.save()
+    log_pdf.info("pdf", extra={"archivo": filename if isinstance(filename, str) else type(filename).__name__,
+                               "paginas": paginas, "segundos": round(time.perf_counter() - t0, 6)})
+
+def dibujar_anexo(c, anexo, x_margin, y, content_width, height, estilo_contenido, optimizar=True, paleta=False):
+    """
+    Dibuja un anexo: tabla ("filas", se parte entre páginas si no cabe) y/o
+    imagen ("imagen", PNG) con "marcadores" opcionales [(fx, fy), ...] en
+    fracciones de la imagen, estampados como puntos vectoriales encima.
+    """
+    if y < 6*cm: c.showPage(); y = height - 2*cm
+    p = Paragraph(f"<font size=11><b>{anexo['titulo']}</b></font>", estilo_contenido); w, h = p.wrapOn(c, content_width, y); p.drawOn(c, x_margin, y - h); y -= h + 5
+    filas = anexo.get("filas")
+    if filas:
+        t = Table([[Paragraph(str(celda), estilo_contenido) for celda in fila] for fila in filas], repeatRows=1)
+        t.setStyle(generar_table_style(len(filas)))
+        pendientes = [t]
+        while pendientes:
+            t = pendientes.pop(0)
+            w, t_h = t.wrapOn(c, content_width, y - 2*cm)
+            if t_h > y - 2*cm:
+                partes = t.split(content_width, y - 2*cm)
+                if len(partes) > 1:
+                    pendientes = partes + pendientes
+                    continue
+                c.showPage(); y = height - 2*cm
+                pendientes.insert(0, t)
+                continue
+            t.drawOn(c, x_margin, y - t_h); y -= t_h + 10
+    if anexo.get("imagen"):
+        img = _png_a_imagen(anexo["imagen"])
+        iw, ih = img.getSize()
+        img_h = content_width * ih / iw
+        if y - img_h < 2*cm: c.showPage(); y = height - 2*cm
+        img_y = y - img_h
+        dibujar_grafico(c, anexo["imagen"], x_margin, img_y, content_width, img_h, optimizar=optimizar, paleta=paleta)
+        c.setFillColor(colors.HexColor("#E91E63")); c.setStrokeColor(colors.black); c.setLineWidth(0.5)
+        for fx, fy in anexo.get("marcadores", []):
+            c.circle(x_margin + fx * content_width, img_y + fy * img_h, 3.5, stroke=1, fill=1)
+        c.setFillColor(colors.black)
+        y = img_y - 10
+    return y
+
+# -----------------------------
+# Informes comparativos por sector
+# -----------------------------
+def estadisticas_sector(rv, sector, claves=None):
+    """
+    Percentiles 5/25/50/75/95 de cada ratio por sector, con una llamada a
+    np.nanpercentile por sector sobre la matriz (empresas x ratios).
+    Devuelve {sector: ndarray (5, len(claves))}.
+    """
+    claves = claves or D1_KEYS
+    sector = np.asarray(sector)
+    M = np.column_stack([rv[k] for k in claves])
+    orden = np.argsort(sector, kind="stable")
+    valores, inicios = np.unique(sector[orden], return_index=True)
+    stats = {}
+    for s_val, bloque in zip(valores, np.split(orden, inicios[1:])):
+        stats[s_val] = np.nanpercentile(M[bloque], [5, 25, 50, 75, 95], axis=0)
+    return stats
+
+def renderizar_distribucion_sector(p, nombre_sector, claves=None):
+    """
+    Boxplots (p5-p95, cuartiles y mediana) de cada ratio del sector, en un
+    PNG que se renderiza una vez por sector. Devuelve (png, geometría) donde
+    geometría[clave] = (x0, y0, ancho, alto, ymin, ymax) en fracciones de la
+    imagen, para estampar después el punto de cada empresa.
+    """
+    claves = claves or D1_KEYS
+    columnas = 3; filas_graf = int(math.ceil(len(claves) / columnas))
+    fig, axes = _nueva_figura((8.5, 2.3 * filas_graf), filas_graf, columnas)
+    axes = np.atleast_1d(axes).ravel()
+    geometria = {}
+    for j, (ax, k) in enumerate(zip(axes, claves)):
+        p5, q1, med, q3, p95 = p[:, j]
+        if np.isnan(med):
+            ax.set_axis_off(); ax.set_title(f"{k} (N/A)", fontsize=9)
+            continue
+        ax.bxp([{"med": med, "q1": q1, "q3": q3, "whislo": p5, "whishi": p95, "fliers": []}],
+               showfliers=False, widths=0.5, patch_artist=True,
+               boxprops={"facecolor": HEX_CAJA, "edgecolor": HEX_PRINCIPAL}, medianprops={"color": HEX_ACENTO, "linewidth": 2})
+        margen = (p95 - p5) * 0.15 or abs(med) * 0.1 or 1.0
+        ax.set_xlim(0.5, 1.5); ax.set_ylim(p5 - margen, p95 + margen)
+        ax.set_xticks([]); ax.set_title(k, fontsize=9); ax.tick_params(labelsize=7)
+        ax.grid(axis='y', linestyle='--', alpha=0.5)
+    for ax in axes[len(claves):]:
+        ax.set_axis_off()
+    fig.suptitle(f"Distribución del sector {nombre_sector} (p5-p95)", fontsize=11)
+    fig.tight_layout()
+    for ax, k in zip(axes, claves):
+        if ax.axison:
+            pos = ax.get_position(); ymin, ymax = ax.get_ylim()
+            geometria[k] = (pos.x0, pos.y0, pos.width, pos.height, ymin, ymax)
+    # Sin bbox 'tight' para que las fracciones de la figura coincidan con la imagen
+    return _figura_a_png(fig, bbox_inches=None), geometria
+
+def marcadores_empresa(r, geometria):
+    """Posiciones (fx, fy) del valor de la empresa en cada boxplot; fuera de escala se recorta al borde."""
+    marcas = []
+    for k, (x0, y0, w, h, ymin, ymax) in geometria.items():
+        v = r.get(k)
+        if v is None:
+            continue
+        v = min(max(v, ymin), ymax)
+        marcas.append((x0 + w * 0.5, y0 + h * (v - ymin) / (ymax - ymin)))
+    return marcas
+
+def anexo_comparativo(r24, p, nombre_sector, png, geometria, claves=None):
+    """Anexos del informe comparativo: tabla empresa vs cuartiles y gráfico del sector con su marca."""
+    claves = claves or D1_KEYS
+    filas = [["Ratio", "Empresa", "Q1", "Mediana", "Q3", "Posición"]]
+    for j, k in enumerate(claves):
+        v = r24.get(k); _, q1, med, q3, _ = p[:, j]
+        if v is None or np.isnan(med):
+            pos = "N/A"
+        else:
+            pos = "< Q1" if v < q1 else ("Q1 - Mediana" if v < med else ("Mediana - Q3" if v <= q3 else "> Q3"))
+        filas.append([k, fmt_num(v), fmt_num(q1), fmt_num(med), fmt_num(q3), pos])
+    return [
+        {"titulo": f"Comparación con el sector {nombre_sector} (2024)", "filas": filas},
+        {"titulo": "Posición de la empresa en la distribución del sector", "imagen": png, "marcadores": marcadores_empresa(r24, geometria)},
+    ]
+
+def generar_informes_comparativos(t23, t24, sector, carpeta, executor=None, reproducible=False, fecha=None, d2_sector=False, carpeta_cache=None):
+    """
+    Un PDF por empresa con su informe completo más la comparación con su
+    sector. Ratios, percentiles y gráficos de sector se calculan una sola vez
+    para toda la cartera; cada informe se dibuja en el executor si se pasa.
+    Con d2_sector=True las fortalezas y debilidades (D2) se redactan frente a
+    la mediana del sector (atipicos_sector) en lugar de con umbrales fijos.
+    Con `carpeta_cache` cada informe pasa por generar_pdf_cacheado: al repetir
+    la cartera solo se dibujan las empresas (o sectores) que cambiaron.
+    Devuelve la lista de rutas generadas.
+    """
+    os.makedirs(carpeta, exist_ok=True)
+    rv23 = calcular_ratios_vectorizado(t23); rv24 = calcular_ratios_vectorizado(t24)
+    sector = np.asarray(sector)
+    stats = estadisticas_sector(rv24, sector)
+    graficos = {s_val: renderizar_distribucion_sector(p, s_val) for s_val, p in stats.items()}
+    at = atipicos_sector(rv24, sector) if d2_sector else None
+    empresas = t24.get("empresa")
+    rutas = []; futuros = []
+    for j in range(len(sector)):
+        nombre = str(empresas[j]) if empresas is not None else f"empresa_{j + 1}"
+        r23 = ratios_de_fila(rv23, j); r24 = ratios_de_fila(rv24, j)
+        png, geometria = graficos[sector[j]]
+        anexos = anexo_comparativo(r24, stats[sector[j]], sector[j], png, geometria)
+        ruta = os.path.join(carpeta, f"{nombre}.pdf")
+        kwargs = dict(filename=ruta, anexos=anexos, reproducible=reproducible, fecha=fecha)
+        if at is not None:
+            kwargs["pares"] = posicion_pares(at, rv24, j)
+        generar = generar_pdf_final
+        if carpeta_cache is not None:
+            generar = generar_pdf_cacheado
+            kwargs["carpeta_cache"] = carpeta_cache; del kwargs["reproducible"]
+        if executor is None:
+            generar(r23, r24, **kwargs)
+        else:
+            futuros.append(executor.submit(generar, r23, r24, **kwargs))
+        rutas.append(ruta)
+    for fut in futuros:
+        fut.result()
+    return rutas
+
+# -----------------------------
+# Atípicos por sector (estadística robusta)
+# -----------------------------
+# Fondo de Maniobra es un importe: depende del tamaño, no se compara entre pares
+CLAVES_ATIPICOS = [k for k in D1_KEYS if k != "Fondo Maniobra"] + ["Margen Neto", "Rotación Activo", "Endeudamiento"]
+UMBRAL_ATIPICO = 3.5      # |z robusto| a partir del cual se marca (criterio de Iglewicz-Hoaglin)
+Z_POSICION_PARES = 1.0    # |z robusto| a partir del cual D2 menciona el ratio frente al sector
+# Ratios en los que un valor menor es mejor; el resto, mayor es mejor
+SENTIDO_RATIO = {"Calidad Deuda": -1, "Endeudamiento": -1, "Costo Deuda (i)": -1, "Multiplicador Capital": -1}
+
+def _codificar_sectores(sector):
+    """
+    Lo mismo que np.unique(sector, return_inverse=True) para etiquetas de texto,
+    sin ordenar todas las filas: hay pocos sectores, así que los valores distintos
+    salen de una muestra y cada fila se localiza con searchsorted. Si alguno no
+    estaba en la muestra se añade y se repite la búsqueda una vez.
+    """
+    sector = np.asarray(sector).ravel()
+    if sector.dtype.kind not in "US":
+        return np.unique(sector, return_inverse=True)
+    valores = np.unique(sector[::997])
+    for _ in range(2):
+        codigo = np.searchsorted(valores, sector)
+        np.minimum(codigo, len(valores) - 1, out=codigo)
+        faltan = valores[codigo] != sector
+        if not faltan.any():
+            break
+        valores = np.union1d(valores, sector[faltan])
+    return valores, codigo
+
+def _mediana_filas(B, cnt):
+    """
+    Mediana de cada fila del bloque B (ratios x empresas de un sector) sobre sus
+    cnt valores finitos; los no finitos deben ser +inf para quedar al final.
+    Un np.partition de un solo kth por cada cnt // 2 distinto (casi siempre uno,
+    y entonces B se reordena en su sitio); con cnt par el otro valor central es
+    el máximo de la parte izquierda.
+    """
+    med = np.full(len(cnt), np.nan)
+    mitad = cnt // 2
+    for h in np.unique(mitad[cnt > 0]):
+        filas = np.flatnonzero((mitad == h) & (cnt > 0))
+        P = B if len(filas) == len(B) else B[filas]
+        P.partition(h, axis=1)
+        alto = P[:, h]
+        bajo = np.where(cnt[filas] % 2, alto, P[:, :h].max(axis=1)) if h else alto
+        med[filas] = 0.5 * (bajo + alto)
+    return med
+
+def estadisticas_robustas_sector(rv, sector, claves=None):
+    """
+    Mediana y MAD (desviación absoluta mediana) de cada ratio por sector,
+    ignorando NaN/inf. Las filas se ordenan una vez por código de sector en un
+    bloque (ratios x empresas) y mediana y MAD de todos los ratios de un sector
+    salen de np.partition sobre su tramo del bloque (_mediana_filas).
+    Devuelve {"sectores", "codigo" (sector de cada fila), "claves", "n", "mediana", "mad"}
+    con matrices (sectores x claves).
+    """
+    claves = claves or CLAVES_ATIPICOS
+    sectores, codigo = _codificar_sectores(sector)
+    S = len(sectores); K = len(claves)
+    # Códigos pequeños: argsort estable de enteros cortos es un radix sort (lineal)
+    orden = np.argsort(codigo.astype(np.int16 if S < (1 << 15) else np.int64), kind="stable")
+    limites = np.concatenate([[0], np.cumsum(np.bincount(codigo, minlength=S))])
+    posicion = np.empty_like(orden); posicion[orden] = np.arange(len(orden))
+    bloque = np.empty((K, len(orden)))
+    n = np.empty((S, K), dtype=np.int64)
+    for j, k in enumerate(claves):
+        col = np.asarray(rv[k], dtype=float)
+        np.take(col, orden, out=bloque[j])
+        # Los no finitos son pocos: se cuentan y se llevan a +inf solo donde están
+        malos = np.flatnonzero(~np.isfinite(col))
+        bloque[j, posicion[malos]] = np.inf
+        n[:, j] = np.diff(limites) - np.bincount(codigo[malos], minlength=S)
+    mediana = np.full((S, K), np.nan); mad = np.full((S, K), np.nan)
+    for s in range(S):
+        B = bloque[:, limites[s]:limites[s + 1]]
+        mediana[s] = _mediana_filas(B, n[s])
+        # |inf - m| sigue siendo inf: los no finitos siguen al final y cnt no cambia
+        mad[s] = _mediana_filas(np.abs(B - mediana[s][:, None]), n[s])
+    return {"sectores": sectores, "codigo": codigo, "claves": claves, "n": n, "mediana": mediana, "mad": mad}
+
+def atipicos_sector(rv, sector, claves=None, umbral=UMBRAL_ATIPICO, estadisticas=None):
+    """
+    z robusto de cada empresa frente a su sector, 0.6745 * (x - mediana) / MAD,
+    y marca de atípico |z| > umbral. Con MAD = 0 (la mayoría del sector con el
+    mismo valor) z queda NaN y no se marca.
+    Añade a las estadísticas {"z": {ratio: array}, "atipico": {ratio: bool array}, "cuantos": array}.
+    """
+    est = estadisticas or estadisticas_robustas_sector(rv, sector, claves)
+    codigo = est["codigo"]
+    z = {}; atipico = {}
+    cuantos = np.zeros(len(codigo), dtype=np.int16)
+    for j, k in enumerate(est["claves"]):
+        x = np.asarray(rv[k], dtype=float)
+        z[k] = _div(0.6745 * (x - est["mediana"][codigo, j]), est["mad"][codigo, j])
+        atipico[k] = np.abs(z[k]) > umbral
+        cuantos += atipico[k]
+    return dict(est, z=z, atipico=atipico, cuantos=cuantos, umbral=umbral)
+
+def posicion_pares(at, rv, j):
+    """{ratio: (valor, mediana del sector, z robusto)} de la fila j, para el D2 relativo al sector."""
+    s = at["codigo"][j]
+    out = {}
+    for c, k in enumerate(at["claves"]):
+        v = float(rv[k][j]); z = float(at["z"][k][j]); med = at["mediana"][s, c]
+        out[k] = (None if np.isnan(v) else v, None if np.isnan(med) else float(med), None if np.isnan(z) else z)
+    return out
+
+def fortalezas_debilidades_pares(pares, umbral=Z_POSICION_PARES):
+    """D2 a partir de la posición frente al sector: los ratios más alejados de la mediana primero."""
+    fz = []; db = []
+    for k, (v, med, z) in sorted(pares.items(), key=lambda it: -abs(it[1][2] or 0.0)):
+        if z is None or abs(z) < umbral:
+            continue
+        texto = f"{k}: {fmt_num(v)} frente a una mediana sectorial de {fmt_num(med)} (z robusto {fmt_num(z, 1)}"
+        texto += ", atípico)." if abs(z) > UMBRAL_ATIPICO else ")."
+        (fz if z * SENTIDO_RATIO.get(k, 1) > 0 else db).append(texto)
+    if not fz: fz.append("Ningún ratio destaca favorablemente frente a las empresas del sector.")
+    if not db: db.append("Ningún ratio queda claramente por detrás de las empresas del sector.")
+    return fz[:6], db[:6]
+
+def resumen_atipicos(at, empresas=None, ejemplos=10):
+    """Atípicos por ratio y las empresas con más ratios atípicos."""
+    peores = np.argsort(-at["cuantos"], kind="stable")[:ejemplos]
+    peores = peores[at["cuantos"][peores] > 0]
+    return {
+        "filas": int(len(at["codigo"])),
+        "sectores": int(len(at["sectores"])),
+        "por_ratio": {k: int(np.count_nonzero(m)) for k, m in at["atipico"].items()},
+        "empresas_con_atipicos": int(np.count_nonzero(at["cuantos"])),
+        "ejemplos": [(str(empresas[j]) if empresas is not None else int(j), int(at["cuantos"][j]),
+                      [k for k in at["claves"] if at["atipico"][k][j]]) for j in peores],
+    }
+
+# -----------------------------
+# Caché de informes (salida reproducible)
+# -----------------------------
+# Subir al cambiar el diseño del informe: invalida todas las entradas de caché
+VERSION_INFORME = 4
+
+def hash_informe(r23, r24, fecha=None, objetivos=None, anexos=None, moneda=MONEDA_INFORME, pares=None):
+    """Clave de caché: todo lo que determina el PDF (entradas, fecha, moneda, opciones y versión del diseño)."""
+    carga = json.dumps({"version": VERSION_INFORME, "r23": r23, "r24": r24, "fecha": fecha, "moneda": moneda,
+                        "objetivos": objetivos, "anexos": anexos, "pares": pares}, sort_keys=True, default=str)
+    return hashlib.sha256(carga.encode("utf-8")).hexdigest()
+
+def generar_pdf_cacheado(r23, r24, filename, carpeta_cache, fecha=None, objetivos=None, anexos=None, executor=None, moneda=MONEDA_INFORME, pares=None):
+    """
+    Genera el informe en modo reproducible guardándolo en `carpeta_cache`
+    bajo el hash de sus entradas; si ya existe, solo se copia a `filename`
+    (ruta o flujo binario abierto). Devuelve True si se reutilizó el informe cacheado.
+    """
+    os.makedirs(carpeta_cache, exist_ok=True)
+    # La fecha impresa forma parte de la clave: sin ella, un acierto otro día devolvería la fecha vieja
+    fecha = fecha or datetime.date.today()
+    clave = hash_informe(r23, r24, fecha=fecha, objetivos=objetivos, anexos=anexos, moneda=moneda, pares=pares)
+    ruta_cache = os.path.join(carpeta_cache, clave + ".pdf")
+    acierto = os.path.exists(ruta_cache)
+    if not acierto:
+        tmp = f"{ruta_cache}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            generar_pdf_final(r23, r24, filename=tmp, executor=executor, anexos=anexos, objetivos=objetivos, fecha=fecha,
+                              reproducible=True, moneda=moneda, pares=pares)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        os.replace(tmp, ruta_cache)
+    if not isinstance(filename, (str, os.PathLike)):
+        with open(ruta_cache, "rb") as f:
+            shutil.copyfileobj(f, filename)
+    elif os.path.abspath(filename) != os.path.abspath(ruta_cache):
+        shutil.copyfile(ruta_cache, filename)
+    return acierto
+
+# -----------------------------
+# Borrador inmediato + versión final en segundo plano
+# -----------------------------
+DPI_BORRADOR = 40
+# Valores de los que depende cada gráfico: si no cambian, se reutiliza el raster anterior
+DEPENDENCIAS_GRAFICOS = {
+    "pie": ((), ("_PC", "_PNC", "_PN")),
+    "rat_rrp": ((), ("RAT", "RRP", "RRP Apalancada")),
+    "comparativo": (tuple(PLOT_KEYS_D1), tuple(PLOT_KEYS_D1)),
+    "dupont": (("Margen Neto", "Rotación Activo", "Multiplicador Capital"), ("Margen Neto", "Rotación Activo", "Multiplicador Capital")),
+}
+
+def firma_grafico(nombre, r23, r24):
+    claves23, claves24 = DEPENDENCIAS_GRAFICOS[nombre]
+    return tuple(r23.get(k) for k in claves23) + tuple(r24.get(k) for k in claves24)
+
+def _render_final(r23, r24, filename, reutilizar, opciones):
+    """Trabajo de fondo: gráficos que falten a calidad completa + PDF en un temporal. Devuelve los rasters nuevos."""
+    secciones = preparar_secciones(r23, r24, objetivos=opciones.get("objetivos"), fecha=opciones.get("fecha"), reutilizar=reutilizar)
+    generar_pdf_final(r23, r24, filename=filename, secciones=secciones, **opciones)
+    return {k: secciones[k] for k in DEPENDENCIAS_GRAFICOS if k not in reutilizar}
+
+class InformeBorrador:
+    """
+    Escribe al instante un borrador del informe (gráficos nuevos como recuadro
+    pendiente, o a DPI_BORRADOR con calidad="baja") y lanza en `executor` el
+    render final, que sustituye al borrador al terminar. La maquetación es la
+    misma en ambos, así que el final no recoloca nada. Los gráficos cuyas
+    dependencias no cambiaron se toman de los finales anteriores, en los dos pasos.
+    """
+    def __init__(self, executor=None, calidad="marcador"):
+        self.executor = executor
+        self.propio = None
+        self.calidad = calidad
+        self.finales = {}   # nombre -> (firma, png a 150 dpi)
+        self.version = 0
+
+    def _pool(self):
+        if self.executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self.propio = self.executor = ProcessPoolExecutor(max_workers=1)
+        return self.executor
+
+    def _reutilizables(self, r23, r24):
+        firmas = {k: firma_grafico(k, r23, r24) for k in DEPENDENCIAS_GRAFICOS}
+        return firmas, {k: self.finales[k][1] for k, f in firmas.items() if k in self.finales and self.finales[k][0] == f}
+
+    def generar(self, r23, r24, filename, al_terminar=None, al_fallar=None, **opciones):
+        """
+        Escribe el borrador en `filename` y devuelve el future del final.
+        al_terminar(ruta) se llama (desde otro hilo) cuando el final reemplaza al borrador;
+        si entretanto se pidió otro informe, el final obsoleto se descarta.
+        Si el render final falla, el borrador se queda, se borra el temporal, se
+        registra un aviso y se llama a al_fallar(ruta, excepcion).
+        """
+        self.version += 1; version = self.version
+        firmas, reutilizar = self._reutilizables(r23, r24)
+        borrador = dict(reutilizar)
+        if self.calidad == "marcador":
+            borrador.update({k: GRAFICO_PENDIENTE for k in DEPENDENCIAS_GRAFICOS if k not in reutilizar})
+        secciones = preparar_secciones(r23, r24, objetivos=opciones.get("objetivos"), fecha=opciones.get("fecha"), dpi=DPI_BORRADOR, reutilizar=borrador)
+        generar_pdf_final(r23, r24, filename=filename, secciones=secciones, **opciones)
+        tmp = f"{filename}.final.{version}.tmp"
+        fut = self._pool().submit(_render_final, r23, r24, tmp, reutilizar, opciones)
+
+        def terminado(f):
+            if f.cancelled() or f.exception() is not None:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                if f.cancelled():
+                    return
+                error = f.exception()
+                log_pdf.warning("render final fallido", extra={"archivo": filename, "version": version},
+                                exc_info=(type(error), error, error.__traceback__))
+                if al_fallar: al_fallar(filename, error)
+                return
+            for k, png in f.result().items():
+                self.finales[k] = (firmas[k], png)
+            if version == self.version:
+                os.replace(tmp, filename)
+                if al_terminar: al_terminar(filename)
+            elif os.path.exists(tmp):
+                os.remove(tmp)
+        fut.add_done_callback(terminado)
+        return fut
+
+    def cerrar(self):
+        if self.propio is not None:
+            self.propio.shutdown(wait=True); self.propio = self.executor = None
+
+# -----------------------------
+# Pool de procesos precalentado (servicio de informes)
+# -----------------------------
+def precalentar_renderizado():
+    """Carga backend Agg, caché de fuentes y fuentes de ReportLab dibujando un informe completo en memoria."""
+    r = calcular_ratios_from_inputs({k: 1.0 for k in CAMPOS_ENTRADA})
+    generar_pdf_final(r, r, filename=BytesIO(), fecha=datetime.date(2000, 1, 1))
+
+def _iniciar_worker(barrera, turnos, registro=None):
+    precalentar_renderizado()
+    if registro:
+        # Mismo registro que el proceso que creó el pool, en un archivo por worker
+        import multiprocessing.util
+        raiz, ext = os.path.splitext(registro["ruta"])
+        configurar_registro(**dict(registro, ruta=f"{raiz}.{os.getpid()}{ext}"))
+        # Los workers salen con os._exit (sin atexit): vaciar la cola al reciclarse
+        multiprocessing.util.Finalize(None, detener_registro, exitpriority=10)
+    with turnos.get_lock():
+        turno = turnos.value; turnos.value += 1
+    # Solo la primera generación espera: crear_pool_precalentado no vuelve hasta que todos
+    # están calientes. Los reemplazos (reciclado) se precalientan y entran directamente.
+    if turno < barrera.parties - 1:
+        barrera.wait(timeout=120)
+
+def crear_pool_precalentado(workers=None, trabajos_por_worker=50):
+    """
+    ProcessPoolExecutor cuyos workers salen de un forkserver que ya importó
+    panda (matplotlib, ReportLab, NumPy) y que, al arrancar, dibujan un informe
+    de prueba. Los trabajos llegan por la cola del executor y cada worker se
+    recicla tras `trabajos_por_worker` informes para acotar la memoria; el
+    reemplazo se precalienta igual antes de recibir trabajo.
+    Si configurar_registro() está activo, cada worker registra en <ruta>.<pid>.
+    Se usa como cualquier executor de este módulo (generar_pdf_final, preparar_secciones, ...).
+    """
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count() or 1
+    if "forkserver" in mp.get_all_start_methods():
+        ctx = mp.get_context("forkserver")
+        ctx.set_forkserver_preload(["panda"])
+    else:
+        ctx = mp.get_context("spawn")
+    barrera = ctx.Barrier(workers + 1)
+    turnos = ctx.Value("i", 0)
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_iniciar_worker,
+                               initargs=(barrera, turnos, _config_registro), max_tasks_per_child=trabajos_por_worker)
+    # Se lanzan ya todos los workers sin enviarles tareas: una tarea de arranque gastaría
+    # uno de los `trabajos_por_worker` turnos antes del primer informe real
+    pool._launch_processes()
+    try:
+        barrera.wait(timeout=120)
+    except threading.BrokenBarrierError:
+        pool.shutdown(cancel_futures=True)
+        raise RuntimeError("Los workers del pool no terminaron de precalentarse")
+    return pool
+
+# -----------------------------
+# Lotes de informes con memoria acotada
+# -----------------------------
+def memoria_rss_mb():
+    """RSS actual del proceso en MB (/proc/self/statm); fuera de Linux, el pico de getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import sys, resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / 2**20 if sys.platform == "darwin" else pico / 1024
+
+def memoria_pico_mb():
+    """Pico de RSS (VmHWM) desde el último reiniciar_pico_rss(); sin /proc, el RSS actual."""
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return int(linea.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return memoria_rss_mb()
+
+def reiniciar_pico_rss():
+    # Linux >= 4.0: escribir 5 en clear_refs pone VmHWM al RSS actual
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def liberar_memoria():
+    """Cierra figuras sueltas, recoge ciclos y devuelve al sistema la memoria libre del heap (glibc)."""
+    plt.close("all")
+    gc.collect()
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+# Subida de RSS que se supone a un informe hasta haber medido la real (pico - RSS previo)
+MARGEN_INFORME_MB = 40.0
+
+def generar_lote_pdf(trabajos, destino, limite_mb=None, objetivos=None, fecha=None, reproducible=False, carpeta_cache=None):
+    """
+    Un PDF por cada (nombre, r23, r24) de `trabajos`, que puede ser un generador
+    (no se materializa). `destino` es una carpeta o una función nombre -> flujo
+    binario abierto, en el que se escribe directamente y que se cierra al acabar.
+    Tras cada informe se sueltan sus piezas y se fuerza gc.collect().
+    Con `limite_mb` el techo se respeta antes de dibujar: si el RSS más la mayor
+    subida medida en un informe (pico VmHWM, al principio MARGEN_INFORME_MB) lo
+    superaría, se libera memoria (liberar_memoria) y, si aun así no cabe, se lanza
+    MemoryError sin empezar el informe.
+    Con `carpeta_cache` los informes salen de generar_pdf_cacheado (siempre
+    reproducibles): un informe con las mismas entradas no se vuelve a dibujar.
+    Devuelve {"informes", "reutilizados", "liberaciones", "rss_inicial_mb", "rss_max_mb", "margen_mb"}.
+    """
+    rss_inicial = rss_max = memoria_rss_mb()
+    n = reutilizados = liberaciones = 0
+    margen = MARGEN_INFORME_MB
+    medido = False
+    for nombre, r23, r24 in trabajos:
+        rss = memoria_rss_mb()
+        if limite_mb is not None and rss + margen > limite_mb:
+            liberar_memoria(); liberaciones += 1
+            rss = memoria_rss_mb()
+            if rss + margen > limite_mb:
+                raise MemoryError(f"RSS de {rss:.0f} MB + {margen:.0f} MB por informe superaría el límite de {limite_mb} MB "
+                                  f"tras {n} informes")
+        reiniciar_pico_rss()
+        salida = destino(nombre) if callable(destino) else os.path.join(destino, f"{nombre}.pdf")
+        try:
+            if carpeta_cache is not None:
+                reutilizados += generar_pdf_cacheado(r23, r24, salida, carpeta_cache, fecha=fecha, objetivos=objetivos)
+            else:
+                generar_pdf_final(r23, r24, filename=salida, objetivos=objetivos, fecha=fecha, reproducible=reproducible)
+        finally:
+            if callable(destino):
+                salida.close()
+        n += 1
+        del r23, r24
+        # Canvas, ImageReader y figuras forman ciclos: se recogen ya, no cuando toque al GC
+        gc.collect()
+        pico = memoria_pico_mb(); rss_max = max(rss_max, pico)
+        # El margen pasa a ser la mayor subida real (el supuesto inicial solo vale hasta medir)
+        margen = max(margen if medido else 0.0, pico - rss); medido = True
+    return {"informes": n, "reutilizados": reutilizados, "liberaciones": liberaciones,
+            "rss_inicial_mb": rss_inicial, "rss_max_mb": rss_max, "margen_mb": margen}
+
+# -----------------------------
+# Exportación XLSX en streaming (matriz de ratios de la cartera)
+# -----------------------------
+# Estilos de styles.xml: texto, cabecera en negrita, número y porcentaje al estilo de fmt_num
+# (2 decimales con separador de miles; Excel pone '.' y ',' según la configuración regional)
+ESTILO_TEXTO, ESTILO_CABECERA, ESTILO_NUMERO, ESTILO_PORCENTAJE = 0, 1, 2, 3
+BLOQUE_XLSX = 2048
+
+_XLSX_TIPOS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>')
+_XLSX_RELS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>')
+_XLSX_LIBRO = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{hoja}" sheetId="1" r:id="rId1"/></sheets>'
+    '<definedNames><definedName name="_xlnm._FilterDatabase" localSheetId="0" hidden="1">{rango}</definedName></definedNames>'
+    '</workbook>')
+_XLSX_LIBRO_RELS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>')
+_XLSX_ESTILOS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="2"><numFmt numFmtId="164" formatCode="#,##0.00"/><numFmt numFmtId="165" formatCode="#,##0.00&quot;%&quot;"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '</styleSheet>')
+_XLSX_NA = '<c t="inlineStr"><is><t>N/A</t></is></c>'
+# Plantilla %-format de cada celda según su estilo: una fila entera se formatea de una vez.
+# Excel guarda 15 dígitos significativos, así que %.15g no pierde nada (y es más rápido que repr)
+_CELDA_XLSX = {
+    ESTILO_TEXTO: '<c t="inlineStr"><is><t>%s</t></is></c>',
+    ESTILO_NUMERO: f'<c s="{ESTILO_NUMERO}"><v>%.15g</v></c>',
+    ESTILO_PORCENTAJE: f'<c s="{ESTILO_PORCENTAJE}"><v>%.15g</v></c>',
+}
+_XML_NO_VALIDO = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def _letra_columna(j):
+    """Índice 0-based -> referencia de columna de Excel (0 -> A, 26 -> AA)."""
+    letras = ""
+    j += 1
+    while j:
+        j, resto = divmod(j - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+def _texto_xml(v):
+    # Fuera los caracteres de control que XML 1.0 no admite
+    return escape(_XML_NO_VALIDO.sub("", str(v)))
+
+def _valores_xlsx(col, estilo, memo):
+    """Valores de una columna del bloque listos para la plantilla; NaN/inf quedan como nan."""
+    if estilo == ESTILO_TEXTO:
+        return [memo[v] if v in memo else memo.setdefault(v, _texto_xml(v)) for v in col]
+    col = np.asarray(col, dtype=float)
+    return np.where(np.isfinite(col), col, np.nan).tolist()
+
+def _columnas_xlsx(t23, t24, sl, empresas):
+    """(título, estilo, valores) de cada columna para las filas `sl`; el orden fija la cabecera."""
+    b23 = {k: t23[k][sl] for k in CAMPOS_ENTRADA}
+    b24 = {k: t24[k][sl] for k in CAMPOS_ENTRADA}
+    rv23 = calcular_ratios_vectorizado(normalizar_tabla(b23))
+    rv24 = calcular_ratios_vectorizado(normalizar_tabla(b24))
+    validacion = np.array([", ".join(codigos_de_mascara(m)) for m in range(256)], dtype=object)
+    situacion = np.array(ETIQUETAS_SITUACION, dtype=object)
+    cce24, codigo_cce24 = clasificar_cce_vectorizado(rv24)
+    yield "Empresa", ESTILO_TEXTO, empresas[sl]
+    for k in CAMPOS_ENTRADA:
+        yield f"{k} 2023", ESTILO_NUMERO, b23[k]
+        yield f"{k} 2024", ESTILO_NUMERO, b24[k]
+    for nombre in REGISTRO_RATIOS:
+        v23 = rv23[nombre]; v24 = rv24[nombre]
+        yield f"{nombre} 2023", ESTILO_NUMERO, v23
+        yield f"{nombre} 2024", ESTILO_NUMERO, v24
+        yield f"{nombre} Cambio (abs)", ESTILO_NUMERO, v24 - v23
+        yield f"{nombre} Cambio (%)", ESTILO_PORCENTAJE, _div(v24 - v23, np.abs(v23)) * 100
+    yield "Situación 2023", ESTILO_TEXTO, situacion[clasificar_situacion_vectorizado(rv23)]
+    yield "Situación 2024", ESTILO_TEXTO, situacion[clasificar_situacion_vectorizado(rv24)]
+    alerta24 = puntuar_cartera(entradas_de_ratios(rv24))
+    yield "Z' 2023", ESTILO_NUMERO, puntuar_cartera(entradas_de_ratios(rv23))["Z"]
+    yield "Z' 2024", ESTILO_NUMERO, alerta24["Z"]
+    yield "Alerta (Z') 2024", ESTILO_TEXTO, etiquetas_alerta(alerta24["codigo"])
+    yield "CCE 2024 (días)", ESTILO_NUMERO, cce24
+    yield "Ciclo de caja 2024", ESTILO_TEXTO, np.array(ETIQUETAS_CCE, dtype=object)[codigo_cce24]
+    yield "Validación 2023", ESTILO_TEXTO, validacion[validar_tabla(b23)]
+    yield "Validación 2024", ESTILO_TEXTO, validacion[validar_tabla(b24)]
+
+def exportar_xlsx(destino, t23, t24, empresas=None, hoja="Matriz de ratios", bloque=BLOQUE_XLSX, nivel_compresion=1):
+    """
+    Escribe en `destino` (ruta o flujo binario) un .xlsx con una fila por empresa:
+    entradas 2023/2024, todos los ratios de REGISTRO_RATIOS con su cambio
+    absoluto y en %, situación patrimonial, ciclo de caja y códigos de
+    validación. Las tablas pueden traer NaN (conservar_ausentes=True): se
+    exportan como 'N/A' y se normalizan antes de calcular, como en abrir_cartera.
+    La hoja se genera y comprime por bloques de filas directamente dentro del
+    zip (sin cadenas compartidas), así que la memoria no crece con la cartera.
+    Devuelve el número de filas escritas.
+    """
+    n = len(t24["activo_corriente"])
+    if empresas is None:
+        empresas = t24.get("empresa")
+    if empresas is None:
+        empresas = np.array([f"Fila {j + 1}" for j in range(n)], dtype=object)
+    empresas = np.asarray(empresas, dtype=object)
+    cabecera = [(titulo, estilo) for titulo, estilo, _ in _columnas_xlsx(t23, t24, slice(0, 0), empresas)]
+    ultima = f"{_letra_columna(len(cabecera) - 1)}{n + 1}"
+    hoja = _XML_NO_VALIDO.sub("", hoja)[:31]
+    rango = "'{}'!$A$1:${}${}".format(hoja.replace("'", "''"), _letra_columna(len(cabecera) - 1), n + 1)
+    with zipfile.ZipFile(destino, "w", zipfile.ZIP_DEFLATED, compresslevel=nivel_compresion) as zf:
+        zf.writestr("[Content_Types].xml", _XLSX_TIPOS)
+        zf.writestr("_rels/.rels", _XLSX_RELS)
+        zf.writestr("xl/workbook.xml", _XLSX_LIBRO.format(hoja=escape(hoja, {'"': "&quot;"}), rango=escape(rango)))
+        zf.writestr("xl/_rels/workbook.xml.rels", _XLSX_LIBRO_RELS)
+        zf.writestr("xl/styles.xml", _XLSX_ESTILOS)
+        # Tamaño desconocido de antemano: Zip64 si la hoja puede pasar de 2 GB sin comprimir
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=n * len(cabecera) * 40 > 2**31) as f:
+            f.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                     '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                     f'<dimension ref="A1:{ultima}"/>'
+                     '<sheetViews><sheetView workbookViewId="0"><pane xSplit="1" ySplit="1" topLeftCell="B2" activePane="bottomRight" state="frozen"/></sheetView></sheetViews>'
+                     '<cols><col min="1" max="1" width="28" customWidth="1"/></cols><sheetData><row>').encode())
+            f.write("".join(f'<c t="inlineStr" s="{ESTILO_CABECERA}"><is><t>{_texto_xml(titulo)}</t></is></c>' for titulo, _ in cabecera).encode())
+            f.write(b"</row>")
+            plantilla = "<row>" + "".join(_CELDA_XLSX[estilo] for _, estilo in cabecera) + "</row>"
+            for ini in range(0, n, bloque):
+                memo = {}  # textos repetidos (etiquetas, códigos) se escapan una vez por bloque
+                columnas = [_valores_xlsx(v, estilo, memo)
+                            for _, estilo, v in _columnas_xlsx(t23, t24, slice(ini, min(ini + bloque, n)), empresas)]
+                texto = "".join([plantilla % fila for fila in zip(*columnas)])
+                # N/A como en fmt_num: los nan se sustituyen sobre el bloque ya formateado
+                for estilo in (ESTILO_NUMERO, ESTILO_PORCENTAJE):
+                    texto = texto.replace(f'<c s="{estilo}"><v>nan</v></c>', _XLSX_NA)
+                f.write(texto.encode())
+            f.write(f'</sheetData><autoFilter ref="A1:{ultima}"/></worksheet>'.encode())
+    return n
 
 # -----------------------------
-# INTERFAZ TKINTER (SIN CAMBIOS)
+# INTERFAZ TKINTER
 # -----------------------------
+class GrillaVirtual(ttk.Frame):
+    """
+    Tabla ttk.Treeview virtualizada: solo existen las filas visibles y al
+    desplazarse se reescriben sus valores, así que miles de filas no
+    bloquean la ventana. Clic en una cabecera ordena (np.argsort) por esa columna.
+    columnas: lista de (clave, titulo, ancho); los datos son {clave: array}.
+    """
+    def __init__(self, master, columnas, filas_visibles=20, formato=None, **kw):
+        super().__init__(master, **kw)
+        self.columnas = columnas
+        self.formato = formato or {}
+        self.filas_visibles = filas_visibles
+        self.datos = {}
+        self.n = 0
+        self.orden = np.arange(0)
+        self.offset = 0
+        self.orden_col = None; self.descendente = False
+        claves = [c[0] for c in columnas]
+        self.tree = ttk.Treeview(self, columns=claves, show="headings", height=filas_visibles, selectmode="browse")
+        for clave, titulo, ancho in columnas:
+            self.tree.heading(clave, text=titulo, command=lambda k=clave: self.ordenar(k))
+            self.tree.column(clave, width=ancho, anchor="e" if ancho < 200 else "w")
+        self.items = [self.tree.insert("", "end", values=()) for _ in range(filas_visibles)]
+        self.scroll = ttk.Scrollbar(self, orient="vertical", command=self._scroll)
+        self.tree.grid(row=0, column=0, sticky="nsew"); self.scroll.grid(row=0, column=1, sticky="ns")
+        self.rowconfigure(0, weight=1); self.columnconfigure(0, weight=1)
+        for ev in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.tree.bind(ev, self._rueda)
+        self.tree.bind("<Next>", lambda e: self._mover(self.filas_visibles) or "break")
+        self.tree.bind("<Prior>", lambda e: self._mover(-self.filas_visibles) or "break")
+
+    def cargar(self, datos):
+        """Reemplaza los datos ({clave: array de igual longitud})."""
+        self.datos = datos
+        self.n = len(next(iter(datos.values()))) if datos else 0
+        self.orden = np.arange(self.n)
+        if self.orden_col is not None:
+            self._aplicar_orden()
+        self.offset = 0
+        self._pintar()
+
+    def ordenar(self, clave):
+        self.descendente = (not self.descendente) if self.orden_col == clave else False
+        self.orden_col = clave
+        self._aplicar_orden(); self._pintar()
+
+    def _aplicar_orden(self):
+        col = self.datos.get(self.orden_col)
+        if col is None:
+            return
+        if col.dtype.kind in "fiu":
+            # Los NaN (N/A) siempre al final
+            col = col.astype(float)
+            clave = np.where(np.isnan(col), np.inf, -col if self.descendente else col)
+            self.orden = np.argsort(clave, kind="stable")
+        else:
+            self.orden = np.argsort(col.astype(str), kind="stable")
+            if self.descendente:
+                self.orden = self.orden[::-1]
+
+    def _celda(self, clave, v):
+        f = self.formato.get(clave)
+        if f is not None:
+            return f(v)
+        if isinstance(v, (float, np.floating)):
+            return fmt_num(None if np.isnan(v) else float(v))
+        return str(v)
+
+    def _pintar(self):
+        idx = self.orden[self.offset:self.offset + self.filas_visibles]
+        for pos, item in enumerate(self.items):
+            if pos < len(idx):
+                j = idx[pos]
+                self.tree.item(item, values=[self._celda(c[0], self.datos[c[0]][j]) for c in self.columnas])
+            else:
+                self.tree.item(item, values=())
+        if self.n:
+            self.scroll.set(self.offset / self.n, min(1.0, (self.offset + self.filas_visibles) / self.n))
+        else:
+            self.scroll.set(0.0, 1.0)
+
+    def _mover(self, filas):
+        nuevo = max(0, min(self.offset + filas, max(0, self.n - self.filas_visibles)))
+        if nuevo != self.offset:
+            self.offset = nuevo; self._pintar()
+
+    def _scroll(self, accion, valor, unidad=None):
+        if accion == "moveto":
+            self._mover(int(float(valor) * self.n) - self.offset)
+        elif accion == "scroll":
+            paso = self.filas_visibles if unidad == "pages" else 1
+            self._mover(int(valor) * paso)
+
+    def _rueda(self, event):
+        if getattr(event, "num", None) == 4 or getattr(event, "delta", 0) > 0:
+            self._mover(-3)
+        else:
+            self._mover(3)
+        return "break"
+
+class PanelResultados(ttk.Notebook):
+    """
+    Resultados en pestañas: una GrillaVirtual por sección (las filas se pintan
+    solo al verse), la matriz D1 y una pestaña de gráficos embebidos con
+    FigureCanvasTkAgg que se redibuja en el sitio en cada cálculo.
+    Las pestañas se crean la primera vez que se usan.
+    """
+    COLUMNAS_TEXTO = [("apartado", "Apartado", 260), ("detalle", "Detalle", 900)]
+
+    def __init__(self, master, filas_visibles=16, **kw):
+        super().__init__(master, **kw)
+        self.filas_visibles = filas_visibles
+        self.grillas = {}
+        self.figura = None; self.canvas = None
+
+    def _grilla(self, titulo, columnas):
+        g = self.grillas.get(titulo)
+        if g is None or g.columnas != columnas:
+            if g is not None:
+                self.forget(g); g.destroy()
+            g = GrillaVirtual(self, columnas, filas_visibles=self.filas_visibles)
+            self.add(g, text=titulo)
+            self.grillas[titulo] = g
+        return g
+
+    def mostrar_texto(self, secciones):
+        """secciones: {pestaña: [(apartado, línea), ...]}"""
+        for titulo, filas in secciones.items():
+            g = self._grilla(titulo, self.COLUMNAS_TEXTO)
+            g.cargar({"apartado": np.array([f[0] for f in filas], dtype=object),
+                      "detalle": np.array([f[1] for f in filas], dtype=object)})
+
+    def mostrar_tabla(self, titulo, columnas, datos):
+        """Tabla numérica/ordenable: columnas = [(clave, título, ancho)], datos = {clave: array}."""
+        self._grilla(titulo, columnas).cargar(datos)
+
+    def mostrar_cartera(self, rv, empresas, titulo="Cartera", validacion=None):
+        """Todos los ratios del registro para una cartera (salida de calcular_ratios_vectorizado)."""
+        claves = list(REGISTRO_RATIOS)
+        columnas = [("empresa", "Empresa", 220)] + [(k, k, 110) for k in claves]
+        datos = {"empresa": np.asarray(empresas, dtype=object)}
+        if validacion is not None:
+            columnas.insert(1, ("validacion", "Validación", 200)); datos["validacion"] = validacion
+        alerta = puntuar_cartera(entradas_de_ratios(rv))
+        columnas[1:1] = [("rango_z", "Rango riesgo", 90), ("z", "Z'", 80), ("alerta", "Alerta (Z')", 260)]
+        datos.update(rango_z=alerta["rango"], z=alerta["Z"], alerta=etiquetas_alerta(alerta["codigo"]))
+        datos.update({k: rv[k] for k in claves})
+        self.mostrar_tabla(titulo, columnas, datos)
+        self.select(self.grillas[titulo])
+
+    def mostrar_graficos(self, r23, r24):
+        if self.figura is None:
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            marco = ttk.Frame(self)
+            self.figura = Figure(figsize=(10, 3.6), dpi=90)
+            self.canvas = FigureCanvasTkAgg(self.figura, master=marco)
+            self.canvas.get_tk_widget().pack(fill="both", expand=True)
+            self.add(marco, text="Gráficos")
+        # Se reutilizan figura y canvas: solo se limpian y redibujan los ejes
+        self.figura.clear()
+        ax1, ax2 = self.figura.subplots(1, 2, gridspec_kw={"width_ratios": [3, 2]})
+        dibujar_comparativo(ax1, r23, r24)
+        dibujar_rat_rrp(ax2, r24)
+        ax2.tick_params(axis="x", labelsize=7)
+        self.figura.tight_layout()
+        self.canvas.draw_idle()
+
+    def limpiar(self):
+        for g in self.grillas.values():
+            g.cargar({})
+        if self.figura is not None:
+            self.figura.clear(); self.canvas.draw_idle()
+
+def secciones_desde_lineas(out):
+    """
+    Agrupa las líneas de App.mostrar en pestañas: '=== SECCIÓN X ... ===' abre
+    una pestaña y '=== A1. ... ===' fija el apartado de las líneas siguientes.
+    """
+    secciones = {}; pestaña = "General"; apartado = ""
+    for bloque in out:
+        for linea in bloque.split("\n"):
+            txt = linea.strip()
+            if not txt or set(txt) == {"="}:
+                continue
+            if txt.startswith("===") and txt.endswith("==="):
+                titulo = txt.strip("= ").strip()
+                if titulo.startswith("SECCIÓN"):
+                    pestaña = titulo.split(":")[0].title(); apartado = ""
+                else:
+                    apartado = titulo
+                continue
+            secciones.setdefault(pestaña, []).append((apartado, linea.rstrip()))
+    return secciones
+
 class App(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("Informe Financiero - Cuestionario Completo")
-        self.geometry("1000x750")
+        self.geometry("1500x800")
         frm = ttk.Frame(self, padding=10)
         frm.pack(fill="both", expand=True)
 
@@ -1027,18 +3748,45 @@ class App(tk.Tk):
             self.entries["2024"][key] = e2
             r += 1
 
+        # Moneda de los datos y conversión opcional (tipos de cambio / IPC) antes de calcular
+        conv_frame = ttk.Frame(frm)
+        conv_frame.grid(row=r, column=0, columnspan=4, sticky="w", pady=(8, 0))
+        monedas = sorted(SIMBOLOS_MONEDA)
+        ttk.Label(conv_frame, text="Moneda de los datos").grid(row=0, column=0, padx=(0, 4))
+        self.moneda = ttk.Combobox(conv_frame, values=monedas, width=6)
+        self.moneda.set(MONEDA_INFORME); self.moneda.grid(row=0, column=1)
+        ttk.Label(conv_frame, text="Informe en").grid(row=0, column=2, padx=(10, 4))
+        self.moneda_informe = ttk.Combobox(conv_frame, values=monedas, width=6)
+        self.moneda_informe.set(MONEDA_INFORME); self.moneda_informe.grid(row=0, column=3)
+        ttk.Button(conv_frame, text="Tipos de cambio (CSV)", command=self.cargar_tipos).grid(row=0, column=4, padx=(10, 0))
+        ttk.Button(conv_frame, text="IPC (CSV)", command=self.cargar_ipc).grid(row=0, column=5, padx=(6, 0))
+        self.estado_conversion = ttk.Label(conv_frame, text="Sin conversión")
+        self.estado_conversion.grid(row=0, column=6, padx=(10, 0))
+        self.tipos = None; self.ipc = None
+        r += 1
+
         btn_frame = ttk.Frame(frm)
         btn_frame.grid(row=r, column=0, columnspan=4, pady=12)
         ttk.Button(btn_frame, text="Calcular y mostrar (pantalla)", command=self.mostrar).grid(row=0, column=0, padx=6)
         ttk.Button(btn_frame, text="Generar PDF profesional", command=self.export_pdf).grid(row=0, column=1, padx=6)
         ttk.Button(btn_frame, text="Limpiar", command=self.limpiar).grid(row=0, column=2, padx=6)
-        ttk.Button(btn_frame, text="Salir", command=self.destroy).grid(row=0, column=3, padx=6)
+        ttk.Button(btn_frame, text="Abrir cartera (carpeta)", command=self.abrir_cartera).grid(row=0, column=3, padx=6)
+        ttk.Button(btn_frame, text="PDF rápido (borrador)", command=self.export_borrador).grid(row=0, column=4, padx=6)
+        ttk.Button(btn_frame, text="Exportar cartera (Excel)", command=self.export_cartera_xlsx).grid(row=0, column=5, padx=6)
+        ttk.Button(btn_frame, text="Salir", command=self.destroy).grid(row=0, column=6, padx=6)
+        ttk.Button(btn_frame, text="PDF consolidado (carpeta)", command=self.export_consolidado).grid(row=1, column=0, padx=6, pady=(6, 0))
+        ttk.Button(btn_frame, text="Monitor (movimientos CSV)", command=self.monitor_movimientos).grid(row=1, column=1, padx=6, pady=(6, 0))
+        ttk.Button(btn_frame, text="Informes frente al sector", command=self.export_comparativos).grid(row=1, column=2, padx=6, pady=(6, 0))
+        ttk.Button(btn_frame, text="Proyección (escenarios)", command=self.mostrar_proyeccion).grid(row=1, column=3, padx=6, pady=(6, 0))
+        self.borrador = None
 
-        self.output = tk.Text(frm, height=18, width=120, font=("Consolas",10))
-        self.output.grid(row=r+1, column=0, columnspan=4, pady=8)
+        self.output = PanelResultados(frm)
+        self.output.grid(row=0, column=4, rowspan=r+2, sticky="nsew", padx=(12, 0))
+        frm.columnconfigure(4, weight=1); frm.rowconfigure(r+1, weight=1)
 
     def leer_inputs(self):
         data = {"2023":{}, "2024":{}}
+        self.ilegibles = []
         for yr in ("2023","2024"):
             for key, ent in self.entries[yr].items():
                 txt = ent.get().strip()
@@ -1049,11 +3797,60 @@ class App(tk.Tk):
                         val = float(txt)
                     except:
                         val = None
+                        self.ilegibles.append(f"{key} ({yr}): '{txt}'")
                 data[yr][key] = val
         return data
 
-    def mostrar(self):
+    def _conversion(self):
+        return opciones_conversion(self.moneda.get().strip().upper(), self.tipos,
+                                   self.moneda_informe.get().strip().upper(), self.ipc)
+
+    def leer_inputs_convertidos(self):
+        """leer_inputs en la moneda del informe (y a precios constantes si hay IPC): (data, moneda) o (None, None)."""
         data = self.leer_inputs()
+        try:
+            conversion = self._conversion()
+        except ValueError as e:
+            messagebox.showerror("Conversión de moneda", str(e)); return None, None
+        return convertir_entrada(data, conversion)
+
+    def cargar_tipos(self):
+        ruta = filedialog.askopenfilename(title="Tipos de cambio (fecha,moneda,tasa)", filetypes=[("CSV","*.csv")])
+        if not ruta: return
+        try:
+            self.tipos = leer_tipos_cambio(ruta)
+        except Exception as e:
+            messagebox.showerror("Error al leer tipos de cambio", f"Ocurrió un error: {e}"); return
+        self._actualizar_estado_conversion()
+
+    def cargar_ipc(self):
+        ruta = filedialog.askopenfilename(title="IPC (fecha,indice)", filetypes=[("CSV","*.csv")])
+        if not ruta: return
+        try:
+            self.ipc = leer_ipc(ruta)
+        except Exception as e:
+            messagebox.showerror("Error al leer el IPC", f"Ocurrió un error: {e}"); return
+        self._actualizar_estado_conversion()
+
+    def _actualizar_estado_conversion(self):
+        partes = []
+        if self.tipos is not None: partes.append(f"tipos: {', '.join(self.tipos['claves'])}")
+        if self.ipc is not None: partes.append("precios constantes (IPC)")
+        self.estado_conversion.config(text="; ".join(partes) or "Sin conversión")
+
+    def confirmar_validacion(self, data):
+        """Avisa de valores ilegibles y errores de validar_inputs; devuelve False si el usuario cancela."""
+        descripcion = dict(CODIGOS_VALIDACION)
+        avisos = [f"No numérico, se ignora: {x}" for x in self.ilegibles]
+        for yr in ("2023", "2024"):
+            avisos += [f"{yr}: {codigo} - {descripcion[codigo]}" for codigo in validar_inputs(data[yr])]
+        if not avisos:
+            return True
+        return messagebox.askokcancel("Datos inconsistentes", "\n".join(avisos) + "\n\n¿Continuar igualmente?", icon="warning")
+
+    def mostrar(self):
+        data, _ = self.leer_inputs_convertidos()
+        if data is None or not self.confirmar_validacion(data): return
         r23 = calcular_ratios_from_inputs(data["2023"])
         r24 = calcular_ratios_from_inputs(data["2024"])
         out = []
@@ -1067,6 +3864,9 @@ class App(tk.Tk):
         out.append("\n=== A1. Fondo de Maniobra (FM) y Equilibrio Patrimonial ===")
         out.append(f"FM 2023: {fmt_num(fm23)} | FM 2024: {fmt_num(fm24)}")
         out.append(f"Tipo de equilibrio patrimonial (2024): **{equilibrio24}**")
+        alerta_z, alerta_etiqueta, alerta_detalle = generar_alerta_temprana(r23, r24)
+        out.append(f"Alerta temprana (Z'): {alerta_z} -> **{alerta_etiqueta}**")
+        out.append(f"  {alerta_detalle}")
 
         # A2. Análisis Vertical 2024
         av24, econo_str, finan_str = generar_analisis_vertical(r24)
@@ -1111,15 +3911,13 @@ class App(tk.Tk):
         
         # C1. Liquidez
         out.append("\n=== C1. Ratios de Liquidez (Corto Plazo) ===")
-        out.append(f"Liquidez General (AC/PC): **{fmt_num(r24.get('Liquidez General'))}** (óptimo 1.5-2.0)")
-        out.append(f"Razón de Tesorería (C+D/PC): **{fmt_num(r24.get('Tesorería'))}** (óptimo ~1.0)")
-        out.append(f"Disponibilidad (C/PC): **{fmt_num(r24.get('Disponibilidad'))}** (óptimo 0.2-0.3)")
+        for k, titulo in (("Liquidez General", "Liquidez General"), ("Tesorería", "Razón de Tesorería"), ("Disponibilidad", "Disponibilidad")):
+            out.append(f"{titulo} ({formula_corta(k)}): **{fmt_num(r24.get(k))}** ({REGISTRO_RATIOS[k]['optimo_texto']})")
 
         # C2. Solvencia
         out.append("\n=== C2. Ratios de Solvencia y Endeudamiento (Largo Plazo) ===")
-        out.append(f"Garantía (Activo/Pasivo): **{fmt_num(r24.get('Garantía'))}** (óptimo > 1.5)")
-        out.append(f"Autonomía (PN/Pasivo): **{fmt_num(r24.get('Autonomía'))}** (óptimo > 1.0)")
-        out.append(f"Calidad de la Deuda (PC/Pasivo): **{fmt_num(r24.get('Calidad Deuda'))}** (vigilancia si es > 0.6)")
+        for k, titulo in (("Garantía", "Garantía"), ("Autonomía", "Autonomía"), ("Calidad Deuda", "Calidad de la Deuda")):
+            out.append(f"{titulo} ({formula_corta(k)}): **{fmt_num(r24.get(k))}** ({REGISTRO_RATIOS[k]['optimo_texto']})")
 
         # C3. Rentabilidad (RAT vs RRP)
         RAT_val = (r24.get('RAT') or 0.0) * 100
@@ -1128,7 +3926,7 @@ class App(tk.Tk):
         out.append(f"Rentabilidad Económica (RAT): **{fmt_num(RAT_val)}%**")
         out.append(f"Rentabilidad Financiera (RRP): **{fmt_num(RRP_val)}%**")
         out.append(f"Análisis: {'RRP superior a RAT (Efecto Apalancamiento)' if RRP_val > RAT_val else 'RRP inferior o igual a RAT.'}")
-        # C4. (El gráfico es solo para PDF)
+        # C4. El gráfico se muestra en la pestaña "Gráficos"
 
         # C5. Apalancamiento Financiero
         apal = generar_analisis_apalancamiento(r24)
@@ -1155,22 +3953,181 @@ class App(tk.Tk):
         out.append(f"1. {recs['a) Liquidez']}. Cuantificación: {recs['a_cuantif']}")
         out.append(f"2. {recs['b) Rentabilidad']}. Cuantificación: {recs['b_cuantif']}")
         out.append(f"3. {recs['c) Eficiencia operativa']}. Cuantificación: {recs['c_cuantif']}")
+
+        # --- SECCIÓN E: DUPONT ---
+        out.append("\n" + "="*80); out.append("=== SECCIÓN E: DESCOMPOSICIÓN DUPONT DE LA RRP ==="); out.append("="*80)
+        out.append("\n=== E1. RRP = Margen Neto x Rotación Activo x Multiplicador Capital ===")
+        for fila in preparar_dupont(r23, r24)[1:]:
+            out.append(f"{fila[0]} ({fila[1]}): 2023={fila[2]} | 2024={fila[3]} | Aporte a la variación de RRP: {fila[4]}")
         
-        self.output.delete("1.0", tk.END); self.output.insert(tk.END, "\n".join(out))
+        self.output.mostrar_texto(secciones_desde_lineas(out))
+        claves_d1 = D1_KEYS
+        v23 = np.array([np.nan if r23.get(k) is None else r23.get(k) for k in claves_d1], dtype=float)
+        v24 = np.array([np.nan if r24.get(k) is None else r24.get(k) for k in claves_d1], dtype=float)
+        self.output.mostrar_tabla("Matriz D1", [("ratio", "Ratio", 200), ("v23", "2023", 110), ("v24", "2024", 110), ("abs", "Cambio (abs)", 110), ("pct", "Cambio (%)", 110)],
+                                  {"ratio": np.array(claves_d1, dtype=object), "v23": v23, "v24": v24, "abs": v24 - v23, "pct": _div(v24 - v23, np.abs(v23)) * 100})
+        self.output.mostrar_graficos(r23, r24)
+
+    def abrir_cartera(self):
+        """Calcula los ratios 2024 de todos los balances (.csv/.json) de una carpeta y los muestra en la pestaña Cartera."""
+        carpeta = filedialog.askdirectory(title="Carpeta con balances (.csv / .json)")
+        if not carpeta: return
+        rutas = sorted(os.path.join(carpeta, n) for n in os.listdir(carpeta) if n.lower().endswith((".csv", ".json")))
+        if not rutas:
+            messagebox.showinfo("Cartera", "La carpeta no contiene balances .csv o .json."); return
+        try:
+            conversion = self._conversion()
+            entradas = [convertir_entrada(leer_balance(ruta), conversion)[0]["2024"] for ruta in rutas]
+        except Exception as e:
+            messagebox.showerror("Error al leer la cartera", f"Ocurrió un error: {e}"); return
+        empresas = [os.path.splitext(os.path.basename(ruta))[0] for ruta in rutas]
+        t = tabla_desde_inputs(entradas, conservar_ausentes=True)
+        mascara = validar_tabla(t)
+        validacion = np.array([", ".join(codigos_de_mascara(m)) for m in mascara], dtype=object)
+        self.output.mostrar_cartera(calcular_ratios_vectorizado(normalizar_tabla(t)), empresas, validacion=validacion)
+
+    def export_cartera_xlsx(self):
+        """Matriz de ratios 2023 vs 2024 de todos los balances de una carpeta, en un .xlsx."""
+        carpeta = filedialog.askdirectory(title="Carpeta con balances (.csv / .json)")
+        if not carpeta: return
+        rutas = sorted(os.path.join(carpeta, n) for n in os.listdir(carpeta) if n.lower().endswith((".csv", ".json")))
+        if not rutas:
+            messagebox.showinfo("Cartera", "La carpeta no contiene balances .csv o .json."); return
+        file_path = filedialog.asksaveasfilename(defaultextension=".xlsx", initialfile="Matriz_Ratios_Cartera.xlsx", filetypes=[("Excel","*.xlsx")])
+        if not file_path: return
+        try:
+            conversion = self._conversion()
+            balances = [convertir_entrada(leer_balance(ruta), conversion)[0] for ruta in rutas]
+            empresas = [os.path.splitext(os.path.basename(ruta))[0] for ruta in rutas]
+            t23 = tabla_desde_inputs([b["2023"] for b in balances], conservar_ausentes=True)
+            t24 = tabla_desde_inputs([b["2024"] for b in balances], conservar_ausentes=True)
+            filas = exportar_xlsx(file_path, t23, t24, empresas)
+            messagebox.showinfo("Excel generado", f"{filas} empresas exportadas a:\n{file_path}")
+        except Exception as e:
+            messagebox.showerror("Error al exportar", f"Ocurrió un error: {e}")
+
+    def export_consolidado(self):
+        """Un solo informe del grupo con los balances de sus filiales (uno por archivo de la carpeta)."""
+        carpeta = filedialog.askdirectory(title="Carpeta con los balances de las filiales (.csv / .json)")
+        if not carpeta: return
+        rutas = sorted(os.path.join(carpeta, n) for n in os.listdir(carpeta) if n.lower().endswith((".csv", ".json")))
+        if not rutas:
+            messagebox.showinfo("Consolidado", "La carpeta no contiene balances .csv o .json."); return
+        file_path = filedialog.asksaveasfilename(defaultextension=".pdf", initialfile="Informe_Consolidado.pdf", filetypes=[("PDF files","*.pdf")])
+        if not file_path: return
+        try:
+            conversion = self._conversion()
+            convertidos = [convertir_entrada(leer_balance(ruta), conversion) for ruta in rutas]
+            balances = [b for b, _ in convertidos]; moneda = convertidos[0][1]
+            empresas = [os.path.splitext(os.path.basename(ruta))[0] for ruta in rutas]
+            t23 = tabla_desde_inputs([b["2023"] for b in balances], empresas)
+            t24 = tabla_desde_inputs([b["2024"] for b in balances], empresas)
+            generar_pdf_consolidado(t23, t24, filename=file_path, moneda=moneda)
+            messagebox.showinfo("PDF generado", f"Informe consolidado de {len(rutas)} filiales guardado en:\n{file_path}")
+        except Exception as e:
+            messagebox.showerror("Error al generar PDF", f"Ocurrió un error: {e}")
 
+    def mostrar_proyeccion(self):
+        """Proyección del balance 2024 en los escenarios por defecto: una fila por escenario y año."""
+        data, _ = self.leer_inputs_convertidos()
+        if data is None or not self.confirmar_validacion(data): return
+        proy = proyectar_balances(tabla_desde_inputs([data["2024"]]))
+        S = len(proy["escenarios"]); Y = len(proy["anios"])
+        plano = lambda a: np.asarray(a)[:, 0, :].reshape(-1)
+        q = proy["partidas"]
+        columnas = [("escenario", "Escenario", 110), ("anio", "Año", 60), ("ventas", "Ventas", 110), ("beneficio_neto", "Beneficio Neto", 110),
+                    ("caja", "Caja", 110), ("linea", "Línea de crédito", 110)] + [(k, k, 110) for k in ("Liquidez General", "Garantía", "RAT", "RRP")]
+        datos = {"escenario": np.repeat(np.array(proy["escenarios"], dtype=object), Y), "anio": np.tile(np.array(proy["anios"]), S),
+                 "ventas": plano(q["ventas"]), "beneficio_neto": plano(q["beneficio_neto"]), "caja": plano(q["caja"]),
+                 "linea": plano(proy["linea_credito"])}
+        datos.update({k: plano(proy["ratios"][k]) for k in ("Liquidez General", "Garantía", "RAT", "RRP")})
+        self.output.mostrar_tabla("Proyección", columnas, datos)
+        self.output.select(self.output.grillas["Proyección"])
+
+    def export_comparativos(self):
+        """Un PDF por empresa comparado con su sector: una subcarpeta por sector con sus balances."""
+        carpeta = filedialog.askdirectory(title="Carpeta con una subcarpeta de balances (.csv / .json) por sector")
+        if not carpeta: return
+        rutas = []; sector = []
+        for nombre in sorted(os.listdir(carpeta)):
+            sub = os.path.join(carpeta, nombre)
+            if os.path.isdir(sub):
+                archivos = sorted(n for n in os.listdir(sub) if n.lower().endswith((".csv", ".json")))
+                rutas += [os.path.join(sub, n) for n in archivos]; sector += [nombre] * len(archivos)
+        if not rutas:
+            messagebox.showinfo("Informes por sector", "No hay subcarpetas de sector con balances .csv o .json."); return
+        salida = filedialog.askdirectory(title="Carpeta donde guardar los informes")
+        if not salida: return
+        try:
+            conversion = self._conversion()
+            balances = [convertir_entrada(leer_balance(ruta), conversion)[0] for ruta in rutas]
+            empresas = [os.path.splitext(os.path.basename(ruta))[0] for ruta in rutas]
+            t23 = tabla_desde_inputs([b["2023"] for b in balances], empresas)
+            t24 = tabla_desde_inputs([b["2024"] for b in balances], empresas)
+            generadas = generar_informes_comparativos(t23, t24, sector, salida)
+            messagebox.showinfo("Informes generados", f"{len(generadas)} informes ({len(set(sector))} sectores) guardados en:\n{salida}")
+        except Exception as e:
+            messagebox.showerror("Error al generar informes", f"Ocurrió un error: {e}")
+
+    def monitor_movimientos(self):
+        """Reproduce un CSV de movimientos (marca,cuenta,importe) sobre el balance 2024 y muestra las alertas."""
+        data, _ = self.leer_inputs_convertidos()
+        if data is None or not self.confirmar_validacion(data): return
+        ruta = filedialog.askopenfilename(title="Movimientos (marca,cuenta,importe)", filetypes=[("CSV","*.csv")])
+        if not ruta: return
+        monitor = MonitorRatios(calcular_ratios_from_inputs(data["2024"]))
+        try:
+            eventos = reproducir_movimientos(ruta, monitor)
+        except Exception as e:
+            messagebox.showerror("Error al leer movimientos", f"Ocurrió un error: {e}"); return
+        alertas = monitor.alertas
+        columnas = [("marca", "Marca", 150), ("ratio", "Ratio", 140), ("valor", "Valor", 90), ("regla", "Regla", 260), ("estado", "Estado", 80)]
+        datos = {k: np.array([str(a[k]) for a in alertas], dtype=object) for k in ("marca", "ratio", "regla", "estado")}
+        datos["valor"] = np.array([np.nan if a["valor"] is None else a["valor"] for a in alertas], dtype=float)
+        self.output.mostrar_tabla("Monitor", columnas, datos)
+        self.output.select(self.output.grillas["Monitor"])
+        finales = "\n".join(f"{k}: {fmt_num(v)}" for k, v in monitor.ratios.items())
+        messagebox.showinfo("Monitor", f"{eventos} movimientos, {len(alertas)} cambios de estado de alerta.\n\nRatios al final:\n{finales}")
 
     def export_pdf(self):
-        data = self.leer_inputs()
+        data, moneda = self.leer_inputs_convertidos()
+        if data is None or not self.confirmar_validacion(data): return
         r23 = calcular_ratios_from_inputs(data["2023"])
         r24 = calcular_ratios_from_inputs(data["2024"])
         file_path = filedialog.asksaveasfilename(defaultextension=".pdf", initialfile="Informe_Financiero_Elegante.pdf", filetypes=[("PDF files","*.pdf")])
         if not file_path: return
         try:
-            generar_pdf_final(r23, r24, filename=file_path)
+            generar_pdf_final(r23, r24, filename=file_path, moneda=moneda)
             messagebox.showinfo("PDF generado", f"Informe guardado en:\n{file_path}")
         except Exception as e:
             messagebox.showerror("Error al generar PDF", f"Ocurrió un error: {e}")
 
+    def export_borrador(self):
+        """Borrador inmediato; la versión final lo reemplaza en el mismo archivo al terminar."""
+        data, moneda = self.leer_inputs_convertidos()
+        if data is None or not self.confirmar_validacion(data): return
+        r23 = calcular_ratios_from_inputs(data["2023"])
+        r24 = calcular_ratios_from_inputs(data["2024"])
+        file_path = filedialog.asksaveasfilename(defaultextension=".pdf", initialfile="Informe_Financiero_Borrador.pdf", filetypes=[("PDF files","*.pdf")])
+        if not file_path: return
+        if self.borrador is None:
+            self.borrador = InformeBorrador()
+        try:
+            self.borrador.generar(r23, r24, file_path, al_fallar=self._final_fallido, moneda=moneda)
+            messagebox.showinfo("Borrador generado", f"Borrador guardado en:\n{file_path}\nLa versión final lo reemplazará en unos segundos.")
+        except Exception as e:
+            messagebox.showerror("Error al generar PDF", f"Ocurrió un error: {e}")
+
+    def _final_fallido(self, ruta, error):
+        # Llega desde el hilo del executor: el aviso se muestra en el hilo de Tk
+        self.after(0, lambda: messagebox.showerror("Error en la versión final",
+                                                   f"No se pudo generar la versión final de:\n{ruta}\nSe conserva el borrador.\n\n{error}"))
+
+    def destroy(self):
+        if self.borrador is not None:
+            self.borrador.cerrar()
+        super().destroy()
+
     def limpiar(self):
         # Limpiar y re-insertar los valores por defecto del Balance
         datos_iniciales_reset = { 
@@ -1196,8 +4153,11 @@ class App(tk.Tk):
             for key, ent in self.entries[yr].items(): 
                 ent.delete(0, tk.END)
                 ent.insert(0, datos_iniciales_reset.get(key, {}).get(yr, "0"))
+        self.moneda.set(MONEDA_INFORME); self.moneda_informe.set(MONEDA_INFORME)
+        self.tipos = None; self.ipc = None
+        self._actualizar_estado_conversion()
                 
-        self.output.delete("1.0", tk.END)
+        self.output.limpiar()
 
 # -----------------------------
 # EJECUTAR
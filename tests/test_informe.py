@@ -0,0 +1,50 @@
+import io
+import datetime
+
+import panda
+
+BALANCE_2023 = {"activo_corriente": 2800, "activo_no_corriente": 1450, "pasivo_corriente": 550, "pasivo_no_corriente": 700,
+                "patrimonio_neto": 3000, "ventas": 1000, "costo_ventas": 400, "beneficio_neto": 300, "deudores": 1200,
+                "inventario": 300, "caja": 850, "i": 0.05, "gastos_financieros": 50,
+                "dias_inventario": 45, "dias_clientes": 60, "dias_proveedores": 30}
+BALANCE_2024 = {"activo_corriente": 3800, "activo_no_corriente": 1850, "pasivo_corriente": 1000, "pasivo_no_corriente": 1000,
+                "patrimonio_neto": 3650, "ventas": 1500, "costo_ventas": 600, "beneficio_neto": 500, "deudores": 1600,
+                "inventario": 500, "caja": 1100, "i": 0.05, "gastos_financieros": 60,
+                "dias_inventario": 45, "dias_clientes": 60, "dias_proveedores": 30}
+
+def _ratios(**cambios_2024):
+    return panda.calcular_ratios_from_inputs(BALANCE_2023), panda.calcular_ratios_from_inputs(dict(BALANCE_2024, **cambios_2024))
+
+def test_tablas_sin_pasivo_corriente():
+    r23, r24 = _ratios(pasivo_corriente=0, patrimonio_neto=4650)
+    assert r24["Liquidez General"] is None
+    b1 = panda.preparar_tablas(r23, r24)["B1"]
+    assert b1[1][2] == "N/A" and b1[1][3] == "Nivel N/A"
+
+def test_pdf_sin_pasivo_corriente(tmp_path):
+    r23, r24 = _ratios(pasivo_corriente=0, patrimonio_neto=4650)
+    ruta = tmp_path / "informe.pdf"
+    panda.generar_pdf_final(r23, r24, filename=str(ruta), fecha=datetime.date(2024, 12, 31))
+    assert ruta.read_bytes().startswith(b"%PDF")
+
+def _pdf(r23, r24, **opciones):
+    buf = io.BytesIO()
+    panda.generar_pdf_final(r23, r24, filename=buf, reproducible=True, **opciones)
+    return buf.getvalue()
+
+def test_pdf_reproducible_identico():
+    r23, r24 = _ratios()
+    fecha = datetime.date(2024, 12, 31)
+    primero = _pdf(r23, r24, fecha=fecha)
+    assert primero == _pdf(r23, r24, fecha=fecha)
+    assert _pdf(r23, r24, fecha=fecha, paleta=True) == _pdf(r23, r24, fecha=fecha, paleta=True)
+    assert primero != _pdf(r23, r24, fecha=datetime.date(2025, 1, 1))
+
+def test_pdf_cacheado_igual_al_reproducible(tmp_path):
+    r23, r24 = _ratios()
+    fecha = datetime.date(2024, 12, 31)
+    cache = tmp_path / "cache"
+    assert not panda.generar_pdf_cacheado(r23, r24, str(tmp_path / "a.pdf"), str(cache), fecha=fecha)
+    assert panda.generar_pdf_cacheado(r23, r24, str(tmp_path / "b.pdf"), str(cache), fecha=fecha)
+    esperado = _pdf(r23, r24, fecha=fecha)
+    assert (tmp_path / "a.pdf").read_bytes() == esperado == (tmp_path / "b.pdf").read_bytes()
@@ -0,0 +1,99 @@
+import math
+
+import numpy as np
+
+import panda
+
+CLAVES_BASE = ["Costo Deuda (i)", "Fondo Maniobra", "Fondo Maniobra Alternativo", "Liquidez General", "Tesorería",
+               "Disponibilidad", "Garantía", "Autonomía", "Calidad Deuda", "RAT", "RRP", "RRP Apalancada",
+               "Efecto Apalancamiento"]
+
+def _ratios_base(d):
+    """calcular_ratios_from_inputs escalar original, antes del registro compilado."""
+    def safe_div(a, b):
+        return a / b if b != 0 else None
+    v = lambda k: d.get(k) or 0.0
+    AC, ANC, PC, PNC, PN = v("activo_corriente"), v("activo_no_corriente"), v("pasivo_corriente"), v("pasivo_no_corriente"), v("patrimonio_neto")
+    Activo = AC + ANC; Pasivo = PC + PNC
+    r = {}
+    r["Costo Deuda (i)"] = i = safe_div(v("gastos_financieros"), Pasivo) if Pasivo != 0 else 0.0
+    r["Fondo Maniobra"] = AC - PC
+    r["Fondo Maniobra Alternativo"] = PN + PNC - ANC
+    r["Liquidez General"] = safe_div(AC, PC)
+    r["Tesorería"] = safe_div(v("caja") + v("deudores"), PC)
+    r["Disponibilidad"] = safe_div(v("caja"), PC)
+    r["Garantía"] = safe_div(Activo, Pasivo)
+    r["Autonomía"] = safe_div(PN, Pasivo)
+    r["Calidad Deuda"] = safe_div(PC, Pasivo)
+    r["RAT"] = safe_div(v("ventas") - v("costo_ventas"), Activo)
+    r["RRP"] = safe_div(v("beneficio_neto"), PN)
+    if PN != 0:
+        efecto = safe_div(Pasivo, PN) * ((r["RAT"] or 0.0) - i)
+        r["RRP Apalancada"] = (r["RAT"] or 0.0) + efecto
+        r["Efecto Apalancamiento"] = efecto
+    else:
+        r["RRP Apalancada"] = r["Efecto Apalancamiento"] = None
+    return r
+
+def _tabla(n, semilla=0):
+    rng = np.random.default_rng(semilla)
+    t = {k: rng.uniform(0.0, 1000.0, n) for k in panda.CAMPOS_ENTRADA}
+    t["i"] = rng.uniform(0.0, 0.2, n)
+    # Denominadores nulos y patrimonio negativo en parte de las filas
+    for k, paso in (("pasivo_corriente", 5), ("pasivo_no_corriente", 7), ("patrimonio_neto", 11), ("ventas", 13), ("activo_corriente", 17)):
+        t[k][::paso] = 0.0
+    t["pasivo_no_corriente"][::35] = 0.0; t["pasivo_corriente"][::35] = 0.0
+    t["patrimonio_neto"][3::19] *= -1
+    return t
+
+def _igual(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    return math.isclose(a, b, rel_tol=1e-12, abs_tol=1e-12)
+
+def test_paridad_con_calculo_escalar_original():
+    t = _tabla(300)
+    rv = panda.calcular_ratios_vectorizado(t)
+    for j in range(300):
+        d = panda.inputs_de_fila(t, j)
+        base = _ratios_base(d)
+        escalar = panda.calcular_ratios_from_inputs(d)
+        fila = panda.ratios_de_fila(rv, j)
+        for k in CLAVES_BASE:
+            assert _igual(escalar[k], base[k]), (j, k, escalar[k], base[k])
+            assert _igual(fila[k], base[k]), (j, k, fila[k], base[k])
+
+def test_paridad_con_entradas_ausentes():
+    d = {"activo_corriente": 3800, "pasivo_corriente": None, "patrimonio_neto": 0, "ventas": 1500, "caja": None}
+    base = _ratios_base(d)
+    r = panda.calcular_ratios_from_inputs(d)
+    for k in CLAVES_BASE:
+        assert _igual(r[k], base[k]), (k, r[k], base[k])
+
+def test_atribucion_dupont_suma_la_variacion():
+    rng = np.random.default_rng(1)
+    n = 1000
+    rv0 = {k: rng.uniform(-0.5, 3.0, n) for _, k in panda.FACTORES_DUPONT}
+    rv1 = {k: v * rng.uniform(0.5, 1.5, n) for k, v in rv0.items()}
+    at = panda.atribucion_dupont(rv0, rv1)
+    suma = at["margen"] + at["rotacion"] + at["apalancamiento"]
+    np.testing.assert_allclose(suma, at["RRP_final"] - at["RRP_inicial"], rtol=1e-12, atol=1e-12)
+
+def test_atribucion_dupont_reproduce_rrp():
+    t = _tabla(200, semilla=2)
+    rv0 = panda.calcular_ratios_vectorizado(t)
+    rv1 = panda.calcular_ratios_vectorizado({k: v * 1.1 if k == "beneficio_neto" else v for k, v in t.items()})
+    at = panda.atribucion_dupont(rv0, rv1)
+    definidas = np.isfinite(at["RRP_final"]) & np.isfinite(at["RRP_inicial"])
+    assert definidas.any()
+    np.testing.assert_allclose(at["RRP_final"][definidas], rv1["RRP"][definidas], rtol=1e-9)
+    suma = at["margen"] + at["rotacion"] + at["apalancamiento"]
+    np.testing.assert_allclose(suma[definidas], (at["RRP_final"] - at["RRP_inicial"])[definidas], rtol=1e-9, atol=1e-12)
+
+def test_proyeccion_cuadra():
+    t = _tabla(50, semilla=3)
+    t["patrimonio_neto"] = np.abs(t["patrimonio_neto"]) + 1.0
+    assert panda.verificar_proyeccion(t) == [3, 5, 10]
+    escenarios = {"Crisis": {"crecimiento_ventas": [-0.5, -0.2], "dias_clientes": 120.0, "reparto": 1.0},
+                  "Deuda": {"nueva_deuda_pct_ventas": 0.1, "amortizacion_deuda": 0.2}}
+    assert panda.verificar_proyeccion(t, horizontes=(1, 4), escenarios=escenarios) == [1, 4]
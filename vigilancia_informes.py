@@ -0,0 +1,307 @@
+# vigilancia_informes.py
+# Modo demonio: vigila una carpeta de balances (.csv / .json) y regenera
+# ratios y PDF solo de las empresas cuyo archivo cambió de contenido.
+#
+#   python vigilancia_informes.py ENTRADA SALIDA [--workers 4] [--espera 0.5] [--sondeo] [--reciclar 50] [--registro vigilancia.log]
+#       [--moneda ARS] [--tipos tipos.csv] [--moneda-informe BOB] [--ipc ipc.csv] [--cache CARPETA]
+import os
+import sys
+import time
+import json
+import errno
+import select
+import struct
+import hashlib
+import argparse
+import ctypes
+import ctypes.util
+import logging
+from collections import deque
+
+import panda
+
+EXTENSIONES = (".csv", ".json")
+ARCHIVO_ESTADO = ".hashes_vigilancia.json"
+ARCHIVO_METRICAS = "estado_vigilancia.json"
+log = logging.getLogger("panda.vigilancia")
+
+# -----------------------------
+# Fuentes de eventos (inotify / sondeo)
+# -----------------------------
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+_EVENTO = struct.Struct("iIII")
+
+def _es_balance(nombre):
+    return nombre.lower().endswith(EXTENSIONES) and not nombre.startswith(".")
+
+class FuenteInotify:
+    """Eventos de escritura terminada / renombrado en la carpeta (Linux, vía libc)."""
+    def __init__(self, carpeta):
+        nombre_libc = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not nombre_libc:
+            raise OSError(errno.ENOSYS, "inotify no disponible")
+        self.libc = ctypes.CDLL(nombre_libc, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falló")
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(carpeta), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch falló")
+        self.carpeta = carpeta
+        self.desbordado = False
+
+    def esperar(self, timeout):
+        """Nombres de archivo modificados (puede devolver vacío al vencer el timeout)."""
+        listos, _, _ = select.select([self.fd], [], [], timeout)
+        nombres = set()
+        if not listos:
+            return nombres
+        while True:
+            try:
+                buf = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(buf):
+                _, mask, _, largo = _EVENTO.unpack_from(buf, pos)
+                nombre = buf[pos + _EVENTO.size: pos + _EVENTO.size + largo].rstrip(b"\0").decode(errors="replace")
+                pos += _EVENTO.size + largo
+                if mask & IN_Q_OVERFLOW:
+                    self.desbordado = True
+                elif _es_balance(nombre):
+                    nombres.add(nombre)
+        if self.desbordado:
+            # La cola del kernel se llenó: se vuelve a listar todo (el hash evita trabajo de más)
+            self.desbordado = False
+            nombres.update(n for n in os.listdir(self.carpeta) if _es_balance(n))
+        return nombres
+
+    def cerrar(self):
+        os.close(self.fd)
+
+class FuenteSondeo:
+    """Alternativa portable: compara (mtime, tamaño) de cada archivo cada `intervalo` segundos."""
+    def __init__(self, carpeta, intervalo=1.0):
+        self.carpeta = carpeta
+        self.intervalo = intervalo
+        self.firmas = {}
+        self.ultimo = 0.0
+
+    def esperar(self, timeout):
+        restante = self.intervalo - (time.monotonic() - self.ultimo)
+        if restante > 0:
+            time.sleep(min(restante, timeout))
+            return set()
+        self.ultimo = time.monotonic()
+        nombres = set()
+        vistos = {}
+        with os.scandir(self.carpeta) as it:
+            for entrada in it:
+                if not (_es_balance(entrada.name) and entrada.is_file()):
+                    continue
+                st = entrada.stat()
+                vistos[entrada.name] = (st.st_mtime_ns, st.st_size)
+                if self.firmas.get(entrada.name) != vistos[entrada.name]:
+                    nombres.add(entrada.name)
+        self.firmas = vistos
+        return nombres
+
+    def cerrar(self):
+        pass
+
+# -----------------------------
+# Trabajo de cada empresa (se ejecuta en el pool)
+# -----------------------------
+def procesar_balance(ruta, salida, hash_anterior, conversion=None, firma_conversion=None, carpeta_cache=None):
+    """
+    Recalcula ratios y PDF de un archivo si su contenido (o la conversión
+    de moneda, ver panda.opciones_conversion) cambió. Con `carpeta_cache`
+    el PDF sale de panda.generar_pdf_cacheado. Devuelve (hash, regenerado).
+    """
+    with open(ruta, "rb") as f:
+        contenido = f.read()
+    h = hashlib.sha256(contenido)
+    if firma_conversion:
+        h.update(firma_conversion.encode())
+    h = h.hexdigest()
+    if h == hash_anterior:
+        return h, False
+    data, moneda = panda.convertir_entrada(panda.leer_balance(ruta), conversion)
+    r23 = panda.calcular_ratios_from_inputs(data["2023"])
+    r24 = panda.calcular_ratios_from_inputs(data["2024"])
+    base = os.path.join(salida, os.path.splitext(os.path.basename(ruta))[0])
+    validacion = {yr: panda.validar_inputs(data[yr]) for yr in ("2023", "2024")}
+    _escribir_json(base + ".ratios.json", {"2023": r23, "2024": r24, "validacion": validacion})
+    if carpeta_cache:
+        panda.generar_pdf_cacheado(r23, r24, base + ".pdf", carpeta_cache, moneda=moneda)
+    else:
+        panda.generar_pdf_final(r23, r24, filename=base + ".pdf", moneda=moneda)
+    return h, True
+
+def _escribir_json(ruta, datos):
+    tmp = ruta + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(datos, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, ruta)
+
+def _firma_conversion(conversion):
+    """Huella de la conversión para el hash de cada balance; None si no se convierte nada."""
+    if conversion["tipos"] is None and conversion["ipc"] is None and conversion["moneda"] == panda.MONEDA_INFORME:
+        return None
+    h = hashlib.sha256(json.dumps([conversion["moneda"], conversion["moneda_informe"], str(conversion["fecha_base"])]).encode())
+    for serie in (conversion["tipos"], conversion["ipc"]):
+        if serie is not None:
+            for k in ("claves", "llaves", "valores"):
+                h.update(serie[k].tobytes())
+    return h.hexdigest()
+
+# -----------------------------
+# Demonio
+# -----------------------------
+class VigilanteInformes:
+    def __init__(self, entrada, salida, workers=None, espera=0.5, sondeo=False, intervalo_metricas=1.0, reciclar=50, conversion=None, carpeta_cache=None):
+        self.entrada = entrada
+        self.salida = salida
+        self.workers = workers or os.cpu_count() or 1
+        self.espera = espera  # antirrebote: segundos sin escrituras antes de procesar
+        self.intervalo_metricas = intervalo_metricas
+        self.reciclar = reciclar     # informes por worker antes de reemplazarlo
+        self.conversion = conversion or panda.opciones_conversion()
+        self.firma_conversion = _firma_conversion(self.conversion)
+        self.carpeta_cache = carpeta_cache
+        os.makedirs(salida, exist_ok=True)
+        self.hashes = self._cargar_hashes()
+        self.fuente = None
+        if not sondeo:
+            try:
+                self.fuente = FuenteInotify(entrada)
+            except OSError:
+                self.fuente = None
+        if self.fuente is None:
+            self.fuente = FuenteSondeo(entrada)
+        self.ultima_escritura = {}   # nombre -> último evento (antirrebote)
+        self.llegada = {}            # nombre -> primer evento no atendido (latencia)
+        self.cola = deque()
+        self.encolados = set()
+        self.en_curso = {}           # future -> nombre
+        self.latencias = deque(maxlen=1000)
+        self.metricas = {"procesados": 0, "sin_cambios": 0, "errores": 0, "ultimo_error": None}
+        self.detenido = False
+
+    def _cargar_hashes(self):
+        try:
+            with open(os.path.join(self.salida, ARCHIVO_ESTADO), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _registrar(self, nombres, ahora):
+        for n in nombres:
+            self.ultima_escritura[n] = ahora
+            self.llegada.setdefault(n, ahora)
+
+    def _encolar_estables(self, ahora):
+        estables = [n for n, t in self.ultima_escritura.items() if ahora - t >= self.espera]
+        for n in estables:
+            del self.ultima_escritura[n]
+            if n not in self.encolados:
+                self.cola.append(n); self.encolados.add(n)
+
+    def _despachar(self, pool):
+        # Como máximo 2 trabajos por worker en vuelo; el resto espera en la cola
+        ocupados = set(self.en_curso.values())
+        pendientes = len(self.cola)
+        while self.cola and len(self.en_curso) < 2 * self.workers and pendientes:
+            pendientes -= 1
+            n = self.cola.popleft()
+            if n in ocupados:
+                self.cola.append(n)  # ya se procesa; se repetirá al terminar
+                continue
+            self.encolados.discard(n)
+            fut = pool.submit(procesar_balance, os.path.join(self.entrada, n), self.salida, self.hashes.get(n),
+                              self.conversion, self.firma_conversion, self.carpeta_cache)
+            self.en_curso[fut] = n
+            ocupados.add(n)
+
+    def _recoger(self):
+        cambios = False
+        for fut in [f for f in self.en_curso if f.done()]:
+            n = self.en_curso.pop(fut)
+            try:
+                h, regenerado = fut.result()
+            except Exception as e:
+                self.metricas["errores"] += 1
+                self.metricas["ultimo_error"] = f"{n}: {e}"
+                log.warning("balance fallido", extra={"archivo": n, "error": f"{type(e).__name__}: {e}"})
+            else:
+                self.hashes[n] = h; cambios = True
+                self.metricas["procesados" if regenerado else "sin_cambios"] += 1
+            if n not in self.ultima_escritura and n not in self.encolados:
+                llegada = self.llegada.pop(n, None)
+                if llegada is not None:
+                    self.latencias.append(time.monotonic() - llegada)
+        if cambios:
+            _escribir_json(os.path.join(self.salida, ARCHIVO_ESTADO), self.hashes)
+
+    def _escribir_metricas(self):
+        lat = sorted(self.latencias)
+        datos = dict(self.metricas,
+                     fuente=type(self.fuente).__name__,
+                     en_cola=len(self.cola) + len(self.ultima_escritura),
+                     en_curso=len(self.en_curso),
+                     latencia_media_s=(sum(lat) / len(lat)) if lat else None,
+                     latencia_p95_s=lat[int(0.95 * (len(lat) - 1))] if lat else None,
+                     actualizado=time.time())
+        _escribir_json(os.path.join(self.salida, ARCHIVO_METRICAS), datos)
+
+    def ejecutar(self):
+        """Bucle principal; termina con Ctrl+C o poniendo `detenido = True`."""
+        inicial = {n for n in os.listdir(self.entrada) if _es_balance(n)}
+        self._registrar(inicial, time.monotonic() - self.espera)
+        ultima_metrica = 0.0
+        # Workers con matplotlib/ReportLab ya cargados: el primer informe no paga el arranque
+        with panda.crear_pool_precalentado(self.workers, trabajos_por_worker=self.reciclar) as pool:
+            try:
+                while not self.detenido:
+                    hay_trabajo = self.cola or self.en_curso or self.ultima_escritura
+                    nombres = self.fuente.esperar(0.05 if hay_trabajo else 0.5)
+                    ahora = time.monotonic()
+                    self._registrar(nombres, ahora)
+                    self._encolar_estables(ahora)
+                    self._recoger()
+                    self._despachar(pool)
+                    if ahora - ultima_metrica >= self.intervalo_metricas:
+                        self._escribir_metricas(); ultima_metrica = ahora
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.fuente.cerrar()
+                self._escribir_metricas()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Regenera informes al cambiar los balances de una carpeta.")
+    ap.add_argument("entrada"); ap.add_argument("salida")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--espera", type=float, default=0.5, help="segundos de antirrebote")
+    ap.add_argument("--sondeo", action="store_true", help="forzar sondeo en lugar de inotify")
+    ap.add_argument("--reciclar", type=int, default=50, help="informes por worker antes de reemplazarlo")
+    ap.add_argument("--registro", default=None, help="archivo de diagnóstico JSON (ver panda.configurar_registro)")
+    ap.add_argument("--moneda", default=panda.MONEDA_INFORME, help="moneda de los balances de entrada")
+    ap.add_argument("--tipos", default=None, help="CSV fecha,moneda,tasa para pasar a --moneda-informe")
+    ap.add_argument("--moneda-informe", default=panda.MONEDA_INFORME, help="moneda de los informes (requiere --tipos)")
+    ap.add_argument("--ipc", default=None, help="CSV fecha,indice para expresar los importes a precios constantes")
+    ap.add_argument("--cache", default=None, help="carpeta de PDF por hash de entradas (ver panda.generar_pdf_cacheado)")
+    args = ap.parse_args()
+    if args.registro:
+        panda.configurar_registro(args.registro)
+    try:
+        conversion = panda.opciones_conversion(args.moneda.upper(), args.tipos, args.moneda_informe.upper(), args.ipc)
+    except (OSError, ValueError) as e:
+        ap.error(str(e))
+    VigilanteInformes(args.entrada, args.salida, workers=args.workers, espera=args.espera, sondeo=args.sondeo, reciclar=args.reciclar,
+                      conversion=conversion, carpeta_cache=args.cache).ejecutar()